@@ -0,0 +1,121 @@
+from datetime import date
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+from layout import readCalendars
+
+class CalendarCube(NamedTuple):
+    """Calendar documents as participant x day x task boolean arrays"""
+    uids: list
+    days: np.ndarray
+    tasks: list
+    scheduled: np.ndarray
+    completed: np.ndarray
+
+def loadCalendars(db, uids: list) -> dict:
+    """Read many participants' calendars with batched get_all calls, in either storage layout"""
+    return readCalendars(db, uids)
+
+def calendarFrame(calendars: dict) -> pd.DataFrame:
+    """Flatten uid -> Calendar documents into one row per participant, day and task"""
+    records = [
+        (uid, day, task, bool(status.get("Completed", False)))
+        for uid, calendar in calendars.items()
+        for day, tasks in (calendar or {}).items()
+        for task, status in tasks.items()
+        if isinstance(status, dict)
+    ]
+    frame = pd.DataFrame.from_records(records, columns=["uid", "date", "task", "completed"])
+    frame["date"] = pd.to_datetime(frame["date"])
+    return frame
+
+def calendarCube(calendars: dict) -> CalendarCube:
+    """Scatter the flattened calendars into dense participant x day x task arrays"""
+    frame = calendarFrame(calendars)
+    uids = list(calendars)
+    days = np.sort(frame["date"].unique()).astype("datetime64[D]")
+    tasks = sorted(frame["task"].unique())
+
+    p = pd.Categorical(frame["uid"], categories=uids).codes
+    d = np.searchsorted(days, frame["date"].to_numpy().astype("datetime64[D]"))
+    t = pd.Categorical(frame["task"], categories=tasks).codes
+
+    shape = (len(uids), len(days), len(tasks))
+    scheduled = np.zeros(shape, dtype=bool)
+    completed = np.zeros(shape, dtype=bool)
+    scheduled[p, d, t] = True
+    completed[p, d, t] = frame["completed"].to_numpy()
+    return CalendarCube(uids, days, tasks, scheduled, completed)
+
+def dueBefore(cube: CalendarCube, asOf: date = None) -> CalendarCube:
+    """Restrict a cube to the days before asOf (defaults to today)"""
+    keep = cube.days < np.datetime64(asOf or date.today(), "D")
+    return cube._replace(days=cube.days[keep], scheduled=cube.scheduled[:, keep],
+                         completed=cube.completed[:, keep])
+
+def _percent(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / denominator * 100, np.nan)
+
+def adherenceTable(cube: CalendarCube) -> pd.DataFrame:
+    """Percentage of completed tasks per participant and task in a cube"""
+    table = pd.DataFrame(
+        _percent(cube.completed.sum(axis=1), cube.scheduled.sum(axis=1)),
+        index=pd.Index(cube.uids, name="uid"), columns=cube.tasks)
+    table["Overall"] = _percent(cube.completed.sum(axis=(1, 2)), cube.scheduled.sum(axis=(1, 2)))
+    return table.round(1)
+
+def adherence(calendars: dict, asOf: date = None) -> pd.DataFrame:
+    """Percentage of completed tasks per participant and task over the days before asOf"""
+    return adherenceTable(dueBefore(calendarCube(calendars), asOf)).dropna(axis=1, how="all")
+
+def cohortAdherence(cube: CalendarCube) -> pd.Series:
+    """Percentage of completed tasks per task across the whole cohort"""
+    series = pd.Series(_percent(cube.completed.sum(axis=(0, 1)), cube.scheduled.sum(axis=(0, 1))),
+                       index=cube.tasks)
+    series["Overall"] = float(_percent(cube.completed.sum(), cube.scheduled.sum()))
+    return series.round(1)
+
+def streaks(cube: CalendarCube) -> pd.DataFrame:
+    """Current and longest runs of fully completed study days per participant
+
+    Days that are not in a participant's calendar (removed or outside the study)
+    neither extend nor break a streak.
+    """
+    studyDay = cube.scheduled.any(axis=2)
+    fullDay = studyDay & (cube.completed == cube.scheduled).all(axis=2)
+    missed = studyDay & ~fullDay
+
+    completedSoFar = np.cumsum(fullDay, axis=1)
+    atLastMiss = np.maximum.accumulate(np.where(missed, completedSoFar, 0), axis=1)
+    run = completedSoFar - atLastMiss
+
+    empty = run.shape[1] == 0
+    return pd.DataFrame({
+        "current streak": np.zeros(len(cube.uids), dtype=int) if empty else run[:, -1],
+        "longest streak": np.zeros(len(cube.uids), dtype=int) if empty else run.max(axis=1),
+    }, index=pd.Index(cube.uids, name="uid"))
+
+def missedWindows(cube: CalendarCube, minDays: int = 3) -> pd.DataFrame:
+    """Runs of at least minDays consecutive study days with no task completed"""
+    missed = cube.scheduled.any(axis=2) & ~cube.completed.any(axis=2)
+    padded = np.pad(missed.astype(np.int8), ((0, 0), (1, 1)))
+    edges = np.diff(padded, axis=1)
+    startP, startD = np.nonzero(edges == 1)
+    _, endD = np.nonzero(edges == -1)
+
+    lengths = endD - startD
+    keep = lengths >= minDays
+    return pd.DataFrame({
+        "uid": np.asarray(cube.uids, dtype=object)[startP[keep]],
+        "start": cube.days[startD[keep]],
+        "end": cube.days[endD[keep] - 1],
+        "days": lengths[keep],
+    })
+
+def cohortReport(calendars: dict, asOf: date = None) -> pd.DataFrame:
+    """Adherence, streaks and missed study days per participant in one table"""
+    cube = dueBefore(calendarCube(calendars), asOf)
+    table = adherenceTable(cube).join(streaks(cube))
+    table["missed days"] = (cube.scheduled.any(axis=2) & ~cube.completed.any(axis=2)).sum(axis=1)
+    return table
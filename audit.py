@@ -0,0 +1,446 @@
+import atexit
+import contextvars
+import getpass
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, time as dtime, timedelta, timezone
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from backend import firestore, auth
+from identity import getUserByEmail
+from layout import changesByDay
+from schedule import NZ_TIMEZONE
+
+# Every onboarding and study modification appends an entry (who, which participant, the
+# date range and the Calendar diff) to an in-process buffer; a background thread writes
+# the buffer out in batches, so an operation never waits on its audit write. Entries go
+# to the AUDIT_COLLECTION collection (create-only, a batch per flush) or, with
+# DIGIPREDICT_AUDIT_SINK=jsonl, to append-only JSONL segment files under
+# DIGIPREDICT_AUDIT_DIR. A flush that fails transiently keeps its entries buffered and is
+# retried with backoff; one the sink rejects is split in half until the offending entries
+# are isolated, and those are set aside in REJECTED_DIR instead of blocking the buffer.
+# Whatever is still buffered is flushed when the process exits.
+AUDIT_SINK_ENV = "DIGIPREDICT_AUDIT_SINK"
+AUDIT_DIR_ENV = "DIGIPREDICT_AUDIT_DIR"
+FIRESTORE_SINK = "firestore"
+JSONL_SINK = "jsonl"
+AUDIT_COLLECTION = "auditLog"
+DEFAULT_AUDIT_DIR = "audit"
+REJECTED_DIR = "rejected"
+FLUSH_INTERVAL = 2
+MAX_FLUSH_DELAY = 60
+# Firestore accepts at most 500 writes and 10 MiB per commit
+FLUSH_BATCH = 500
+FLUSH_BYTES = 8 * 1024 * 1024
+SEGMENT_BYTES = 8 * 1024 * 1024
+# Diffs larger than this are recorded as day counts so an entry stays well under 1 MiB
+MAX_DIFF_BYTES = 256 * 1024
+QUERY_LIMIT = 1000
+# Sink errors retrying the same write cannot fix, matched by class name so both backends are covered
+PERMANENT_ERRORS = {"InvalidArgument", "ValueError", "TypeError", "FailedPrecondition"}
+
+ONBOARD = "onboard"
+MODIFY = "modify"
+APPLIED = "applied"
+DEFERRED = "deferred"
+FAILED = "failed"
+
+_actor = contextvars.ContextVar("actor", default=None)
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def actingAs(actor: str):
+    """Attribute the operations recorded inside the block to `actor`"""
+    token = _actor.set(actor)
+    try:
+        yield
+    finally:
+        _actor.reset(token)
+
+def currentActor() -> str:
+    """The clinician logged into this session, or the OS user running a CLI"""
+    actor = _actor.get()
+    if actor:
+        return actor
+    if get_script_run_ctx() is not None:
+        return st.session_state.get("username") or "portal"
+    try:
+        return f"cli:{getpass.getuser()}"
+    except (KeyError, OSError):
+        return "cli"
+
+def bindActor(step):
+    """`step` run as the current actor from whichever thread ends up calling it"""
+    actor = currentActor()
+    def run(*args, **kwargs):
+        with actingAs(actor):
+            return step(*args, **kwargs)
+    return run
+
+def calendarDiff(current: dict, fields: dict) -> dict:
+    """Days a Calendar change removes, adds and updates, with the tasks before and after"""
+    diff = {"removed": {}, "added": {}, "updated": {}}
+    for day, tasks in sorted(changesByDay(fields).items()):
+        if tasks is firestore.DELETE_FIELD:
+            diff["removed"][day] = current.get(day)
+        elif day in current:
+            diff["updated"][day] = {"before": current[day], "after": current[day] | tasks}
+        else:
+            diff["added"][day] = tasks
+    return diff
+
+def _boundedDiff(diff: dict) -> dict:
+    if len(json.dumps(diff, default=str)) <= MAX_DIFF_BYTES:
+        return diff
+    return {"truncated": True} | {key: sorted(days) for key, days in diff.items() if isinstance(days, dict)}
+
+def auditEntry(action: str, uid: str, email: str = None, start: str = None, end: str = None,
+               diff: dict = None, outcome: str = APPLIED, actor: str = None, **details) -> dict:
+    """start and end are the YYYY-MM-DD bounds of the days the operation touched"""
+    return {"id": uuid.uuid4().hex, "at": datetime.now(timezone.utc), "actor": actor or currentActor(),
+            "action": action, "uid": uid, "email": (email or "").lower() or None, "start": start, "end": end,
+            "outcome": outcome, "diff": _boundedDiff(diff or {}), "details": details}
+
+def _isAlreadyExists(error: Exception) -> bool:
+    return any(cls.__name__ == "AlreadyExists" for cls in type(error).__mro__)
+
+class FirestoreSink:
+    """Entries as documents of AUDIT_COLLECTION, keyed by entry id"""
+    name = FIRESTORE_SINK
+
+    def write(self, entries: list):
+        db = firestore.client()
+        batch = db.batch()
+        for entry in entries:
+            batch.create(db.collection(AUDIT_COLLECTION).document(entry["id"]), entry)
+        try:
+            batch.commit()
+        except Exception as e:
+            if not _isAlreadyExists(e):
+                raise
+            # An earlier attempt committed some of these (its response was lost), the batch
+            # may also hold newer entries, so they are created one at a time
+            for entry in entries:
+                try:
+                    db.collection(AUDIT_COLLECTION).document(entry["id"]).create(entry)
+                except Exception as e:
+                    if not _isAlreadyExists(e):
+                        raise
+
+    def query(self, uid: str = None, since: datetime = None, until: datetime = None,
+              limit: int = QUERY_LIMIT) -> list:
+        query = firestore.client().collection(AUDIT_COLLECTION)
+        for field, op, value in [("uid", "==", uid), ("at", ">=", since), ("at", "<", until)]:
+            if value is not None:
+                query = query.where(filter=firestore.FieldFilter(field, op, value))
+        query = query.order_by("at", direction=firestore.Query.DESCENDING).limit(limit)
+        return [snapshot.to_dict() for snapshot in query.get()]
+
+class JsonlSink:
+    """Entries as lines of segment files named after the time of their first entry"""
+    name = JSONL_SINK
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._segment = None
+
+    def write(self, entries: list):
+        os.makedirs(self.directory, exist_ok=True)
+        if self._segment is None or not os.path.exists(self._segment) or os.path.getsize(self._segment) > SEGMENT_BYTES:
+            first = entries[0]["at"].strftime("%Y%m%dT%H%M%S")
+            self._segment = os.path.join(self.directory, f"audit-{first}-{os.getpid()}-{uuid.uuid4().hex[:6]}.jsonl")
+        lines = "".join(json.dumps(entry | {"at": entry["at"].isoformat()}, default=str) + "\n" for entry in entries)
+        with open(self._segment, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def segments(self, since: datetime = None, until: datetime = None) -> list:
+        """Segment files that can hold entries in the range, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        paths = []
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("audit-") and name.endswith(".jsonl")):
+                continue
+            path = os.path.join(self.directory, name)
+            first = datetime.strptime(name.split("-")[1], "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+            if (until and first >= until) or (since and os.path.getmtime(path) < since.timestamp()):
+                continue
+            paths.append(path)
+        return paths
+
+    def query(self, uid: str = None, since: datetime = None, until: datetime = None,
+              limit: int = QUERY_LIMIT) -> list:
+        entries = []
+        for path in self.segments(since, until):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    entry["at"] = datetime.fromisoformat(entry["at"])
+                    if _matches(entry, uid, since, until):
+                        entries.append(entry)
+        return sorted(entries, key=lambda entry: entry["at"], reverse=True)[:limit]
+
+def _matches(entry: dict, uid: str = None, since: datetime = None, until: datetime = None) -> bool:
+    return ((uid is None or entry["uid"] == uid) and (since is None or entry["at"] >= since)
+            and (until is None or entry["at"] < until))
+
+def isPermanent(error: Exception) -> bool:
+    return any(cls.__name__ in PERMANENT_ERRORS for cls in type(error).__mro__)
+
+def entrySize(entry: dict) -> int:
+    return len(json.dumps(entry, default=str))
+
+class AuditLog:
+    """Buffer of entries not yet written and the thread flushing it to a sink"""
+    def __init__(self, sink, rejected=None):
+        self.sink = sink
+        self.rejectedSink = rejected
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flushLock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.rejected = 0
+        self.unwritten = []
+        self.lastError = None
+
+    def record(self, entry: dict):
+        """Buffer an entry, returns immediately"""
+        with self._lock:
+            self._pending.append(entry)
+            full = len(self._pending) >= FLUSH_BATCH
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="audit-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def _takeBatch(self) -> list:
+        """The oldest buffered entries fitting in one write, by count and serialized size"""
+        with self._lock:
+            size, count = 0, 0
+            for entry in self._pending[:FLUSH_BATCH]:
+                size += entrySize(entry)
+                if count and size > FLUSH_BYTES:
+                    break
+                count += 1
+            entries, self._pending = self._pending[:count], self._pending[count:]
+        return entries
+
+    def _write(self, entries: list, done: list):
+        """Write a batch, halving it on errors the sink will keep returning for it
+
+        Entries written or set aside are appended to `done`, so a transient failure part
+        way through only leaves the rest to be retried.
+        """
+        try:
+            self.sink.write(entries)
+        except Exception as e:
+            if not isPermanent(e):
+                raise
+            if len(entries) > 1:
+                middle = len(entries) // 2
+                self._write(entries[:middle], done)
+                self._write(entries[middle:], done)
+            else:
+                self._reject(entries[0], e)
+                done.append(entries[0])
+            return
+        self.written += len(entries)
+        done.extend(entries)
+
+    def _reject(self, entry: dict, error: Exception):
+        self.rejected += 1
+        logger.error("audit entry %s rejected by the %s sink: %s", entry["id"], self.sink.name, error)
+        try:
+            if self.rejectedSink is None:
+                raise RuntimeError("no sink for rejected entries")
+            self.rejectedSink.write([entry | {"error": f"{type(error).__name__}: {error}"}])
+        except Exception as e:
+            # Kept in memory so the entry still shows on the Audit Log page
+            logger.error("audit entry %s could not be set aside: %s", entry["id"], e)
+            with self._lock:
+                self.unwritten.append(entry)
+
+    def flush(self) -> int:
+        """Write out everything buffered, returns the number of entries written"""
+        with self._flushLock:
+            before = self.written
+            while True:
+                entries = self._takeBatch()
+                if not entries:
+                    return self.written - before
+                done = []
+                try:
+                    self._write(entries, done)
+                except Exception as e:
+                    ids = {entry["id"] for entry in done}
+                    with self._lock:
+                        self._pending[:0] = [entry for entry in entries if entry["id"] not in ids]
+                    self.lastError = f"{type(e).__name__}: {e}"
+                    raise
+                self.lastError = None
+
+    def _loop(self):
+        delay = FLUSH_INTERVAL
+        while True:
+            self._wake.wait(delay)
+            self._wake.clear()
+            try:
+                self.flush()
+                delay = FLUSH_INTERVAL
+            except Exception:
+                delay = min(MAX_FLUSH_DELAY, delay * 2)
+
+    def pending(self) -> list:
+        with self._lock:
+            return self._pending + self.unwritten
+
+    def query(self, uid: str = None, since: datetime = None, until: datetime = None,
+              limit: int = QUERY_LIMIT) -> list:
+        """Newest matching entries first, including those still waiting to be flushed"""
+        stored = self.sink.query(uid, since, until, limit)
+        ids = {entry["id"] for entry in stored}
+        buffered = [entry for entry in self.pending() if entry["id"] not in ids and _matches(entry, uid, since, until)]
+        return sorted(stored + buffered, key=lambda entry: entry["at"], reverse=True)[:limit]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sink": self.sink.name, "pending": len(self._pending), "written": self.written,
+                    "rejected": self.rejected, "last_error": self.lastError}
+
+def _safeFlush(log: AuditLog):
+    try:
+        log.flush()
+    except Exception as e:
+        logger.error("audit: %d entries not written at exit: %s", len(log.pending()), e)
+
+_log = None
+_logLock = threading.Lock()
+
+def auditLog() -> AuditLog:
+    """The process-wide audit log, flushed in the background and once more at exit"""
+    global _log
+    with _logLock:
+        if _log is None:
+            if os.environ.get(AUDIT_SINK_ENV, FIRESTORE_SINK) == JSONL_SINK:
+                sink = JsonlSink(os.environ.get(AUDIT_DIR_ENV, DEFAULT_AUDIT_DIR))
+            else:
+                sink = FirestoreSink()
+            directory = os.environ.get(AUDIT_DIR_ENV, DEFAULT_AUDIT_DIR)
+            _log = AuditLog(sink, JsonlSink(os.path.join(directory, REJECTED_DIR)))
+            atexit.register(_safeFlush, _log)
+        return _log
+
+def record(action: str, uid: str, **fields):
+    """Append an entry for an operation on a participant, see auditEntry for the fields"""
+    auditLog().record(auditEntry(action, uid, **fields))
+
+def recordCalendarChange(plan: dict, outcome: str = APPLIED, email: str = None, **details):
+    """Append the entry of a planned Calendar change (see modify.planCalendarChanges)"""
+    days = sorted(changesByDay(plan["fields"]))
+    record(MODIFY, plan["uid"], email=email or plan.get("email"), start=days[0] if days else None,
+           end=days[-1] if days else None, diff=calendarDiff(plan["current"], plan["fields"]),
+           outcome=outcome, **details)
+
+def calendarSummary(calendar: dict) -> dict:
+    """Number of days and of days scheduling each task, for entries about a whole new Calendar"""
+    tasks = {}
+    for day in calendar.values():
+        for task in day or {}:
+            tasks[task] = tasks.get(task, 0) + 1
+    return {"days": len(calendar), "tasks": dict(sorted(tasks.items()))}
+
+def recordOnboarding(uid: str, email: str, documents: dict, outcome: str = APPLIED, **details):
+    """Append the entry of a participant onboarded with `documents`, summarising their Calendar"""
+    calendar = documents.get("Calendar", {})
+    days = sorted(calendar)
+    record(ONBOARD, uid, email=email, start=days[0] if days else None, end=days[-1] if days else None,
+           diff={"created": calendarSummary(calendar)}, outcome=outcome, documents=sorted(documents), **details)
+
+def localRange(startDate: date, endDate: date) -> tuple:
+    """UTC bounds of whole NZ days from startDate to endDate inclusive"""
+    since = datetime.combine(startDate, dtime.min, NZ_TIMEZONE)
+    until = datetime.combine(endDate + timedelta(days=1), dtime.min, NZ_TIMEZONE)
+    return since.astimezone(timezone.utc), until.astimezone(timezone.utc)
+
+def entryFrame(entries: list):
+    """One row per entry with day counts instead of the diff"""
+    # Imported here so the pages recording entries do not load pandas
+    import pandas as pd
+    columns = ["at", "actor", "action", "email", "uid", "start", "end", "outcome",
+               "removed", "added", "updated", "id"]
+    rows = []
+    for entry in entries:
+        diff = entry.get("diff") or {}
+        rows.append({key: entry.get(key) for key in columns} |
+                    {"at": entry["at"].astimezone(NZ_TIMEZONE)} |
+                    {key: len(diff.get(key) or ()) for key in ("removed", "added", "updated")} |
+                    ({"added": diff["created"].get("days", 0)} if "created" in diff else {}))
+    return pd.DataFrame(rows, columns=columns)
+
+def main():
+    # server imports this module to record onboardings, so the shared check is imported here
+    from server import check_auth_and_redirect
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Audit Log")
+    log = auditLog()
+    stats = log.stats()
+    st.caption(f"Stored in {stats['sink']}, {stats['pending']} entries waiting to be written")
+    if stats["last_error"]:
+        st.warning(f"Last flush failed, entries stay buffered and are retried: {stats['last_error']}")
+    if stats["rejected"]:
+        st.warning(f"{stats['rejected']} entries were rejected by {stats['sink']} and set aside in "
+                   f"{os.path.join(os.environ.get(AUDIT_DIR_ENV, DEFAULT_AUDIT_DIR), REJECTED_DIR)}")
+
+    col1, col2 = st.columns(2)
+    today = datetime.now(NZ_TIMEZONE).date()
+    with col1:
+        startDate = st.date_input("From", value=today - timedelta(days=30), key="afrom")
+    with col2:
+        endDate = st.date_input("To", value=today, key="ato")
+    email = st.text_input("Participant Email (optional)")
+
+    if st.button("Search"):
+        if endDate < startDate:
+            st.error("End date should be after start date")
+            return
+        uid = None
+        if email:
+            try:
+                uid = getUserByEmail(email).uid
+            except auth.UserNotFoundError:
+                st.error("User doesn't exist")
+                return
+        with st.spinner("Querying audit log..."):
+            st.session_state.auditEntries = log.query(uid, *localRange(startDate, endDate))
+
+    entries = st.session_state.get("auditEntries")
+    if entries is None:
+        return
+    st.caption(f"{len(entries)} entries" + (f" (newest {QUERY_LIMIT} shown)" if len(entries) >= QUERY_LIMIT else ""))
+    if not entries:
+        return
+    st.dataframe(entryFrame(entries), use_container_width=True, hide_index=True)
+
+    byId = {entry["id"]: entry for entry in entries}
+    selected = st.selectbox("Entry", list(byId), format_func=lambda entryId: (
+        f"{byId[entryId]['at'].astimezone(NZ_TIMEZONE):%Y-%m-%d %H:%M:%S} "
+        f"{byId[entryId]['action']} {byId[entryId]['email'] or byId[entryId]['uid']}"))
+    entry = byId[selected]
+    st.json({"diff": entry.get("diff"), "details": entry.get("details")}, expanded=False)
+
+if __name__ == "__main__":
+    st.error("Please access this application through the main portal")
+    st.stop()
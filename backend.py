@@ -0,0 +1,74 @@
+import os
+import threading
+from tracing import traced
+
+# Set DIGIPREDICT_BACKEND=fake to run the portal against the in-memory stand-in
+BACKEND_ENV = "DIGIPREDICT_BACKEND"
+
+_active = None
+_lock = threading.Lock()
+
+class _Proxy:
+    """Module-like stand-in that forwards attribute access to the active backend"""
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(getattr(current(), self._name), attr)
+
+    def __repr__(self):
+        return f"<backend proxy {self._name}>"
+
+class _SharedClientFirestore:
+    """firebase_admin.firestore whose client() hands out one client per process"""
+    def __init__(self, module):
+        self._module = module
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self, app=None):
+        if app is not None:
+            return self._module.client(app)
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._module.client()
+        return self._client
+
+    def __getattr__(self, attr):
+        return getattr(self._module, attr)
+
+class FirebaseBackend:
+    """The real firebase_admin modules, imported on first use"""
+    name = "firebase"
+
+    def __init__(self):
+        from firebase_admin import auth, firestore
+        self.auth = auth
+        self.firestore = _SharedClientFirestore(firestore)
+
+def current():
+    """The backend in use, chosen from DIGIPREDICT_BACKEND on first access"""
+    global _active
+    if _active is None:
+        with _lock:
+            if _active is None:
+                if os.environ.get(BACKEND_ENV, "firebase") == "fake":
+                    from fakefirebase import FakeFirebase
+                    _active = traced(FakeFirebase())
+                else:
+                    _active = traced(FirebaseBackend())
+    return _active
+
+def use(backend):
+    """Switch every module to another backend (e.g. a FakeFirebase), returns the previous one"""
+    global _active
+    with _lock:
+        previous, _active = _active, traced(backend)
+    return previous
+
+def usingFake() -> bool:
+    return current().name != "firebase"
+
+auth = _Proxy("auth")
+firestore = _Proxy("firestore")
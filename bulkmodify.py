@@ -0,0 +1,362 @@
+import argparse
+import contextvars
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+import streamlit as st
+import firebase_admin
+from firebase_admin import credentials
+from audit import APPLIED, FAILED, recordCalendarChange
+from backend import firestore, auth, usingFake
+from jobs import idempotencyKey, showJobs, submitJob
+from layout import SCHEMA_V3, applyPackedChanges, calendarWrites
+from modify import MAX_WRITES_PER_BATCH, chunkFields, commitFieldUpdates, planCalendarChanges, summarizePlan
+from registry import ACTIVE, COMPLETED, UPCOMING, refreshEntries, registryEmails
+from schedule import WEEKDAYS
+from server import check_auth_and_redirect
+
+MAX_WORKERS = 8
+MAX_LOOKUP_BATCH = 100
+# Participants planned and written per wave; the checkpoint is appended after each commit
+WAVE_SIZE = 200
+# Stays under Firestore's recommended 500 writes/second ramp-up for a new workload
+WRITES_PER_SECOND = 500
+CHECKPOINT_DIR = "checkpoints"
+REPORT_COLUMNS = ["email", "uid", "status", "added", "updated", "removed", "message"]
+FINISHED = ("done", "unchanged")
+
+class Throttle:
+    """Token bucket shared by the commit workers, `rate` writes per second"""
+    def __init__(self, rate: float = WRITES_PER_SECOND):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, writes: int):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= min(writes, self.rate):
+                    self.tokens -= writes
+                    return
+                wait = (min(writes, self.rate) - self.tokens) / self.rate
+            time.sleep(wait)
+
+def normalizeEmails(emails) -> list:
+    """Stripped, lower-cased emails without duplicates or blanks, in first-seen order"""
+    return list(dict.fromkeys(key for key in (str(e).strip().lower() for e in emails) if key))
+
+def resolveUids(emails: list) -> tuple:
+    """email -> uid for existing accounts and the emails without one, 100 lookups per call"""
+    emails = normalizeEmails(emails)
+    found = {}
+    for i in range(0, len(emails), MAX_LOOKUP_BATCH):
+        result = auth.get_users([auth.EmailIdentifier(e) for e in emails[i:i + MAX_LOOKUP_BATCH]])
+        found |= {user.email.lower(): user.uid for user in result.users if user.email}
+    uids = {email: found[email] for email in emails if email in found}
+    return uids, [email for email in emails if email not in found]
+
+def cohortEmails(contains: str = "", createdFrom: date = None, createdTo: date = None) -> list:
+    """Emails of every account matching a filter on the address and account creation date"""
+    def created(user) -> date:
+        millis = user.user_metadata.creation_timestamp
+        return datetime.fromtimestamp(millis / 1000, timezone.utc).date() if millis else None
+
+    emails = []
+    for user in auth.list_users().iterate_all():
+        if not user.email or contains.lower() not in user.email.lower():
+            continue
+        day = created(user)
+        if (createdFrom and (day is None or day < createdFrom)) or (createdTo and (day is None or day > createdTo)):
+            continue
+        emails.append(user.email)
+    return sorted(normalizeEmails(emails))
+
+def readCheckpoint(path: str) -> dict:
+    """email -> last recorded report row of an interrupted run"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return {row["email"].strip().lower(): row for row in rows}
+
+def appendCheckpoint(path: str, rows: list, lock: threading.Lock):
+    if not path or not rows:
+        return
+    with lock, open(path, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(row) + "\n" for row in rows)
+
+def reportRow(email: str, uid: str = "", status: str = "pending", message: str = "", summary: dict = None) -> dict:
+    summary = summary or {}
+    return {"email": email, "uid": uid, "status": status, "added": summary.get("added", 0),
+            "updated": summary.get("updated", 0), "removed": summary.get("removed", 0), "message": message}
+
+def writeGroups(plans: list) -> list:
+    """Pack participant plans into groups that fit one batch, never splitting a participant"""
+    groups, group, size = [], [], 0
+    for plan, writes in plans:
+        count = sum(len(chunkFields(fields)) for _, fields, _ in writes)
+        if group and size + count > MAX_WRITES_PER_BATCH:
+            groups.append((group, size))
+            group, size = [], 0
+        group.append((plan, writes))
+        size += count
+    if group:
+        groups.append((group, size))
+    return groups
+
+def modifyWave(db, targets: dict, pause: tuple, extend: tuple, pool, throttle: Throttle,
+               checkpoint: str = None, lock: threading.Lock = None, dry_run: bool = False) -> list:
+    """Plan and apply the changes of up to WAVE_SIZE participants, returns their report rows"""
+    lock = lock or threading.Lock()
+    rows = {email: reportRow(email, uid) for email, uid in targets.items()}
+    futures = {email: pool.submit(contextvars.copy_context().run, planCalendarChanges, db, uid, pause, extend)
+               for email, uid in targets.items()}
+
+    plans, packed = [], []
+    for email, future in futures.items():
+        try:
+            plan = future.result()
+        except Exception as e:
+            rows[email] |= {"status": "failed", "message": str(e)}
+            continue
+        rows[email] |= reportRow(email, plan["uid"], summary=summarizePlan(plan))
+        if not plan["fields"]:
+            rows[email]["status"] = "unchanged"
+        elif dry_run:
+            rows[email]["status"] = "planned"
+        elif plan["schema"] == SCHEMA_V3:
+            packed.append(dict(plan, email=email))
+        else:
+            plans.append((dict(plan, email=email), calendarWrites(db, plan["uid"], plan["fields"], plan["schema"])))
+    appendCheckpoint(checkpoint, [r for r in rows.values() if r["status"] == "unchanged"], lock)
+
+    def commit(group, size):
+        throttle.acquire(size)
+        try:
+            if group[0][1] is None:
+                # A packed Calendar is re-read and rewritten on its own
+                applyPackedChanges(db, group[0][0]["uid"], group[0][0]["fields"])
+            else:
+                commitFieldUpdates(db, [write for _, writes in group for write in writes])
+            status, message = "done", ""
+        except Exception as e:
+            status, message = "failed", str(e)
+        if status == "done":
+            try:
+                refreshEntries(db, [plan["uid"] for plan, _ in group], {plan["uid"]: plan["email"] for plan, _ in group})
+            except Exception as e:
+                message = f"Registry not updated, rerun registry.py: {e}"
+        for plan, _ in group:
+            rows[plan["email"]] |= {"status": status, "message": message}
+            if status == "done":
+                recordCalendarChange(plan, APPLIED, bulk=True)
+            else:
+                recordCalendarChange(plan, FAILED, bulk=True, error=message)
+        appendCheckpoint(checkpoint, [rows[plan["email"]] for plan, _ in group if status == "done"], lock)
+
+    groups = writeGroups(plans) + [([(plan, None)], 1) for plan in packed]
+    commits = [pool.submit(contextvars.copy_context().run, commit, group, size) for group, size in groups]
+    for future in commits:
+        future.result()
+    return list(rows.values())
+
+def bulkModify(emails: list, pause: tuple = None, extend: tuple = None, checkpoint: str = None,
+               max_workers: int = MAX_WORKERS, rate: float = WRITES_PER_SECOND, dry_run: bool = False) -> list:
+    """Apply the same removal and/or extension to many participants
+
+    Participants already finished in the checkpoint file are skipped, so an interrupted
+    run can be restarted with the same arguments.
+    """
+    emails = normalizeEmails(emails)
+    finished = {email: row for email, row in readCheckpoint(checkpoint).items() if row["status"] in FINISHED}
+    pending = [email for email in emails if email not in finished]
+    uids, missing = resolveUids(pending)
+
+    report = [dict(row, message="Finished in an earlier run") for email, row in finished.items() if email in emails]
+    report += [reportRow(email, status="failed", message="User doesn't exist") for email in missing]
+
+    db = firestore.client()
+    throttle = Throttle(rate)
+    lock = threading.Lock()
+    targets = list(uids.items())
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i in range(0, len(targets), WAVE_SIZE):
+            report += modifyWave(db, dict(targets[i:i + WAVE_SIZE]), pause, extend, pool, throttle,
+                                 None if dry_run else checkpoint, lock, dry_run)
+    return report
+
+def writeReport(report: list, out):
+    writer = csv.DictWriter(out, fieldnames=REPORT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(report)
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Bulk Study Modification")
+    st.info("Apply the same removal or extension to many participants")
+
+    mode = st.radio("Participants", ["Email list", "Cohort filter", "Account filter"], horizontal=True)
+    emails = filters = None
+    if mode == "Email list":
+        text = st.text_area("Study Emails", help="One email per line or comma separated")
+        emails = [e.strip() for e in text.replace(",", "\n").splitlines() if e.strip()]
+    elif mode == "Cohort filter":
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            gender = st.selectbox("Sex at Birth", ("Any", "Female", "Male"))
+        with col2:
+            status = st.selectbox("Study Status", ("Any", UPCOMING, ACTIVE, COMPLETED))
+        with col3:
+            day = st.selectbox("Questionnaire Day", ["Any"] + WEEKDAYS)
+        col1, col2 = st.columns(2)
+        with col1:
+            startFrom = st.date_input("Study started from", value=None)
+        with col2:
+            startTo = st.date_input("Study started to", value=None)
+        filters = {"gender": None if gender == "Any" else gender, "status": None if status == "Any" else status,
+                   "questionnaireDay": None if day == "Any" else day, "startFrom": startFrom, "startTo": startTo}
+    else:
+        contains = st.text_input("Email contains", help="Leave empty for every participant")
+        col1, col2 = st.columns(2)
+        with col1:
+            createdFrom = st.date_input("Account created from", value=None)
+        with col2:
+            createdTo = st.date_input("Account created to", value=None)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        pauseStudy = st.toggle("Remove Dates from Study")
+        if pauseStudy:
+            startPauseDate = st.date_input("Start Removal Date", key="bsrd")
+            endPauseDate = st.date_input("End Removal Date", key="berd")
+            if endPauseDate < startPauseDate:
+                st.error("End date should be after start date")
+    with col2:
+        extendStudy = st.toggle("Extend Study")
+        if extendStudy:
+            startExtendDate = st.date_input("Start Extension Date", key="bsed")
+            endExtendDate = st.date_input("End Extension Date", key="beed")
+            if endExtendDate < startExtendDate:
+                st.error("End date should be after start date")
+            questionnaireLink = st.text_input("Questionnaire Link")
+            questionnaireDay = WEEKDAYS.index(st.select_slider("Select Questionnaire Day", options=WEEKDAYS))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        preview = st.button("Preview Changes")
+    with col2:
+        submit = st.button(label="Submit")
+
+    if preview or submit:
+        pause = (startPauseDate, endPauseDate) if pauseStudy else None
+        extend = (startExtendDate, endExtendDate, questionnaireDay, questionnaireLink) if extendStudy else None
+        if not pause and not extend:
+            st.warning("Select dates to remove or extend")
+            return
+        if filters is not None:
+            emails = registryEmails(firestore.client(), **filters)
+        elif emails is None:
+            emails = cohortEmails(contains, createdFrom, createdTo)
+        emails = normalizeEmails(emails)
+        if not emails:
+            st.error("No participants selected")
+            return
+
+        if preview:
+            with st.spinner(f"Planning changes for {len(emails)} participants..."):
+                report = bulkModify(emails, pause, extend, dry_run=True)
+            st.markdown(f"**{sum(r['status'] == 'planned' for r in report)} participants would change, "
+                        f"{sum(r['status'] == 'unchanged' for r in report)} unchanged, "
+                        f"{sum(r['status'] == 'failed' for r in report)} failed**")
+            st.dataframe(report, use_container_width=True)
+            return
+
+        key = idempotencyKey("bulk-modify", sorted(emails), pause, extend)
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        # Resubmitting the same change after a failure resumes from this file
+        checkpoint = os.path.join(CHECKPOINT_DIR, f"bulk-{key[:16]}.jsonl")
+
+        def apply():
+            report = bulkModify(emails, pause, extend, checkpoint)
+            counts = {s: sum(r["status"] == s for r in report) for s in ("done", "unchanged", "failed")}
+            failed = [f"{r['email']}: {r['message']}" for r in report if r["status"] == "failed"]
+            return (f"{counts['done']} modified, {counts['unchanged']} unchanged, {counts['failed']} failed"
+                    + ("\n\n" + "\n\n".join(failed) if failed else ""))
+
+        submitJob(f"Bulk modifying {len(emails)} participants", [("Applying changes", apply)], key=key)
+
+    showJobs()
+
+def parseDate(value: str) -> date:
+    return date.fromisoformat(value)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Remove or extend study dates for many participants")
+    parser.add_argument("emails", nargs="*", help="Participants to modify")
+    parser.add_argument("--emails-file", help="File with one email per line")
+    parser.add_argument("--contains", help="Select every account whose email contains this text")
+    parser.add_argument("--gender", choices=("Female", "Male"), help="Select registry participants of this sex")
+    parser.add_argument("--status", choices=(UPCOMING, ACTIVE, COMPLETED), help="Select registry participants by status")
+    parser.add_argument("--started-from", type=parseDate, help="Select registry participants starting on or after")
+    parser.add_argument("--started-to", type=parseDate, help="Select registry participants starting on or before")
+    parser.add_argument("--remove", nargs=2, type=parseDate, metavar=("START", "END"), help="Dates to remove")
+    parser.add_argument("--extend", nargs=2, type=parseDate, metavar=("START", "END"), help="Dates to add")
+    parser.add_argument("--questionnaire-day", choices=WEEKDAYS, default="Monday")
+    parser.add_argument("--questionnaire-link", default="")
+    parser.add_argument("--checkpoint", help="Resumable progress file (default: checkpoints/bulk-<hash>.jsonl)")
+    parser.add_argument("--report", help="Write the per-participant report to this CSV file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Thread pool size")
+    parser.add_argument("--rate", type=float, default=WRITES_PER_SECOND, help="Maximum writes per second")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args(argv)
+
+    if not args.remove and not args.extend:
+        parser.error("give --remove and/or --extend")
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    emails = list(args.emails)
+    if args.emails_file:
+        with open(args.emails_file, encoding="utf-8") as f:
+            emails += [line.strip() for line in f if line.strip()]
+    if args.contains is not None:
+        emails += cohortEmails(args.contains)
+    filters = {"gender": args.gender, "status": args.status, "startFrom": args.started_from, "startTo": args.started_to}
+    if any(value is not None for value in filters.values()):
+        emails += registryEmails(firestore.client(), **filters)
+    emails = normalizeEmails(emails)
+    if not emails:
+        parser.error("no participants selected")
+
+    pause = tuple(args.remove) if args.remove else None
+    extend = (*args.extend, WEEKDAYS.index(args.questionnaire_day), args.questionnaire_link) if args.extend else None
+    checkpoint = args.checkpoint
+    if checkpoint is None and not args.dry_run:
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        key = idempotencyKey("bulk-modify", sorted(emails), pause, extend)
+        checkpoint = os.path.join(CHECKPOINT_DIR, f"bulk-{key[:16]}.jsonl")
+
+    report = bulkModify(emails, pause, extend, checkpoint, args.workers, args.rate, args.dry_run)
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writeReport(report, f)
+    else:
+        writeReport(report, sys.stdout)
+    return 0 if all(r["status"] != "failed" for r in report) else 1
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,119 @@
+from collections import Counter
+from datetime import date, timedelta
+from backend import firestore
+
+# Packed Calendar layout (schema 3), the whole study in one small document:
+#   Start, Length  first study day (YYYY-MM-DD) and number of days covered
+#   Days           bitset of the days present, bit i is Start + i days
+#   Tasks          task names in the order they first appear
+#   Scheduled      {task: bitset of the days scheduling it}
+#   Completed      {task: bitset of the days it was completed}
+#   Links          {task: link}, each task's most common link stored once
+#   Overrides      {day: {task: status}} for statuses the bitsets cannot express
+# A 7 month study packs into a few hundred bytes instead of ~215 nested maps.
+PACKED_SCHEMA = 3
+
+def isPacked(calendar: dict) -> bool:
+    return bool(calendar) and calendar.get("Schema") == PACKED_SCHEMA
+
+def _bitset(indices, length: int) -> bytes:
+    value = 0
+    for index in indices:
+        value |= 1 << index
+    return value.to_bytes((length + 7) // 8, "little")
+
+def _indices(bitset: bytes) -> list:
+    value = int.from_bytes(bitset, "little")
+    indices = []
+    while value:
+        low = value & -value
+        indices.append(low.bit_length() - 1)
+        value ^= low
+    return indices
+
+def _isPlain(status, link) -> bool:
+    """Whether a status is exactly what the bitsets and the stored link decode to"""
+    if not isinstance(status, dict) or not isinstance(status.get("Completed"), bool):
+        return False
+    extra = status.keys() - {"Completed", "Link"}
+    return not extra and status.get("Link") == link
+
+def encodeCalendar(calendar: dict) -> dict:
+    """Packed Calendar document for a day-keyed calendar"""
+    days = sorted(calendar)
+    if not days:
+        return {"Schema": PACKED_SCHEMA, "Start": None, "Length": 0, "Days": b"", "Tasks": [],
+                "Scheduled": {}, "Completed": {}, "Links": {}, "Overrides": {}}
+    start = date.fromisoformat(days[0])
+    length = (date.fromisoformat(days[-1]) - start).days + 1
+
+    tasks, links = [], {}
+    for day in days:
+        for task, status in calendar[day].items():
+            if task not in links:
+                tasks.append(task)
+                links[task] = Counter()
+            if isinstance(status, dict) and "Link" in status:
+                links[task][status["Link"]] += 1
+    links = {task: counts.most_common(1)[0][0] for task, counts in links.items() if counts}
+
+    present, scheduled, completed, overrides = [], {t: [] for t in tasks}, {t: [] for t in tasks}, {}
+    for day in days:
+        index = (date.fromisoformat(day) - start).days
+        present.append(index)
+        for task, status in calendar[day].items():
+            scheduled[task].append(index)
+            if isinstance(status, dict) and status.get("Completed") is True:
+                completed[task].append(index)
+            if not _isPlain(status, links.get(task)):
+                overrides.setdefault(day, {})[task] = status
+
+    return {"Schema": PACKED_SCHEMA, "Start": days[0], "Length": length, "Days": _bitset(present, length),
+            "Tasks": tasks, "Scheduled": {t: _bitset(scheduled[t], length) for t in tasks},
+            "Completed": {t: _bitset(completed[t], length) for t in tasks if completed[t]},
+            "Links": links, "Overrides": overrides}
+
+def decodeCalendar(packed: dict, first: str = None, last: str = None) -> dict:
+    """Day-keyed calendar of a packed document, limited to YYYY-MM-DD bounds if given"""
+    if not packed.get("Length"):
+        return {}
+    start = date.fromisoformat(packed["Start"])
+    keys = {index: (start + timedelta(days=index)).strftime("%Y-%m-%d") for index in _indices(packed["Days"])}
+    if first or last:
+        keys = {index: key for index, key in keys.items()
+                if (not first or key >= first) and (not last or key <= last)}
+    calendar = {key: {} for key in keys.values()}
+
+    links, overrides = packed.get("Links", {}), packed.get("Overrides", {})
+    for task in packed["Tasks"]:
+        done = set(_indices(packed["Completed"].get(task, b"")))
+        for index in _indices(packed["Scheduled"][task]):
+            key = keys.get(index)
+            if key is None:
+                continue
+            override = overrides.get(key, {})
+            if task in override:
+                calendar[key][task] = override[task]
+            elif task in links:
+                calendar[key][task] = {"Completed": index in done, "Link": links[task]}
+            else:
+                calendar[key][task] = {"Completed": index in done}
+    return calendar
+
+def applyChanges(packed: dict, fields: dict) -> dict:
+    """Packed document with changes applied, keyed by day or by YYYY-MM-DD.Task path
+
+    DELETE_FIELD on a day removes the day, a task path replaces only that task.
+    """
+    calendar = decodeCalendar(packed) if packed else {}
+    for key, value in fields.items():
+        day, _, task = key.partition(".")
+        if value is firestore.DELETE_FIELD and task:
+            calendar.get(day, {}).pop(task, None)
+        elif value is firestore.DELETE_FIELD:
+            calendar.pop(day, None)
+        elif task:
+            calendar.setdefault(day, {})[task] = value
+        else:
+            calendar[day] = value
+    return encodeCalendar(calendar)
@@ -0,0 +1,301 @@
+import argparse
+import contextvars
+import csv
+import hashlib
+import io
+import json
+import secrets
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time
+import streamlit as st
+import firebase_admin
+from firebase_admin import credentials
+from audit import FAILED, recordOnboarding
+from backend import firestore, auth, usingFake
+from server import check_auth_and_redirect, buildParticipantDocuments
+from identity import deleteUsers
+from layout import participantWriteCount, queueParticipantWrites
+from modify import MAX_WRITES_PER_BATCH
+from registry import queueRegistryEntry
+from templates import DEFAULT_TEMPLATE, loadTemplate, templateNames
+
+MAX_WORKERS = 8
+# Admin SDK limits for bulk identity calls
+MAX_LOOKUP_BATCH = 100
+MAX_IMPORT_BATCH = 1000
+PBKDF2_ROUNDS = 100000
+
+ROSTER_COLUMNS = [
+    "email", "password", "gender", "start_date", "time_frame",
+    "checkin_time", "hailie_time", "cough_monitor_time",
+    "questionnaire_time", "questionnaire_link",
+]
+ROSTER_DEFAULTS = {
+    "gender": "Female",
+    "time_frame": "7",
+    "checkin_time": "08:00",
+    "hailie_time": "08:00",
+    "cough_monitor_time": "22:00",
+    "questionnaire_time": "20:00",
+    "questionnaire_link": "",
+}
+REPORT_COLUMNS = ["row", "email", "uid", "status", "message"]
+
+def readRoster(content: str, fmt: str) -> list:
+    """Read roster rows from CSV or JSON text"""
+    if fmt == "json":
+        rows = json.loads(content)
+        if not isinstance(rows, list):
+            raise ValueError("JSON roster must be a list of participant objects")
+        return rows
+    return list(csv.DictReader(io.StringIO(content)))
+
+def parseRow(row: dict):
+    """Turn a roster row into the email, password, userInfo and questionnaireInfo used by onboarding"""
+    if not isinstance(row, dict):
+        raise ValueError("Roster row must be an object of participant columns")
+    row = {k.strip(): str(v).strip() for k, v in row.items() if k and v is not None and str(v).strip()}
+    row = ROSTER_DEFAULTS | row
+    email = row.get("email", "")
+    password = row.get("password", "")
+    if not email or not password:
+        raise ValueError("Missing email or password")
+    auth.EmailIdentifier(email)
+    if len(password) < 6:
+        raise ValueError("Password must be at least 6 characters")
+    if row["gender"] not in ("Female", "Male"):
+        raise ValueError(f"Invalid gender {row['gender']!r}")
+    if "start_date" not in row:
+        raise ValueError("Missing start_date")
+
+    timeFrame = int(row["time_frame"])
+    if not 1 <= timeFrame <= 12:
+        raise ValueError("time_frame must be between 1 and 12 months")
+
+    usrInfo = {
+        "Gender": row["gender"],
+        "start_date": date.fromisoformat(row["start_date"]),
+        "CheckInTaskTime": time.fromisoformat(row["checkin_time"]),
+        "HailieTaskTime": time.fromisoformat(row["hailie_time"]),
+        "Cough MonitorTaskTime": time.fromisoformat(row["cough_monitor_time"]),
+        "time_frame": (timeFrame * 31) - 3,
+    }
+    questionnaireInfo = {
+        "time": time.fromisoformat(row["questionnaire_time"]),
+        "frequency": 14,
+        "link": row["questionnaire_link"]
+    }
+    return email, password, usrInfo, questionnaireInfo
+
+def hashPassword(password: str):
+    """Hash a password the way auth.UserImportHash.pbkdf2_sha256 expects"""
+    salt = secrets.token_bytes(16)
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ROUNDS), salt
+
+def existingEmails(emails: list) -> set:
+    """Look up which emails already have accounts, 100 identifiers per call"""
+    found = set()
+    for i in range(0, len(emails), MAX_LOOKUP_BATCH):
+        result = auth.get_users([auth.EmailIdentifier(e) for e in emails[i:i + MAX_LOOKUP_BATCH]])
+        found |= {user.email.lower() for user in result.users if user.email}
+    return found
+
+def prepareParticipant(entry: dict, structure: dict):
+    """Per-participant work run on the pool: build documents and the account import record"""
+    email, password, usrInfo, questionnaireInfo = entry["parsed"]
+    documents = buildParticipantDocuments(usrInfo, questionnaireInfo, structure)
+    passwordHash, salt = hashPassword(password)
+    record = auth.ImportUserRecord(
+        uid=secrets.token_urlsafe(21)[:28], email=email,
+        password_hash=passwordHash, password_salt=salt)
+    return documents, record
+
+def importAccounts(entries: list):
+    """Create accounts with auth.import_users, marking rows the import rejects"""
+    hashAlg = auth.UserImportHash.pbkdf2_sha256(rounds=PBKDF2_ROUNDS)
+    for i in range(0, len(entries), MAX_IMPORT_BATCH):
+        chunk = entries[i:i + MAX_IMPORT_BATCH]
+        try:
+            result = auth.import_users([e["record"] for e in chunk], hash_alg=hashAlg)
+        except Exception as e:
+            for entry in chunk:
+                entry["report"] |= {"status": "failed", "message": f"Account import failed: {e}"}
+            continue
+        for error in result.errors:
+            chunk[error.index]["report"] |= {"status": "failed", "message": error.reason}
+        for entry in chunk:
+            if entry["report"]["status"] == "pending":
+                entry["report"]["uid"] = entry["record"].uid
+
+def commitDocuments(db, entries: list):
+    """Write one batch of participants' documents, removing their accounts if the commit fails"""
+    batch = db.batch()
+    for entry in entries:
+        queueParticipantWrites(db, batch, entry["record"].uid, entry["documents"])
+        queueRegistryEntry(db, batch, entry["record"].uid, entry["record"].email, entry["documents"])
+    try:
+        batch.commit()
+    except Exception as e:
+        uids = [entry["record"].uid for entry in entries]
+        try:
+            leftover = {uids[error.index]: error.reason for error in deleteUsers(uids).errors}
+        except Exception as c:
+            leftover = dict.fromkeys(uids, str(c))
+        for entry in entries:
+            uid = entry["record"].uid
+            if uid in leftover:
+                # The account still exists, its uid stays in the report so it can be removed by hand
+                entry["report"] |= {"status": "failed", "message":
+                                    f"Account created, documents not written, cleanup failed: {e}; {leftover[uid]}"}
+            else:
+                entry["report"] |= {"uid": "", "status": "failed",
+                                    "message": f"Documents not written, account removed: {e}"}
+            recordOnboarding(entry["record"].uid, entry["record"].email, entry["documents"], FAILED,
+                             bulk=True, error=str(e))
+        return
+    for entry in entries:
+        entry["report"] |= {"status": "onboarded", "message": ""}
+        recordOnboarding(entry["record"].uid, entry["record"].email, entry["documents"], bulk=True)
+
+def writeGroups(entries: list) -> list:
+    """Split participants into groups whose documents fit in one write batch"""
+    groups, group, writes = [], [], 0
+    for entry in entries:
+        count = participantWriteCount(entry["documents"]) + 1
+        if group and writes + count > MAX_WRITES_PER_BATCH:
+            groups.append(group)
+            group, writes = [], 0
+        group.append(entry)
+        writes += count
+    if group:
+        groups.append(group)
+    return groups
+
+def onBoardCohort(rows: list, structure: dict, max_workers: int = MAX_WORKERS) -> list:
+    """Onboard a roster of participants, returns one report row per roster row"""
+    entries = []
+    seen = set()
+    for i, row in enumerate(rows, start=1):
+        email = row.get("email", "") if isinstance(row, dict) else ""
+        entry = {"report": {"row": i, "email": str(email).strip(),
+                            "uid": "", "status": "pending", "message": ""}}
+        entries.append(entry)
+        try:
+            entry["parsed"] = parseRow(row)
+        except (ValueError, TypeError) as e:
+            entry["report"] |= {"status": "failed", "message": str(e)}
+            continue
+        key = entry["parsed"][0].lower()
+        if key in seen:
+            entry["report"] |= {"status": "failed", "message": "Duplicate email in roster"}
+        seen.add(key)
+
+    pending = [e for e in entries if e["report"]["status"] == "pending"]
+    existing = existingEmails([e["parsed"][0] for e in pending])
+    for entry in pending:
+        if entry["parsed"][0].lower() in existing:
+            entry["report"] |= {"status": "skipped", "message": "User already exists"}
+
+    pending = [e for e in entries if e["report"]["status"] == "pending"]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(prepareParticipant, entry, structure) for entry in pending]
+        for entry, future in zip(pending, futures):
+            try:
+                entry["documents"], entry["record"] = future.result()
+            except Exception as e:
+                entry["report"] |= {"status": "failed", "message": str(e)}
+
+        pending = [e for e in pending if e["report"]["status"] == "pending"]
+        importAccounts(pending)
+
+        pending = [e for e in pending if e["report"]["status"] == "pending"]
+        db = firestore.client()
+        # Each commit runs in a copy of the caller's context so it is traced under the same request
+        groups = writeGroups(pending)
+        commits = [pool.submit(contextvars.copy_context().run, commitDocuments, db, group) for group in groups]
+        for group, future in zip(groups, commits):
+            try:
+                future.result()
+            except Exception as e:
+                for entry in group:
+                    if entry["report"]["status"] == "pending":
+                        entry["report"] |= {"status": "failed", "message": f"Account created, documents not written: {e}"}
+
+    return [entry["report"] for entry in entries]
+
+def writeReport(report: list, f):
+    """Write the per-row onboarding report as CSV"""
+    writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+    writer.writeheader()
+    writer.writerows(report)
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Bulk Participant Onboarding")
+    st.info("Upload a CSV or JSON roster with columns: " + ", ".join(ROSTER_COLUMNS))
+
+    names = templateNames()
+    templateName = st.selectbox("Study Template", names) if len(names) > 1 else DEFAULT_TEMPLATE
+    upload = st.file_uploader("Roster", type=["csv", "json"])
+    if upload is None:
+        return
+
+    try:
+        rows = readRoster(upload.getvalue().decode("utf-8-sig"),
+                          "json" if upload.name.lower().endswith(".json") else "csv")
+    except ValueError as e:
+        st.error(f"Could not read roster: {e}")
+        return
+
+    st.markdown(f"**{len(rows)} participants in roster**")
+    st.dataframe([{k: v for k, v in row.items() if k != "password"} if isinstance(row, dict) else {"row": row}
+                  for row in rows],
+                 use_container_width=True)
+
+    if st.button("Onboard Cohort"):
+        with st.spinner("Onboarding participants..."):
+            report = onBoardCohort(rows, loadTemplate(templateName))
+
+        counts = {status: sum(r["status"] == status for r in report)
+                  for status in ("onboarded", "skipped", "failed")}
+        st.success(f"{counts['onboarded']} onboarded, {counts['skipped']} skipped, {counts['failed']} failed")
+        st.dataframe(report, use_container_width=True)
+
+        out = io.StringIO()
+        writeReport(report, out)
+        st.download_button("Download Report", out.getvalue(), file_name="onboarding_report.csv",
+                           mime="text/csv")
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Onboard a cohort of participants from a CSV/JSON roster")
+    parser.add_argument("roster", help="CSV or JSON roster file")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--report", help="Write the per-row report to this CSV file (default: stdout)")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, choices=templateNames(),
+                        help="Study template to onboard with")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Thread pool size")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    with open(args.roster, "r", encoding="utf-8-sig") as f:
+        rows = readRoster(f.read(), "json" if args.roster.lower().endswith(".json") else "csv")
+
+    report = onBoardCohort(rows, loadTemplate(args.template), max_workers=args.workers)
+
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writeReport(report, f)
+    else:
+        writeReport(report, sys.stdout)
+
+    return 0 if all(r["status"] != "failed" for r in report) else 1
+
+if __name__ == "__main__":
+    sys.exit(cli())
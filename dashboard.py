@@ -0,0 +1,123 @@
+from datetime import datetime
+import streamlit as st
+from backend import auth
+from analytics import adherence, calendarCube, cohortAdherence, cohortReport, dueBefore, missedWindows
+from livestate import liveState
+from server import check_auth_and_redirect
+
+PAGE_SIZE = 50
+# Account listings change on onboarding only; participant documents come from the shared
+# snapshot listeners, so rereading them costs nothing and live views just rerun
+LIST_TTL = 60
+LIVE_INTERVAL = 5
+
+def formatTimestamp(millis) -> str:
+    return datetime.fromtimestamp(millis / 1000).strftime("%Y-%m-%d %H:%M") if millis else ""
+
+def showStaleness(uids: list):
+    """Warn when some of the participants shown are no longer kept current"""
+    stale = liveState().staleness(uids)
+    if not stale:
+        return
+    oldest = max(stale.values())
+    since = "before any data arrived" if oldest == float("inf") else f"{oldest / 60:.0f} min ago"
+    st.warning(f"Live updates interrupted for {len(stale)} participant(s), oldest data shown was last updated {since}. "
+               "Reconnecting on the next refresh.")
+
+@st.cache_data(ttl=LIST_TTL, show_spinner=False)
+def listParticipants(page_token: str = None, max_results: int = PAGE_SIZE):
+    """One page of participant accounts and the token for the next page"""
+    page = auth.list_users(page_token=page_token, max_results=max_results)
+    rows = [{
+        "email": user.email,
+        "uid": user.uid,
+        "created": formatTimestamp(user.user_metadata.creation_timestamp),
+        "last sign in": formatTimestamp(user.user_metadata.last_sign_in_timestamp),
+    } for user in page.users]
+    return rows, page.next_page_token
+
+@st.cache_data(max_entries=20, show_spinner=False)
+def cohortViews(uids: tuple, version: tuple):
+    """Cohort adherence, report and missed windows, recomputed only when a calendar changes"""
+    calendars = liveState().calendars(list(uids))
+    cube = dueBefore(calendarCube(calendars))
+    return cohortAdherence(cube), cohortReport(calendars), missedWindows(cube)
+
+def showCohortReport(emails: dict):
+    uids = tuple(emails.values())
+    with st.spinner("Loading calendars..."):
+        live = liveState()
+        live.watch(list(uids))
+    showStaleness(list(uids))
+    adherenceByTask, report, windows = cohortViews(uids, live.version(list(uids)))
+    names = {uid: name for name, uid in emails.items()}
+    st.subheader("Cohort Adherence (%)")
+    st.dataframe(adherenceByTask.to_frame("Adherence"), use_container_width=True)
+    st.subheader("Participants")
+    st.dataframe(report.rename(index=names), use_container_width=True)
+    st.subheader("Missed Windows (3+ days)")
+    windows = windows.copy()
+    windows["uid"] = windows["uid"].map(names)
+    st.dataframe(windows.rename(columns={"uid": "participant"}), use_container_width=True, hide_index=True)
+
+def showParticipants(emails: dict, selected: list):
+    with st.spinner("Loading participant documents..."):
+        documents = {emails[name]: liveState().documents(emails[name]) for name in selected}
+    showStaleness([emails[name] for name in selected])
+
+    st.subheader("Adherence (%)")
+    table = adherence({uid: docs.get("Calendar", {}) for uid, docs in documents.items()})
+    table.index = [name for name in selected]
+    st.dataframe(table, use_container_width=True)
+
+    for name in selected:
+        docs = documents[emails[name]]
+        with st.expander(name):
+            calendar = docs.get("Calendar", {})
+            days = sorted(calendar)
+            st.markdown(f"**Sex at Birth:** {docs.get('Basic Info', {}).get('Gender', '')}")
+            if days:
+                st.markdown(f"**Study Days:** {len(days)} ({days[0]} to {days[-1]})")
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Participant Dashboard")
+
+    if "dashboard_tokens" not in st.session_state:
+        st.session_state.dashboard_tokens = [None]
+
+    tokens = st.session_state.dashboard_tokens
+    rows, nextToken = listParticipants(tokens[-1])
+
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        if st.button("⬅️ Previous", disabled=len(tokens) == 1):
+            tokens.pop()
+            st.rerun()
+    with col2:
+        if st.button("Next ➡️", disabled=not nextToken):
+            tokens.append(nextToken)
+            st.rerun()
+    with col3:
+        if st.button("🔄 Refresh"):
+            listParticipants.clear()
+            st.rerun()
+
+    st.caption(f"Page {len(tokens)}, {len(rows)} participants")
+    st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    emails = {row["email"] or row["uid"]: row["uid"] for row in rows}
+
+    # Live views rerun on their own, reading only the in-memory state
+    live = st.toggle("Live updates", help=f"Refresh the views below every {LIVE_INTERVAL}s")
+    fragment = st.fragment(run_every=LIVE_INTERVAL if live else None)
+
+    if st.toggle("Cohort report for this page"):
+        fragment(showCohortReport)(emails)
+
+    selected = st.multiselect("Load participant details", list(emails))
+    if not selected:
+        return
+    fragment(showParticipants)(emails, selected)
@@ -0,0 +1,333 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+import streamlit as st
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from calendarcodec import decodeCalendar, isPacked
+from jobs import showJobs, submitJob
+from layout import READ_BATCH, isSharded, monthRef
+from locations import readAllFixes
+from questionnaires import RESPONSES_COLLECTION
+from server import check_auth_and_redirect
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional, CSV always works
+    pa = pq = None
+
+EXPORT_DOCUMENTS = ("Calendar", "Questionnaires", "Location")
+# Participant document each dataset is read from
+DATASET_DOCUMENTS = {"calendar": "Calendar", "questionnaires": "Questionnaires", "location": "Location"}
+# Long (one value per row) layouts keep every chunk on the same schema whatever fields participants have
+COLUMNS = {
+    "calendar": ["uid", "day", "task", "completed", "link"],
+    "questionnaires": ["uid", "questionnaire", "record", "field", "value"],
+    "location": ["uid", "record", "field", "value"],
+}
+CHUNK_ROWS = 50000
+# Firestore allows at most 30 values in an "in" filter
+IN_QUERY_LIMIT = 30
+STATE_FILE = "export_state.json"
+
+def formats() -> list:
+    return ["csv", "parquet"] if pq else ["csv"]
+
+def flatten(value, prefix: str = "") -> dict:
+    """Nested maps as dotted field -> value, lists and timestamps as text"""
+    if isinstance(value, dict):
+        fields = {}
+        for key, item in value.items():
+            fields |= flatten(item, f"{prefix}.{key}" if prefix else str(key))
+        return fields
+    if isinstance(value, list):
+        value = json.dumps(value, default=str)
+    elif value is not None and not isinstance(value, str):
+        value = value.isoformat() if isinstance(value, datetime) else str(value)
+    return {prefix or "value": value}
+
+def calendarRows(uid: str, calendar: dict):
+    for day in sorted(calendar):
+        tasks = calendar[day]
+        if not isinstance(tasks, dict):
+            continue
+        for task, status in tasks.items():
+            status = status if isinstance(status, dict) else {}
+            yield {"uid": uid, "day": day, "task": task, "completed": bool(status.get("Completed")),
+                   "link": status.get("Link", "")}
+
+def questionnaireRows(uid: str, questionnaires: dict):
+    for name, questionnaire in questionnaires.items():
+        records = questionnaire.get("Record", {}) if isinstance(questionnaire, dict) else {}
+        for record, answers in records.items():
+            for field, value in flatten(answers).items():
+                yield {"uid": uid, "questionnaire": name, "record": record, "field": field, "value": value}
+
+def locationRows(uid: str, location: dict):
+    for record, entry in location.items():
+        for field, value in flatten(entry).items():
+            yield {"uid": uid, "record": record, "field": field, "value": value}
+
+class ChunkWriter:
+    """Appends rows to one CSV or Parquet file CHUNK_ROWS at a time"""
+    def __init__(self, path: str, columns: list, fmt: str):
+        if fmt == "parquet" and pq is None:
+            raise ValueError("Parquet export needs pyarrow, install it or export CSV")
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self.rows = []
+        self.written = 0
+        self._writer = None
+        self._file = None
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= CHUNK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows and self.written:
+            return
+        if self.fmt == "parquet":
+            table = pa.Table.from_pylist(self.rows, schema=self._schema())
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            if self._file is None:
+                self._file = open(self.path, "w", newline="", encoding="utf-8")
+                self._csv = csv.DictWriter(self._file, fieldnames=self.columns)
+                self._csv.writeheader()
+            self._csv.writerows(self.rows)
+        self.written += len(self.rows)
+        self.rows = []
+
+    def _schema(self):
+        return pa.schema([(c, pa.bool_() if c == "completed" else pa.string()) for c in self.columns])
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+
+def participantPages(page_size: int = READ_BATCH):
+    """uids of every account, READ_BATCH at a time, paging through auth.list_users"""
+    page = auth.list_users(max_results=1000)
+    uids = []
+    while page:
+        uids.extend(user.uid for user in page.users)
+        while len(uids) >= page_size:
+            yield uids[:page_size]
+            uids = uids[page_size:]
+        page = page.get_next_page()
+    if uids:
+        yield uids
+
+def _latest(current, candidate):
+    return candidate if candidate and (current is None or candidate > current) else current
+
+def updateTimes(db, uids: list, keys=EXPORT_DOCUMENTS) -> dict:
+    """uid -> newest update_time across the exported documents, read with a field mask"""
+    latest = {uid: None for uid in uids}
+    shards = []
+    refs = [db.collection(uid).document(key) for uid in uids for key in keys]
+    for snapshot in db.get_all(refs, field_paths=["Schema", "Months"]):
+        uid = snapshot.reference.parent.id
+        latest[uid] = _latest(latest[uid], snapshot.update_time)
+        head = snapshot.to_dict()
+        if snapshot.id == "Calendar" and isSharded(head):
+            shards += [(uid, monthRef(db, uid, month)) for month in head.get("Months", {})]
+    for i in range(0, len(shards), READ_BATCH):
+        owners = {ref.path: uid for uid, ref in shards[i:i + READ_BATCH]}
+        for snapshot in db.get_all([ref for _, ref in shards[i:i + READ_BATCH]], field_paths=["Schema"]):
+            uid = owners[snapshot.reference.path]
+            latest[uid] = _latest(latest[uid], snapshot.update_time)
+    return latest
+
+def readParticipants(db, uids: list, keys=EXPORT_DOCUMENTS) -> dict:
+    """uid -> {key: document} for the requested documents, with month shards and responses merged in"""
+    documents = {uid: {key: {} for key in keys} for uid in uids}
+    refs = [db.collection(uid).document(key) for uid in uids for key in keys]
+    shards = {}
+    for snapshot in db.get_all(refs):
+        uid = snapshot.reference.parent.id
+        data = snapshot.to_dict() or {}
+        if snapshot.id == "Calendar" and isSharded(data):
+            for month in data.get("Months", {}):
+                ref = monthRef(db, uid, month)
+                shards[ref.path] = (uid, ref)
+            data = {}
+        elif snapshot.id == "Calendar" and isPacked(data):
+            data = decodeCalendar(data)
+        elif snapshot.id == "Location" and "Buckets" in data:
+            data = {datetime.fromtimestamp(ms / 1000, timezone.utc).isoformat(): {"lat": lat, "lng": lng}
+                    for ms, lat, lng in readAllFixes(db, uid, data["Buckets"])}
+        documents[uid][snapshot.id] = data
+    if "Questionnaires" in keys:
+        for i in range(0, len(uids), IN_QUERY_LIMIT):
+            query = db.collection(RESPONSES_COLLECTION).where(
+                filter=firestore.FieldFilter("uid", "in", uids[i:i + IN_QUERY_LIMIT]))
+            for snapshot in query.stream():
+                response = snapshot.to_dict()
+                records = documents[response["uid"]]["Questionnaires"].setdefault(response["questionnaire"], {})
+                records.setdefault("Record", {})[response["submitted"].isoformat()] = response["answers"]
+    shardList = list(shards.values())
+    for i in range(0, len(shardList), READ_BATCH):
+        for snapshot in db.get_all([ref for _, ref in shardList[i:i + READ_BATCH]]):
+            documents[shards[snapshot.reference.path][0]]["Calendar"].update(snapshot.to_dict() or {})
+    return documents
+
+def loadState(outDir: str) -> dict:
+    path = os.path.join(outDir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def saveState(outDir: str, state: dict):
+    path = os.path.join(outDir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def exportParticipants(outDir: str, fmt: str = "csv", datasets=tuple(COLUMNS), incremental: bool = False,
+                       uids: list = None) -> dict:
+    """Stream participant data into one file per dataset under outDir/<run>/
+
+    Only the documents the datasets need are read. In incremental mode only participants
+    whose documents changed since the previous run are exported; the per-participant update
+    times are kept in outDir/export_state.json, and a run with other datasets starts over.
+    Every account is exported unless uids are given. Returns the run directory and row counts.
+    """
+    db = firestore.client()
+    keys = tuple(key for key in EXPORT_DOCUMENTS if key in {DATASET_DOCUMENTS[name] for name in datasets})
+    state = loadState(outDir) if incremental else {}
+    seen = dict(state.get("participants", {})) if state.get("datasets") == sorted(datasets) else {}
+    os.makedirs(outDir, exist_ok=True)
+    runDir = tempfile.mkdtemp(prefix=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ-"), dir=outDir)
+    writers = {name: ChunkWriter(os.path.join(runDir, f"{name}.{fmt}"), COLUMNS[name], fmt) for name in datasets}
+    flatteners = {"calendar": calendarRows, "questionnaires": questionnaireRows, "location": locationRows}
+    exported = skipped = 0
+
+    try:
+        pages = participantPages() if uids is None else (uids[i:i + READ_BATCH] for i in range(0, len(uids), READ_BATCH))
+        for page in pages:
+            if incremental:
+                times = updateTimes(db, page, keys)
+                changed = [uid for uid in page
+                           if times[uid] is not None and times[uid].isoformat() != seen.get(uid)]
+                skipped += len(page) - len(changed)
+                page = changed
+                seen |= {uid: times[uid].isoformat() for uid in changed}
+            if not page:
+                continue
+            for uid, documents in readParticipants(db, page, keys).items():
+                for name, writer in writers.items():
+                    writer.write(flatteners[name](uid, documents[DATASET_DOCUMENTS[name]]))
+            exported += len(page)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    if incremental:
+        saveState(outDir, {"participants": seen, "datasets": sorted(datasets), "last_run": os.path.basename(runDir)})
+    return {"run": runDir, "participants": exported, "unchanged": skipped,
+            "rows": {name: writer.written for name, writer in writers.items()}}
+
+def zipDirectory(path: str, dest: str) -> str:
+    """Zip the files of a directory into dest, returns dest"""
+    with zipfile.ZipFile(dest, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name in sorted(os.listdir(path)):
+            archive.write(os.path.join(path, name), name)
+    return dest
+
+def prepareArchive(prepared: dict, fmt: str, datasets: list) -> str:
+    """Job step exporting into a temporary directory and zipping the run, recorded in `prepared`"""
+    with tempfile.TemporaryDirectory() as outDir:
+        result = exportParticipants(outDir, fmt, datasets)
+        fd, archive = tempfile.mkstemp(prefix="digipredict-export-", suffix=".zip")
+        os.close(fd)
+        zipDirectory(result["run"], archive)
+    prepared |= {"archive": archive, "name": f"digipredict-{os.path.basename(result['run'])}.zip"}
+    # The export was replaced while it ran, nobody will download it
+    if prepared.get("discarded"):
+        os.remove(archive)
+    return (f"{result['participants']} participants, "
+            + ", ".join(f"{rows} {name} rows" for name, rows in result["rows"].items()))
+
+def discardArchive():
+    """Delete the prepared archive and forget it, once downloaded or replaced"""
+    prepared = st.session_state.pop("export", None)
+    if prepared is None:
+        return
+    prepared["discarded"] = True
+    path = prepared.get("archive")
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Export Participant Data")
+    st.info("Calendar, questionnaire records and location data for every participant")
+
+    datasets = st.multiselect("Datasets", list(COLUMNS), default=list(COLUMNS))
+    fmt = st.radio("Format", formats(), horizontal=True)
+    if pq is None:
+        st.caption("Install pyarrow to export Parquet")
+
+    if st.button("Prepare Export"):
+        if not datasets:
+            st.error("Select at least one dataset")
+            return
+        discardArchive()
+        # Only the path is kept in the session, the archive itself stays on disk
+        prepared = st.session_state.export = {}
+        submitJob(f"Exporting {', '.join(datasets)}",
+                  [("Exporting participants", lambda: prepareArchive(prepared, fmt, datasets))])
+
+    showJobs()
+    prepared = st.session_state.get("export") or {}
+    archive = prepared.get("archive")
+    if archive and os.path.exists(archive):
+        with open(archive, "rb") as f:
+            st.download_button("Download Export", f, file_name=prepared["name"],
+                               mime="application/zip", on_click=discardArchive)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Export participant data to CSV or Parquet")
+    parser.add_argument("out", help="Output directory, each run writes a timestamped folder inside it")
+    parser.add_argument("uids", nargs="*", help="Participants to export (default: every account)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--datasets", nargs="+", choices=list(COLUMNS), default=list(COLUMNS))
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only export participants changed since the previous incremental run")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and pq is None:
+        parser.error("--format parquet needs pyarrow")
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    result = exportParticipants(args.out, args.format, args.datasets, args.incremental, args.uids or None)
+    print(f"{result['run']}: {result['participants']} participants exported, {result['unchanged']} unchanged")
+    for name, rows in result["rows"].items():
+        print(f"  {name}: {rows} rows")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
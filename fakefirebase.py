@@ -0,0 +1,764 @@
+import copy
+import json
+import secrets
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from enum import Enum
+
+# In-memory stand-in for firebase_admin.auth and firestore, used by the tests and benchmarks and
+# local development (DIGIPREDICT_BACKEND=fake). Every call that would be a network
+# request counts as one round-trip and can be slowed down with a simulated latency.
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+class NotFound(Exception):
+    pass
+
+class AlreadyExists(Exception):
+    pass
+
+class FailedPrecondition(Exception):
+    pass
+
+class LastUpdateOption:
+    """Write precondition returned by client.write_option(last_update_time=...)"""
+    def __init__(self, last_update_time):
+        self._last_update_time = last_update_time
+
+class FakeStats:
+    """Round-trip, read, write and payload counters of a FakeFirebase"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = Counter()
+            self.roundTrips = 0
+            self.reads = 0
+            self.writes = 0
+            self.bytes = 0
+
+    def record(self, op: str, reads: int = 0, writes: int = 0, payload=None):
+        size = len(json.dumps(payload, default=str)) if payload is not None else 0
+        with self._lock:
+            self.calls[op] += 1
+            self.roundTrips += 1
+            self.reads += reads
+            self.writes += writes
+            self.bytes += size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"round_trips": self.roundTrips, "reads": self.reads, "writes": self.writes,
+                    "bytes": self.bytes, "calls": dict(self.calls)}
+
+class FakeFirebase:
+    """Backend holding users and documents in memory"""
+    name = "fake"
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.stats = FakeStats()
+        self.lock = threading.RLock()
+        self.auth = FakeAuth(self)
+        self.firestore = FakeFirestore(self)
+
+    def roundTrip(self, op: str, reads: int = 0, writes: int = 0, payload=None):
+        self.stats.record(op, reads, writes, payload)
+        if self.latency:
+            time.sleep(self.latency)
+
+# ---------------------------------------------------------------- auth
+
+class UserNotFoundError(Exception):
+    pass
+
+class EmailAlreadyExistsError(Exception):
+    pass
+
+class UidAlreadyExistsError(Exception):
+    pass
+
+def _validateEmail(email: str) -> str:
+    if not isinstance(email, str) or "@" not in email or email.startswith("@") or email.endswith("@"):
+        raise ValueError(f'Malformed email address string: "{email}".')
+    return email
+
+class UserMetadata:
+    def __init__(self, creation_timestamp=None, last_sign_in_timestamp=None):
+        self.creation_timestamp = creation_timestamp
+        self.last_sign_in_timestamp = last_sign_in_timestamp
+
+class UserRecord:
+    def __init__(self, uid: str, email: str = None, disabled: bool = False):
+        self.uid = uid
+        self.email = email
+        self.disabled = disabled
+        self.user_metadata = UserMetadata(int(time.time() * 1000))
+
+class EmailIdentifier:
+    def __init__(self, email: str):
+        self.email = _validateEmail(email)
+
+class UidIdentifier:
+    def __init__(self, uid: str):
+        self.uid = uid
+
+class ImportUserRecord:
+    def __init__(self, uid: str, email: str = None, password_hash: bytes = None,
+                 password_salt: bytes = None, **kwargs):
+        if email is not None:
+            _validateEmail(email)
+        self.uid = uid
+        self.email = email
+        self.password_hash = password_hash
+        self.password_salt = password_salt
+
+class UserImportHash:
+    @staticmethod
+    def pbkdf2_sha256(rounds: int):
+        return {"name": "PBKDF2_SHA256", "rounds": rounds}
+
+class ErrorInfo:
+    def __init__(self, index: int, reason: str):
+        self.index = index
+        self.reason = reason
+
+class BulkResult:
+    def __init__(self, success_count: int, errors: list):
+        self.success_count = success_count
+        self.failure_count = len(errors)
+        self.errors = errors
+
+class GetUsersResult:
+    def __init__(self, users: list, not_found: list):
+        self.users = users
+        self.not_found = not_found
+
+class ListUsersPage:
+    def __init__(self, auth, users: list, next_page_token: str, max_results: int):
+        self._auth = auth
+        self._max_results = max_results
+        self.users = users
+        self.next_page_token = next_page_token
+        self.has_next_page = bool(next_page_token)
+
+    def get_next_page(self):
+        if not self.has_next_page:
+            return None
+        return self._auth.list_users(self.next_page_token, self._max_results)
+
+    def iterate_all(self):
+        page = self
+        while page:
+            yield from page.users
+            page = page.get_next_page()
+
+class FakeAuth:
+    """The subset of firebase_admin.auth the portal uses"""
+    UserNotFoundError = UserNotFoundError
+    EmailAlreadyExistsError = EmailAlreadyExistsError
+    UidAlreadyExistsError = UidAlreadyExistsError
+    UserRecord = UserRecord
+    EmailIdentifier = EmailIdentifier
+    UidIdentifier = UidIdentifier
+    ImportUserRecord = ImportUserRecord
+    UserImportHash = UserImportHash
+
+    def __init__(self, fb: FakeFirebase):
+        self._fb = fb
+        self._users = {}
+        self._emails = {}
+
+    def _add(self, uid: str, email: str):
+        if uid in self._users:
+            raise UidAlreadyExistsError(f"The user with the provided uid already exists ({uid}).")
+        if email and email.lower() in self._emails:
+            raise EmailAlreadyExistsError(f"The user with the provided email already exists ({email}).")
+        user = UserRecord(uid, email.lower() if email else None)
+        self._users[uid] = user
+        if email:
+            self._emails[email.lower()] = uid
+        return user
+
+    def get_user_by_email(self, email: str):
+        _validateEmail(email)
+        self._fb.roundTrip("auth.get_user_by_email")
+        with self._fb.lock:
+            uid = self._emails.get(email.lower())
+            if uid is None:
+                raise UserNotFoundError(f"No user record found for the provided email: {email}.")
+            return self._users[uid]
+
+    def get_user(self, uid: str):
+        self._fb.roundTrip("auth.get_user")
+        with self._fb.lock:
+            if uid not in self._users:
+                raise UserNotFoundError(f"No user record found for the provided user ID: {uid}.")
+            return self._users[uid]
+
+    def get_users(self, identifiers: list):
+        if len(identifiers) > 100:
+            raise ValueError("`identifiers` parameter must have <= 100 entries.")
+        self._fb.roundTrip("auth.get_users")
+        found, missing = [], []
+        with self._fb.lock:
+            for identifier in identifiers:
+                if isinstance(identifier, EmailIdentifier):
+                    uid = self._emails.get(identifier.email.lower())
+                else:
+                    uid = identifier.uid if identifier.uid in self._users else None
+                if uid is None:
+                    missing.append(identifier)
+                else:
+                    found.append(self._users[uid])
+        return GetUsersResult(found, missing)
+
+    def create_user(self, email: str = None, password: str = None, uid: str = None, **kwargs):
+        if email is not None:
+            _validateEmail(email)
+        if password is not None and len(password) < 6:
+            raise ValueError("Invalid password string. Password must be a string at least 6 characters long.")
+        self._fb.roundTrip("auth.create_user")
+        with self._fb.lock:
+            return self._add(uid or secrets.token_urlsafe(21)[:28], email)
+
+    def import_users(self, users: list, hash_alg=None):
+        if len(users) > 1000:
+            raise ValueError("Users must be a non-empty list with no more than 1000 elements.")
+        if any(user.password_hash for user in users) and hash_alg is None:
+            raise ValueError("A UserImportHash is required to import users with passwords.")
+        self._fb.roundTrip("auth.import_users")
+        errors = []
+        with self._fb.lock:
+            for index, user in enumerate(users):
+                try:
+                    self._add(user.uid, user.email)
+                except (UidAlreadyExistsError, EmailAlreadyExistsError) as e:
+                    errors.append(ErrorInfo(index, str(e)))
+        return BulkResult(len(users) - len(errors), errors)
+
+    def delete_user(self, uid: str):
+        self._fb.roundTrip("auth.delete_user")
+        with self._fb.lock:
+            if uid not in self._users:
+                raise UserNotFoundError(f"No user record found for the provided user ID: {uid}.")
+            self._remove(uid)
+
+    def delete_users(self, uids: list):
+        if len(uids) > 1000:
+            raise ValueError("`uids` paramter must have <= 1000 entries.")
+        self._fb.roundTrip("auth.delete_users")
+        with self._fb.lock:
+            for uid in uids:
+                self._remove(uid)
+        return BulkResult(len(uids), [])
+
+    def _remove(self, uid: str):
+        user = self._users.pop(uid, None)
+        if user and user.email:
+            self._emails.pop(user.email.lower(), None)
+
+    def list_users(self, page_token: str = None, max_results: int = 1000):
+        if not 1 <= max_results <= 1000:
+            raise ValueError("Max results must be a positive integer less than or equal to 1000.")
+        self._fb.roundTrip("auth.list_users")
+        with self._fb.lock:
+            uids = sorted(self._users)
+            start = uids.index(page_token) + 1 if page_token in self._users else 0
+            users = [self._users[uid] for uid in uids[start:start + max_results]]
+        nextToken = users[-1].uid if start + max_results < len(uids) else ""
+        return ListUsersPage(self, users, nextToken, max_results)
+
+# ---------------------------------------------------------------- firestore
+
+def _splitPath(fieldPath: str) -> list:
+    return fieldPath.split(".")
+
+def _getField(data: dict, fieldPath: str):
+    value = data
+    for part in _splitPath(fieldPath):
+        if not isinstance(value, dict) or part not in value:
+            raise KeyError(fieldPath)
+        value = value[part]
+    return value
+
+def _resolve(value, existing=None):
+    """Replace write sentinels with the values Firestore would store"""
+    if value is SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, Increment):
+        return (existing if isinstance(existing, (int, float)) else 0) + value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items() if v is not DELETE_FIELD}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v) for v in value]
+    return copy.deepcopy(value)
+
+def _setField(data: dict, fieldPath: str, value):
+    parts = _splitPath(fieldPath)
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _resolve(value, data.get(parts[-1]))
+
+def _merge(data: dict, updates: dict):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        elif value is DELETE_FIELD:
+            data.pop(key, None)
+        else:
+            data[key] = _resolve(value, data.get(key))
+
+class FieldFilter:
+    def __init__(self, field_path: str, op_string: str, value=None):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: isinstance(a, list) and b in a,
+    "array_contains_any": lambda a, b: isinstance(a, list) and any(v in a for v in b),
+}
+
+class FakeFirestore:
+    """The subset of firebase_admin.firestore the portal uses"""
+    DELETE_FIELD = DELETE_FIELD
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    Increment = Increment
+    FieldFilter = FieldFilter
+
+    class Query:
+        ASCENDING = "ASCENDING"
+        DESCENDING = "DESCENDING"
+
+    def __init__(self, fb: FakeFirebase):
+        self._client = FakeClient(fb)
+
+    def client(self, app=None):
+        return self._client
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, fieldPath: str):
+        return copy.deepcopy(_getField(self._data or {}, fieldPath))
+
+class ChangeType(Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class DocumentChange:
+    def __init__(self, type: ChangeType, document: DocumentSnapshot, old_index: int = -1, new_index: int = -1):
+        self.type = type
+        self.document = document
+        self.old_index = old_index
+        self.new_index = new_index
+
+class Watch:
+    """Handle returned by on_snapshot"""
+    def __init__(self, client, listenerId: int):
+        self._client = client
+        self._id = listenerId
+        self._closed = False
+
+    @property
+    def is_active(self):
+        return not self._closed
+
+    def close(self, reason=None):
+        """Stop delivering changes, as the server ending the stream does"""
+        self.unsubscribe()
+
+    def unsubscribe(self):
+        with self._client._fb.lock:
+            self._client._listeners.pop(self._id, None)
+        self._closed = True
+
+class FakeClient:
+    def __init__(self, fb: FakeFirebase):
+        self._fb = fb
+        self._docs = {}
+        self._listeners = {}
+        self._listenerIds = iter(range(1, 1 << 62))
+
+    def collection(self, *path: str):
+        return CollectionReference(self, tuple("/".join(path).split("/")))
+
+    def document(self, *path: str):
+        parts = tuple("/".join(path).split("/"))
+        return CollectionReference(self, parts[:-1]).document(parts[-1])
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def write_option(self, last_update_time=None):
+        return LastUpdateOption(last_update_time)
+
+    def collections(self):
+        self._fb.roundTrip("firestore.list_collections")
+        with self._fb.lock:
+            names = sorted({path[0] for path in self._docs})
+        return [CollectionReference(self, (name,)) for name in names]
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        self._fb.roundTrip("firestore.batch_get", reads=len(references))
+        with self._fb.lock:
+            snapshots = [self._snapshot(ref, field_paths) for ref in references]
+        yield from snapshots
+
+    def _snapshot(self, ref, field_paths=None):
+        entry = self._docs.get(ref._path)
+        if entry is None:
+            return DocumentSnapshot(ref, None)
+        data = entry["data"]
+        if field_paths is not None:
+            # A field mask returns only the listed fields that exist, plus the metadata
+            data = {}
+            for fieldPath in field_paths:
+                if _hasField(entry["data"], fieldPath):
+                    _setField(data, fieldPath, _getField(entry["data"], fieldPath))
+        return DocumentSnapshot(ref, copy.deepcopy(data), entry["create_time"], entry["update_time"])
+
+    def _listen(self, path: tuple, isCollection: bool, callback) -> Watch:
+        """Register a listener and deliver its initial snapshot, as Firestore does on subscribe"""
+        self._fb.roundTrip("firestore.listen")
+        with self._fb.lock:
+            listenerId = next(self._listenerIds)
+            self._listeners[listenerId] = (path, isCollection, callback)
+            if isCollection:
+                snapshots = self._collectionSnapshots(path)
+            else:
+                snapshots = [self._snapshot(DocumentReference(self, path))]
+        changes = [DocumentChange(ChangeType.ADDED, snapshot, -1, i)
+                   for i, snapshot in enumerate(snapshots) if snapshot.exists]
+        callback(snapshots, changes, datetime.now(timezone.utc))
+        return Watch(self, listenerId)
+
+    def _collectionSnapshots(self, path: tuple) -> list:
+        depth = len(path) + 1
+        return [self._snapshot(DocumentReference(self, p))
+                for p in sorted(p for p in self._docs if len(p) == depth and p[:-1] == path)]
+
+    def _notify(self, before: dict):
+        """Call the listeners of every document a commit changed, after the lock is released"""
+        deliveries = []
+        with self._fb.lock:
+            for path, isCollection, callback in list(self._listeners.values()):
+                changed = [p for p in before if (p[:-1] if isCollection else p) == path]
+                if not changed:
+                    continue
+                changes = []
+                for p in changed:
+                    snapshot = self._snapshot(DocumentReference(self, p))
+                    if snapshot.exists:
+                        changes.append(DocumentChange(ChangeType.MODIFIED if before[p] else ChangeType.ADDED, snapshot))
+                    elif before[p]:
+                        changes.append(DocumentChange(ChangeType.REMOVED, snapshot))
+                snapshots = self._collectionSnapshots(path) if isCollection else [self._snapshot(DocumentReference(self, path))]
+                deliveries.append((callback, snapshots, changes))
+        now = datetime.now(timezone.utc)
+        for callback, snapshots, changes in deliveries:
+            try:
+                callback(snapshots, changes, now)
+            except Exception as e:
+                print(f"Snapshot listener failed: {e}")
+
+    def _apply(self, writes: list):
+        """Apply (op, ref, data, options) writes atomically"""
+        with self._fb.lock:
+            for op, ref, data, options in writes:
+                exists = ref._path in self._docs
+                if op == "update" and not exists:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if op == "create" and exists:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+                option = options.get("option")
+                if option is not None and self._docs[ref._path]["update_time"] != option._last_update_time:
+                    raise FailedPrecondition(f"Document changed since {option._last_update_time}: {ref.path}")
+            now = datetime.now(timezone.utc)
+            before = {ref._path: ref._path in self._docs for _, ref, _, _ in writes}
+            for op, ref, data, options in writes:
+                entry = self._docs.get(ref._path)
+                if op == "delete":
+                    self._docs.pop(ref._path, None)
+                    continue
+                if entry is None:
+                    entry = self._docs[ref._path] = {"data": {}, "create_time": now}
+                if op == "update":
+                    for fieldPath, value in data.items():
+                        _setField(entry["data"], fieldPath, value)
+                elif options.get("merge"):
+                    _merge(entry["data"], data)
+                else:
+                    entry["data"] = _resolve(data)
+                entry["update_time"] = now
+        if self._listeners:
+            self._notify(before)
+
+class CollectionReference:
+    def __init__(self, client: FakeClient, path: tuple):
+        self._client = client
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return DocumentReference(self._client, self._path[:-1]) if len(self._path) > 1 else None
+
+    def document(self, document_id: str = None):
+        return DocumentReference(self._client, self._path + (document_id or secrets.token_hex(10),))
+
+    def add(self, document_data: dict, document_id: str = None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self, page_size=None):
+        fb = self._client._fb
+        fb.roundTrip("firestore.list_documents")
+        depth = len(self._path) + 1
+        with fb.lock:
+            ids = sorted({path[depth - 1] for path in self._client._docs
+                          if len(path) >= depth and path[:depth - 1] == self._path})
+        return [self.document(i) for i in ids]
+
+    def _query(self):
+        return Query(self)
+
+    def on_snapshot(self, callback):
+        """Call callback(snapshots, changes, read_time) now and whenever a document of the collection changes"""
+        return self._client._listen(self._path, True, callback)
+
+    def where(self, field_path: str = None, op_string: str = None, value=None, *, filter=None):
+        return self._query().where(field_path, op_string, value, filter=filter)
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._query().order_by(field_path, direction)
+
+    def limit(self, count: int):
+        return self._query().limit(count)
+
+    def start_after(self, document_fields):
+        return self._query().start_after(document_fields)
+
+    def select(self, field_paths):
+        return self._query().select(field_paths)
+
+    def stream(self, transaction=None):
+        return self._query().stream()
+
+    def get(self, transaction=None):
+        return self._query().get()
+
+class Query:
+    def __init__(self, collection: CollectionReference, filters=(), orders=(), count=None, after=None,
+                 fields=None):
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._count = count
+        self._after = after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = {"filters": self._filters, "orders": self._orders, "count": self._count, "after": self._after,
+                 "fields": self._fields}
+        return Query(self._collection, **(state | changes))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def where(self, field_path: str = None, op_string: str = None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        if op_string not in _OPERATORS:
+            raise ValueError(f"Operator string {op_string!r} is invalid.")
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(count=count)
+
+    def start_after(self, document_fields):
+        # A snapshot cursor also carries its path, which breaks ties between equal order values
+        if isinstance(document_fields, DocumentSnapshot):
+            return self._copy(after=(document_fields._data, document_fields.reference._path))
+        return self._copy(after=(document_fields, None))
+
+    def _matches(self, data: dict) -> bool:
+        for fieldPath, op, value in self._filters:
+            try:
+                if not _OPERATORS[op](_getField(data, fieldPath), value):
+                    return False
+            except (KeyError, TypeError):
+                return False
+        return True
+
+    def _run(self):
+        client = self._collection._client
+        path = self._collection._path
+        with client._fb.lock:
+            snapshots = [client._snapshot(DocumentReference(client, docPath))
+                         for docPath in sorted(client._docs)
+                         if len(docPath) == len(path) + 1 and docPath[:-1] == path]
+        snapshots = [s for s in snapshots if self._matches(s._data)]
+        for fieldPath, direction in reversed(self._orders):
+            snapshots = [s for s in snapshots if _hasField(s._data, fieldPath)]
+            snapshots.sort(key=lambda s: _getField(s._data, fieldPath), reverse=direction == "DESCENDING")
+        if self._after is not None and self._orders:
+            keyOf = lambda data: tuple(_getField(data, f) for f, _ in self._orders)
+            afterData, afterPath = self._after
+            after = keyOf(afterData)
+            descending = self._orders[0][1] == "DESCENDING"
+
+            def isAfter(s):
+                key = keyOf(s._data)
+                if key == after:
+                    return afterPath is not None and s.reference._path > afterPath
+                return key < after if descending else key > after
+            snapshots = [s for s in snapshots if isAfter(s)]
+        if self._count is not None:
+            snapshots = snapshots[:self._count]
+        if self._fields is not None:
+            with client._fb.lock:
+                snapshots = [client._snapshot(s.reference, self._fields) for s in snapshots]
+        client._fb.roundTrip("firestore.run_query", reads=max(1, len(snapshots)))
+        return snapshots
+
+    def stream(self, transaction=None):
+        yield from self._run()
+
+    def get(self, transaction=None):
+        return self._run()
+
+def _hasField(data: dict, fieldPath: str) -> bool:
+    try:
+        _getField(data, fieldPath)
+        return True
+    except KeyError:
+        return False
+
+class DocumentReference:
+    def __init__(self, client: FakeClient, path: tuple):
+        self._client = client
+        self._path = path
+        self.id = path[-1]
+        self.path = "/".join(path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._path[:-1])
+
+    def collection(self, collection_id: str):
+        return CollectionReference(self._client, self._path + (collection_id,))
+
+    def collections(self):
+        fb = self._client._fb
+        fb.roundTrip("firestore.list_collections")
+        depth = len(self._path)
+        with fb.lock:
+            names = sorted({path[depth] for path in self._client._docs
+                            if len(path) > depth + 1 and path[:depth] == self._path})
+        return [self.collection(name) for name in names]
+
+    def _write(self, op: str, data=None, **options):
+        self._client._fb.roundTrip(f"firestore.{op}", writes=1, payload=data)
+        self._client._apply([(op, self, data, options)])
+
+    def set(self, document_data: dict, merge: bool = False):
+        self._write("set", document_data, merge=merge)
+
+    def create(self, document_data: dict):
+        self._write("create", document_data)
+
+    def update(self, field_updates: dict, option=None):
+        self._write("update", field_updates, option=option)
+
+    def delete(self):
+        self._write("delete")
+
+    def get(self, field_paths=None, transaction=None):
+        fb = self._client._fb
+        fb.roundTrip("firestore.get", reads=1)
+        with fb.lock:
+            return self._client._snapshot(self, field_paths)
+
+    def on_snapshot(self, callback):
+        """Call callback([snapshot], changes, read_time) now and whenever the document changes"""
+        return self._client._listen(self._path, False, callback)
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+class WriteBatch:
+    def __init__(self, client: FakeClient):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._writes.append(("set", reference, document_data, {"merge": merge}))
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(("create", reference, document_data, {}))
+
+    def update(self, reference, field_updates: dict, option=None):
+        self._writes.append(("update", reference, field_updates, {"option": option}))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, {}))
+
+    def commit(self):
+        if len(self._writes) > 500:
+            raise ValueError("maximum 500 writes allowed per request")
+        self._client._fb.roundTrip("firestore.commit", writes=len(self._writes),
+                                   payload=[data for _, _, data, _ in self._writes])
+        self._client._apply(self._writes)
+        self._writes = []
@@ -0,0 +1,53 @@
+import threading
+import time
+from backend import auth
+
+# How long a resolved email -> UserRecord stays valid; accounts are rarely changed outside the portal
+USER_CACHE_TTL = 300
+
+_users = {}
+_lock = threading.Lock()
+
+def _key(email: str) -> str:
+    return email.strip().lower()
+
+def getUserByEmail(email: str):
+    """auth.get_user_by_email with a TTL cache, missing users are not cached"""
+    key = _key(email)
+    now = time.monotonic()
+    with _lock:
+        cached = _users.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    user = auth.get_user_by_email(email)
+    with _lock:
+        _users[key] = (now + USER_CACHE_TTL, user)
+    return user
+
+def createUser(**kwargs):
+    """auth.create_user that primes the cache with the new account"""
+    user = auth.create_user(**kwargs)
+    if user.email:
+        with _lock:
+            _users[_key(user.email)] = (time.monotonic() + USER_CACHE_TTL, user)
+    return user
+
+def deleteUsers(uids: list):
+    """auth.delete_users that drops the deleted accounts from the cache"""
+    result = auth.delete_users(uids)
+    invalidate(uids=uids)
+    return result
+
+def invalidate(email: str = None, uids: list = None):
+    """Forget cached users by email or uid, or everything when called without arguments"""
+    with _lock:
+        if email is None and uids is None:
+            _users.clear()
+            return
+        if email is not None:
+            _users.pop(_key(email), None)
+        if uids:
+            uids = set(uids)
+            for key in [k for k, (_, user) in _users.items() if user.uid in uids]:
+                del _users[key]
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from audit import bindActor
+from tracing import span
+
+MAX_WORKERS = 4
+# Finished jobs are kept this long; resubmitting the same idempotency key inside
+# the window returns the existing job instead of writing again
+JOB_RETENTION = 600
+POLL_INTERVAL = 1
+
+class Job:
+    """A submission running on the shared executor"""
+    def __init__(self, label: str, key: str, steps: int):
+        self.id = uuid.uuid4().hex[:12]
+        self.label = label
+        self.key = key
+        self.steps = steps
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "Waiting to start"
+        self.results = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.trace = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+class JobRunner:
+    """Thread pool plus a registry of jobs, shared by every session"""
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="portal-job")
+        self.jobs = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def submit(self, label: str, steps: list, key: str = None) -> Job:
+        """Queue (message, callable) steps, reusing a live job with the same idempotency key"""
+        with self.lock:
+            self._prune()
+            existing = self.jobs.get(self.keys.get(key)) if key else None
+            if existing and existing.status != "failed":
+                return existing
+            job = Job(label, key, len(steps))
+            self.jobs[job.id] = job
+            if key:
+                self.keys[key] = job.id
+        self.executor.submit(self._run, job, steps)
+        return job
+
+    def get(self, jobId: str) -> Job:
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for jobId in [j.id for j in self.jobs.values() if j.done and j.finished < cutoff]:
+            job = self.jobs.pop(jobId)
+            if self.keys.get(job.key) == jobId:
+                del self.keys[job.key]
+
+    def _run(self, job: Job, steps: list):
+        job.status = "running"
+        try:
+            with span(job.label, job=job.id) as job.trace:
+                for i, (message, step) in enumerate(steps):
+                    job.message = message
+                    result = step()
+                    if result:
+                        job.results.append(result)
+                    job.progress = (i + 1) / len(steps)
+            job.status = "done"
+            job.message = "Finished"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+        finally:
+            job.finished = time.time()
+
+@st.cache_resource
+def jobRunner() -> JobRunner:
+    return JobRunner()
+
+def idempotencyKey(*parts) -> str:
+    """Stable key for a submission built from its form values"""
+    return hashlib.sha256(json.dumps(parts, default=str, sort_keys=True).encode()).hexdigest()
+
+def submitJob(label: str, steps: list, key: str = None) -> Job:
+    """Dispatch a submission and remember it in this session"""
+    # Steps run on the shared pool, so the clinician who submitted them is carried along for the audit log
+    steps = [(message, bindActor(step)) for message, step in steps]
+    job = jobRunner().submit(label, steps, key)
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = []
+    if job.id not in st.session_state.jobs:
+        st.session_state.jobs.append(job.id)
+    return job
+
+def renderJob(job: Job):
+    state = {"done": "complete", "failed": "error"}.get(job.status, "running")
+    with st.status(f"{job.label} ({job.id})", state=state, expanded=not job.done):
+        if not job.done:
+            st.progress(job.progress, text=job.message)
+        for result in job.results:
+            st.write(result)
+        if job.error:
+            st.error(job.error)
+        if job.done and job.trace:
+            trace = job.trace.summary()
+            st.caption(f"{trace['calls']} Firebase calls, {trace['reads']} reads, {trace['writes']} writes, "
+                       f"{trace['firebase_ms']:.0f} ms in Firebase")
+
+def showJobs():
+    """Render this session's jobs, polling while any of them is still running"""
+    jobs = [job for job in map(jobRunner().get, st.session_state.get("jobs", [])) if job]
+    if not jobs:
+        return
+
+    st.subheader("Submissions")
+    if any(not job.done for job in jobs):
+        _pollJobs()
+    else:
+        for job in reversed(jobs):
+            renderJob(job)
+        if st.button("Clear Finished"):
+            st.session_state.jobs = []
+            st.rerun()
+
+@st.fragment(run_every=POLL_INTERVAL)
+def _pollJobs():
+    jobs = [job for job in map(jobRunner().get, st.session_state.get("jobs", [])) if job]
+    for job in reversed(jobs):
+        renderJob(job)
+    if all(job.done for job in jobs):
+        st.rerun()
@@ -0,0 +1,267 @@
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from calendarcodec import PACKED_SCHEMA, applyChanges, decodeCalendar, encodeCalendar, isPacked
+
+# Participant storage layouts:
+#   1 - one document per structure.json section, Calendar holds one field per study day
+#   2 - as 1, but Calendar only holds {"Schema": 2, "Months": {YYYY-MM: True}} and the
+#       days live in Calendar/Months/{YYYY-MM} documents
+#   3 - Calendar holds the whole study as per-task bitsets, see calendarcodec.py
+# New participants are written with DIGIPREDICT_SCHEMA (default 1); readers handle all three.
+SCHEMA_ENV = "DIGIPREDICT_SCHEMA"
+SCHEMA_V1 = 1
+SCHEMA_V2 = 2
+SCHEMA_V3 = PACKED_SCHEMA
+MONTHS_COLLECTION = "Months"
+READ_BATCH = 100
+# Read-modify-write attempts on a packed Calendar before giving up to the caller's retries
+PACKED_ATTEMPTS = 5
+
+def schemaVersion() -> int:
+    """Layout used for newly written participants"""
+    return int(os.environ.get(SCHEMA_ENV, SCHEMA_V1))
+
+def monthKey(day) -> str:
+    """YYYY-MM shard of a YYYY-MM-DD key or date"""
+    return day.strftime("%Y-%m") if isinstance(day, date) else day[:7]
+
+def monthsBetween(startDate: date, endDate: date) -> list:
+    """Every YYYY-MM shard touched by an inclusive date range"""
+    months = []
+    current = startDate.replace(day=1)
+    while current <= endDate:
+        months.append(monthKey(current))
+        current = (current + timedelta(days=32)).replace(day=1)
+    return months
+
+def shardCalendar(calendar: dict) -> dict:
+    """Group a day-keyed calendar into month shards"""
+    shards = {}
+    for day, tasks in calendar.items():
+        shards.setdefault(monthKey(day), {})[day] = tasks
+    return shards
+
+def taskPath(day: str, task: str) -> str:
+    """Field path of one task of a day-keyed Calendar, see changesByDay"""
+    return f"{day}.{task}"
+
+def changesByDay(fields: dict) -> dict:
+    """Day-keyed Calendar changes with task paths (YYYY-MM-DD.Task) grouped under their day"""
+    days = {}
+    for key, value in fields.items():
+        day, _, task = key.partition(".")
+        if task:
+            days.setdefault(day, {})[task] = value
+        else:
+            days[day] = value
+    return days
+
+def calendarRef(db, uid: str):
+    return db.collection(uid).document("Calendar")
+
+def monthRef(db, uid: str, month: str):
+    return calendarRef(db, uid).collection(MONTHS_COLLECTION).document(month)
+
+def isSharded(calendar: dict) -> bool:
+    return (calendar or {}).get("Schema") == SCHEMA_V2
+
+def calendarSchema(calendar: dict) -> int:
+    """Layout of a Calendar document"""
+    if isSharded(calendar):
+        return SCHEMA_V2
+    return SCHEMA_V3 if isPacked(calendar) else SCHEMA_V1
+
+def participantSchema(db, uid: str) -> int:
+    """Layout of an existing participant, read from the Calendar document"""
+    snapshot = calendarRef(db, uid).get(field_paths=["Schema"])
+    try:
+        return snapshot.get("Schema") if snapshot.exists else SCHEMA_V1
+    except KeyError:
+        return SCHEMA_V1
+
+def queueParticipantWrites(db, batch, uid: str, documents: dict, schema: int = None) -> int:
+    """Queue every document of a new participant on one batch, returns the number of writes"""
+    schema = schema or schemaVersion()
+    writes = 0
+    for key, document in documents.items():
+        if key == "Calendar" and schema == SCHEMA_V2:
+            shards = shardCalendar(document)
+            batch.set(calendarRef(db, uid), {"Schema": SCHEMA_V2, "Months": {m: True for m in shards}})
+            for month, days in shards.items():
+                batch.set(monthRef(db, uid, month), days)
+            writes += 1 + len(shards)
+        elif key == "Calendar" and schema == SCHEMA_V3:
+            batch.set(calendarRef(db, uid), encodeCalendar(document))
+            writes += 1
+        else:
+            batch.set(db.collection(uid).document(key), document)
+            writes += 1
+    return writes
+
+def participantWriteCount(documents: dict, schema: int = None) -> int:
+    """Writes queueParticipantWrites will need for a participant"""
+    schema = schema or schemaVersion()
+    if schema != SCHEMA_V2:
+        return len(documents)
+    return len(documents) + len(shardCalendar(documents.get("Calendar", {})))
+
+def calendarWrites(db, uid: str, fields: dict, schema: int) -> list:
+    """(doc_ref, field map, merge) writes applying Calendar changes in a layout
+
+    Changes are keyed by day or by task path. Month shards take them as nested maps, which
+    a merge write only applies to the tasks named. A packed Calendar cannot take field
+    writes, see applyPackedChanges.
+    """
+    if schema == SCHEMA_V3:
+        raise ValueError("Packed calendars are changed with applyPackedChanges")
+    if schema != SCHEMA_V2:
+        return [(calendarRef(db, uid), fields, False)]
+    shards = shardCalendar(changesByDay(fields))
+    added = {m: True for m, days in shards.items()
+             if any(v is not firestore.DELETE_FIELD for v in days.values())}
+    writes = [(monthRef(db, uid, month), days, True) for month, days in shards.items()]
+    if added:
+        writes.append((calendarRef(db, uid), {"Months": added}, True))
+    return writes
+
+def applyPackedChanges(db, uid: str, fields: dict, attempts: int = PACKED_ATTEMPTS) -> int:
+    """Apply day-keyed changes to a packed Calendar, returns the number of commits
+
+    The document is re-read and re-encoded on every attempt and written only if it has not
+    changed since that read, so tasks the app completes meanwhile are never overwritten.
+    """
+    ref = calendarRef(db, uid)
+    for attempt in range(1, attempts + 1):
+        snapshot = ref.get()
+        # Every top-level field of a packed document is replaced, which makes this update a rewrite
+        packed = applyChanges(snapshot.to_dict(), fields)
+        try:
+            ref.update(packed, option=db.write_option(last_update_time=snapshot.update_time))
+            return 1
+        except Exception as e:
+            conflict = any(cls.__name__ == "FailedPrecondition" for cls in type(e).__mro__)
+            if not conflict or attempt == attempts:
+                raise
+
+def _readShards(db, refsByUid: dict) -> dict:
+    """get_all month shards for several participants, batched"""
+    owners = {ref.path: uid for uid, refs in refsByUid.items() for ref in refs}
+    refs = [ref for refs in refsByUid.values() for ref in refs]
+    calendars = {uid: {} for uid in refsByUid}
+    for i in range(0, len(refs), READ_BATCH):
+        for snapshot in db.get_all(refs[i:i + READ_BATCH]):
+            if snapshot.exists:
+                calendars[owners[snapshot.reference.path]].update(snapshot.to_dict())
+    return calendars
+
+def expandCalendar(db, uid: str, calendar: dict) -> dict:
+    """Day-keyed calendar from a Calendar document, reading month shards when sharded"""
+    if isPacked(calendar):
+        return decodeCalendar(calendar)
+    if not isSharded(calendar):
+        return calendar or {}
+    months = sorted(calendar.get("Months", {}))
+    return _readShards(db, {uid: [monthRef(db, uid, m) for m in months]})[uid]
+
+def readCalendar(db, uid: str, startDate: date = None, endDate: date = None) -> dict:
+    """Day-keyed calendar of one participant, limited to a date range if given"""
+    return readCalendarWithSchema(db, uid, startDate, endDate)[0]
+
+def readCalendarWithSchema(db, uid: str, startDate: date = None, endDate: date = None):
+    """(calendar, schema) of one participant, the calendar limited to a date range if given
+
+    With a range only the Calendar document and the shards covering it are read,
+    in one round-trip.
+    """
+    months = monthsBetween(startDate, endDate) if startDate and endDate else []
+    refs = [calendarRef(db, uid)] + [monthRef(db, uid, m) for m in months]
+    snapshots = {s.reference.path: s for s in db.get_all(refs)}
+    head = snapshots[refs[0].path].to_dict() or {}
+
+    if isPacked(head):
+        calendar = decodeCalendar(head)
+    elif not isSharded(head):
+        calendar = head
+    elif months:
+        calendar = {}
+        for ref in refs[1:]:
+            calendar.update(snapshots[ref.path].to_dict() or {})
+    else:
+        calendar = expandCalendar(db, uid, head)
+
+    if startDate and endDate:
+        first, last = startDate.strftime("%Y-%m-%d"), endDate.strftime("%Y-%m-%d")
+        calendar = {day: tasks for day, tasks in calendar.items() if first <= day <= last}
+    return calendar, calendarSchema(head)
+
+def readCalendars(db, uids: list) -> dict:
+    """Full day-keyed calendars of many participants with batched get_all calls"""
+    heads = {}
+    for i in range(0, len(uids), READ_BATCH):
+        for snapshot in db.get_all([calendarRef(db, uid) for uid in uids[i:i + READ_BATCH]]):
+            heads[snapshot.reference.parent.id] = snapshot.to_dict() or {}
+
+    sharded = {uid: [monthRef(db, uid, m) for m in sorted(head.get("Months", {}))]
+               for uid, head in heads.items() if isSharded(head)}
+    shards = _readShards(db, sharded) if sharded else {}
+    return {uid: shards[uid] if uid in shards else expandCalendar(db, uid, heads.get(uid))
+            for uid in uids}
+
+def migrateParticipant(db, uid: str, dry_run: bool = False, target: int = SCHEMA_V2) -> str:
+    """Rewrite a participant's Calendar in the target layout (2 or 3) in one atomic batch"""
+    snapshot = calendarRef(db, uid).get()
+    if not snapshot.exists:
+        return "no calendar"
+    head = snapshot.to_dict() or {}
+    source = calendarSchema(head)
+    if source == target:
+        return "already migrated"
+
+    calendar = expandCalendar(db, uid, head)
+    shards = shardCalendar(calendar)
+    if dry_run:
+        return f"would migrate {len(calendar)} days from layout {source} to {target}"
+
+    batch = db.batch()
+    if target == SCHEMA_V2:
+        for month, days in shards.items():
+            batch.set(monthRef(db, uid, month), days)
+        batch.set(calendarRef(db, uid), {"Schema": SCHEMA_V2, "Months": {m: True for m in shards}})
+    else:
+        for month in head.get("Months", {}) if source == SCHEMA_V2 else ():
+            batch.delete(monthRef(db, uid, month))
+        batch.set(calendarRef(db, uid), encodeCalendar(calendar))
+    batch.commit()
+    return f"migrated {len(calendar)} days from layout {source} to {target}"
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate participants to the sharded or packed calendar layout")
+    parser.add_argument("uids", nargs="*", help="Participants to migrate (default: every account)")
+    parser.add_argument("--to", type=int, choices=(SCHEMA_V2, SCHEMA_V3), default=SCHEMA_V2, help="Target layout")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    db = firestore.client()
+    uids = args.uids or [user.uid for user in auth.list_users().iterate_all()]
+    failed = 0
+    for uid in uids:
+        try:
+            print(f"{uid}: {migrateParticipant(db, uid, args.dry_run, args.to)}")
+        except Exception as e:
+            failed += 1
+            print(f"{uid}: failed ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,218 @@
+import logging
+import threading
+import time
+import streamlit as st
+from backend import firestore
+from calendarcodec import decodeCalendar, isPacked
+from layout import calendarRef, isSharded
+
+# Participants' documents are kept current by one on_snapshot listener per watched
+# document (plus one on Calendar/Months once a participant is sharded), shared by every
+# session of the process. Only the documents pages show are listened to, so Location and
+# the other busy documents of the collection never reach the process. Pages read from
+# memory instead of Firestore, so any number of clinicians watching the same cohort cost
+# the same streams per participant.
+WATCHED_DOCUMENTS = ("Basic Info", "Calendar", "Questionnaires")
+# Listeners of participants no page has read for this long are closed. A listener the
+# server closed, or whose callback failed, is replaced the next time a page reads the
+# participant; until that succeeds pages are told how old the state they show is.
+IDLE_TIMEOUT = 1800
+INITIAL_SNAPSHOT_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+class ParticipantState:
+    """Materialised documents of one participant, replaced (never mutated) on every change"""
+    def __init__(self, uid: str):
+        self.uid = uid
+        self.documents = {}
+        self.months = {}
+        self.version = 0
+        self.lastRead = time.monotonic()
+        self.updated = None
+        self.error = None
+        self.ready = threading.Event()
+        self.watches = []
+        self.delivered = set()
+        self.monthsWatched = False
+        self._calendar = None
+
+    def closed(self) -> bool:
+        """Whether a listener stopped delivering changes, through a failed callback or a closed stream"""
+        return self.error is not None or not all(watch.is_active for watch in self.watches)
+
+    def age(self) -> float:
+        """Seconds since the last snapshot was delivered"""
+        return time.time() - self.updated if self.updated else float("inf")
+
+    def calendar(self) -> dict:
+        """Day-keyed calendar in either storage layout, merged once per version"""
+        cached = self._calendar
+        if cached is None or cached[0] != self.version:
+            version, head, months = self.version, self.documents.get("Calendar"), self.months
+            if isSharded(head):
+                calendar = {}
+                for month in sorted(months):
+                    calendar.update(months[month])
+            elif isPacked(head):
+                calendar = decodeCalendar(head)
+            else:
+                calendar = head or {}
+            cached = self._calendar = (version, calendar)
+        return cached[1]
+
+class LiveState:
+    """Listener service and the in-memory participant state it feeds"""
+    def __init__(self):
+        self._participants = {}
+        self._lock = threading.Lock()
+
+    def _guarded(self, state: ParticipantState, handler):
+        """Snapshot callback that records a failure instead of ending the listener's thread"""
+        def callback(snapshots, changes, readTime):
+            try:
+                handler(snapshots, changes, readTime)
+            except Exception as e:
+                state.error = f"{type(e).__name__}: {e}"
+                logger.exception("Listener of %s failed", state.uid)
+        return callback
+
+    def _onDocument(self, state: ParticipantState, name: str, snapshots):
+        with self._lock:
+            documents = dict(state.documents)
+            snapshot = next((s for s in snapshots if s.exists), None)
+            if snapshot is None:
+                documents.pop(name, None)
+            else:
+                documents[name] = snapshot.to_dict() or {}
+            self._publish(state, documents=documents)
+            state.delivered.add(name)
+            watchMonths = isSharded(documents.get("Calendar")) and not state.monthsWatched
+            state.monthsWatched |= watchMonths
+        if watchMonths:
+            # A sharded participant is ready once its month listener has delivered too
+            db = firestore.client()
+            state.watches.append(calendarRef(db, state.uid).collection("Months").on_snapshot(
+                self._guarded(state, lambda snapshots, changes, readTime: self._onMonths(state, changes))))
+        self._markReady(state)
+
+    def _onMonths(self, state: ParticipantState, changes):
+        with self._lock:
+            months = dict(state.months)
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    months.pop(change.document.id, None)
+                else:
+                    months[change.document.id] = change.document.to_dict() or {}
+            self._publish(state, months=months)
+            state.delivered.add("Months")
+        self._markReady(state)
+
+    def _markReady(self, state: ParticipantState):
+        """A participant is ready once every listener it has has delivered its first snapshot"""
+        with self._lock:
+            expected = set(WATCHED_DOCUMENTS) | ({"Months"} if state.monthsWatched else set())
+            if expected <= state.delivered:
+                state.ready.set()
+
+    def _publish(self, state: ParticipantState, documents: dict = None, months: dict = None):
+        if documents is not None:
+            state.documents = documents
+        if months is not None:
+            state.months = months
+        state.version += 1
+        state.updated = time.time()
+
+    def _subscribe(self, uid: str, version: int = 0) -> ParticipantState:
+        state = ParticipantState(uid)
+        # A replacement carries on from the version it replaces so cached views are recomputed
+        state.version = version
+        db = firestore.client()
+        for name in WATCHED_DOCUMENTS:
+            state.watches.append(db.collection(uid).document(name).on_snapshot(self._guarded(
+                state, lambda snapshots, changes, readTime, name=name: self._onDocument(state, name, snapshots))))
+        return state
+
+    def _resubscribe(self, old: ParticipantState):
+        """Replace the listeners of a participant whose stream closed, keeping the old state if that fails"""
+        try:
+            state = self._subscribe(old.uid, old.version + 1)
+        except Exception as e:
+            old.error = f"{type(e).__name__}: {e}"
+            logger.warning("Could not resubscribe to %s: %s", old.uid, e)
+            return
+        state.lastRead = old.lastRead
+        with self._lock:
+            replaced = self._participants.get(old.uid) is old
+            if replaced:
+                self._participants[old.uid] = state
+        # Another session may have replaced it first, its listeners are kept then
+        for watch in (old if replaced else state).watches:
+            watch.unsubscribe()
+
+    def watch(self, uids: list, timeout: float = INITIAL_SNAPSHOT_TIMEOUT) -> dict:
+        """uid -> ParticipantState, subscribing on first use and waiting for the initial snapshots"""
+        now = time.monotonic()
+        with self._lock:
+            missing = [uid for uid in uids if uid not in self._participants]
+            closed = [self._participants[uid] for uid in uids
+                      if uid in self._participants and self._participants[uid].closed()]
+            for uid in uids:
+                if uid in self._participants:
+                    self._participants[uid].lastRead = now
+        for state in closed:
+            self._resubscribe(state)
+        for uid in missing:
+            state = self._subscribe(uid)
+            with self._lock:
+                if uid in self._participants:
+                    for watch in state.watches:
+                        watch.unsubscribe()
+                else:
+                    self._participants[uid] = state
+        self._expire(now)
+
+        with self._lock:
+            states = {uid: self._participants[uid] for uid in uids}
+        deadline = time.monotonic() + timeout
+        for state in states.values():
+            state.ready.wait(max(0, deadline - time.monotonic()))
+        return states
+
+    def _expire(self, now: float):
+        with self._lock:
+            idle = [uid for uid, state in self._participants.items() if now - state.lastRead > IDLE_TIMEOUT]
+            expired = [self._participants.pop(uid) for uid in idle]
+        for state in expired:
+            for watch in state.watches:
+                watch.unsubscribe()
+
+    def calendars(self, uids: list) -> dict:
+        """uid -> day-keyed calendar"""
+        return {uid: state.calendar() for uid, state in self.watch(uids).items()}
+
+    def documents(self, uid: str) -> dict:
+        """Basic Info, expanded Calendar and Questionnaires of one participant"""
+        state = self.watch([uid])[uid]
+        return {key: state.documents.get(key, {}) for key in WATCHED_DOCUMENTS} | {"Calendar": state.calendar()}
+
+    def staleness(self, uids: list) -> dict:
+        """uid -> seconds since the last update, for participants whose listeners are closed"""
+        with self._lock:
+            states = [self._participants[uid] for uid in uids if uid in self._participants]
+        return {state.uid: state.age() for state in states if state.closed()}
+
+    def version(self, uids: list) -> tuple:
+        """Changes whenever any of the participants' documents do, for caching derived views"""
+        with self._lock:
+            return tuple(self._participants[uid].version if uid in self._participants else 0 for uid in uids)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"participants": len(self._participants),
+                    "listeners": sum(len(state.watches) for state in self._participants.values())}
+
+@st.cache_resource(show_spinner=False)
+def liveState() -> LiveState:
+    """The listener service shared by every session"""
+    return LiveState()
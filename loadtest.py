@@ -0,0 +1,236 @@
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+# Simulated clinicians sharing one portal process: every session is its own AppTest
+# driving main.py against the in-memory backend, the way the Streamlit server runs one
+# script thread per browser tab. Caches built with st.cache_resource are shared between
+# sessions as in production; AppTest gives every run a fresh st.cache_data store, so
+# pages relying on it are measured cold. AppTest installs its own Runtime for the length
+# of a run, so script runs take turns on SCRIPT_LOCK (like reruns contending for the GIL)
+# while the jobs and backend calls they start overlap; the time spent waiting for the
+# lock is reported separately from the rerun itself.
+os.environ.setdefault("DIGIPREDICT_BACKEND", "fake")
+os.environ.setdefault("DIGIPREDICT_TRACE_FILE", "")
+os.environ.setdefault("DIGIPREDICT_QUEUE_DB", os.path.join(tempfile.gettempdir(), f"digipredict-loadtest-{os.getpid()}.sqlite3"))
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+CREDENTIALS = {"username": "loadtest", "password": "loadtest"}
+RUN_TIMEOUT = 60
+JOB_TIMEOUT = 120
+SCRIPT_LOCK = threading.Lock()
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def deepSize(value, seen: set = None) -> int:
+    """Approximate memory held by a value and everything it references"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deepSize(k, seen) + deepSize(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deepSize(v, seen) for v in value)
+    return size
+
+class ClinicianSession:
+    """One simulated browser session, timing every script rerun it triggers"""
+    def __init__(self, index: int):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.app = AppTest.from_file(MAIN_SCRIPT, default_timeout=RUN_TIMEOUT)
+        self.reruns = []
+        self.waits = []
+        self.actions = {}
+        self.errors = []
+
+    def run(self, action: str, step=None):
+        """Apply a widget interaction (or nothing) and time the rerun it causes"""
+        queued = time.perf_counter()
+        with SCRIPT_LOCK:
+            start = time.perf_counter()
+            (step() if step else self.app).run()
+            elapsed = (time.perf_counter() - start) * 1000
+        self.waits.append((start - queued) * 1000)
+        self.reruns.append(elapsed)
+        self.actions.setdefault(action, []).append(elapsed)
+        if self.app.exception:
+            self.errors.append(f"{action}: {self.app.exception[0].value}")
+        return self.app
+
+    def widget(self, kind: str, label: str):
+        return next(w for w in getattr(self.app, kind) if w.label == label)
+
+    def login(self):
+        self.run("load")
+        self.app.text_input[0].input(CREDENTIALS["username"])
+        self.app.text_input[1].input(CREDENTIALS["password"])
+        self.run("login", self.app.button[0].click)
+
+    def open(self, label: str):
+        if self.app.session_state["current_app"] is not None:
+            self.run("menu", self.widget("button", "🔙 Back to Main Menu").click)
+        self.run("navigate", self.widget("button", label).click)
+
+    def waitForJobs(self):
+        """Rerun, as the page's poller does, until every submission of the session is done"""
+        from jobs import jobRunner
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while time.monotonic() < deadline:
+            jobs = [jobRunner().get(jobId) for jobId in self.app.session_state.get("jobs", [])]
+            if all(job is None or job.done for job in jobs):
+                self.errors += [f"job: {job.error}" for job in jobs if job and job.error]
+                return
+            time.sleep(0.05)
+            self.run("poll")
+        self.errors.append("job: timed out")
+
+    def onboard(self, email: str, startDate: date):
+        self.widget("text_input", "Email").input(email)
+        self.widget("text_input", "Password").input("loadtest-password")
+        self.widget("date_input", "Start Date").set_value(startDate)
+        self.widget("text_input", "Questionnaire Link").input("https://example.com/questionnaire")
+        self.run("onboard submit", self.widget("button", "Submit").click)
+        self.waitForJobs()
+
+    def modify(self, email: str, startDate: date):
+        self.widget("text_input", "Study Email").input(email)
+        self.run("modify form", self.widget("toggle", "Extend Study").set_value(True).run)
+        self.widget("date_input", "Start Extension Date").set_value(startDate)
+        self.widget("date_input", "End Extension Date").set_value(startDate + timedelta(days=13))
+        self.widget("text_input", "Questionnaire Link").input("https://example.com/questionnaire")
+        self.run("modify submit", self.widget("button", "Submit").click)
+        self.waitForJobs()
+
+    def stateSize(self) -> int:
+        return deepSize(self.app.session_state.to_dict())
+
+def clinicianScenario(index: int, participants: int, startDate: date) -> ClinicianSession:
+    """Log in, onboard `participants` participants, then extend each of their studies"""
+    session = ClinicianSession(index)
+    try:
+        session.login()
+        emails = [f"loadtest-{index + 1}-{i}@example.com" for i in range(participants)]
+        session.open("👥 Onboard New Participant")
+        for email in emails:
+            session.onboard(email, startDate)
+        session.open("📝 Modify Participant Data")
+        for email in emails:
+            session.modify(email, startDate + timedelta(days=220))
+    except Exception as e:
+        session.errors.append(f"scenario: {type(e).__name__}: {e}")
+    return session
+
+def runLoadTest(sessions: int, participants: int, latency: float = 0.0) -> dict:
+    """Run `sessions` clinicians concurrently, returns latency, throughput and memory figures"""
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+    import backend
+    from fakefirebase import FakeFirebase
+    fb = FakeFirebase(latency)
+    backend.use(fb)
+    # AppTest swaps st.secrets for the length of each run when given its own, which races
+    # between concurrent runs, so every session reads one process-wide copy instead
+    secrets = Secrets()
+    secrets._secrets = {"admin_credentials": CREDENTIALS}
+    st.secrets = secrets
+    # Page imports and st.cache_resource singletons are process-wide, load them before measuring
+    clinicianScenario(-1, 1, date.today())
+    fb.stats.reset()
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="clinician") as pool:
+        futures = [pool.submit(clinicianScenario, i, participants, date.today()) for i in range(sessions)]
+        results = [future.result() for future in futures]
+    wall = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    reruns = [ms for session in results for ms in session.reruns]
+    waits = [ms for session in results for ms in session.waits]
+    actions = {}
+    for session in results:
+        for action, timings in session.actions.items():
+            actions.setdefault(action, []).extend(timings)
+    return {
+        "sessions": sessions,
+        "participants_per_session": participants,
+        "latency_s": latency,
+        "wall_s": round(wall, 2),
+        "reruns": len(reruns),
+        "reruns_per_s": round(len(reruns) / wall, 2),
+        "operations_per_min": round(sessions * participants * 2 / wall * 60, 1),
+        "rerun_ms": {"p50": round(statistics.median(reruns), 1) if reruns else 0.0,
+                     "p95": round(percentile(reruns, 0.95), 1), "max": round(max(reruns, default=0.0), 1)},
+        "wait_ms": {"p50": round(statistics.median(waits), 1) if waits else 0.0,
+                    "p95": round(percentile(waits, 0.95), 1), "max": round(max(waits, default=0.0), 1)},
+        "actions_ms": {action: {"count": len(timings), "p50": round(statistics.median(timings), 1),
+                                "p95": round(percentile(timings, 0.95), 1)}
+                       for action, timings in actions.items()},
+        "memory_kib": {"retained_per_session": round((current - baseline) / sessions / 1024, 1),
+                       "peak": round((peak - baseline) / 1024, 1),
+                       "session_state_per_session": round(statistics.mean(s.stateSize() for s in results) / 1024, 1)},
+        "backend": {key: value for key, value in fb.stats.snapshot().items() if key != "calls"},
+        "errors": [f"session {s.index}: {error}" for s in results for error in s.errors],
+    }
+
+def printReport(report: dict):
+    print(f"{report['sessions']} sessions x {report['participants_per_session']} participants, "
+          f"{report['latency_s'] * 1000:.0f} ms simulated backend latency")
+    print(f"wall {report['wall_s']} s, {report['reruns']} reruns ({report['reruns_per_s']}/s), "
+          f"{report['operations_per_min']} onboard/modify operations per minute")
+    rerun = report["rerun_ms"]
+    wait = report["wait_ms"]
+    print(f"rerun latency ms: p50 {rerun['p50']}  p95 {rerun['p95']}  max {rerun['max']}")
+    print(f"queued behind other sessions ms: p50 {wait['p50']}  p95 {wait['p95']}  max {wait['max']}")
+    print(f"{'action':<16} {'count':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for action, timings in report["actions_ms"].items():
+        print(f"{action:<16} {timings['count']:>6} {timings['p50']:>8} {timings['p95']:>8}")
+    memory = report["memory_kib"]
+    print(f"memory KiB: {memory['retained_per_session']} retained per session, {memory['peak']} peak, "
+          f"{memory['session_state_per_session']} session state per session")
+    backendStats = report["backend"]
+    print(f"backend: {backendStats['round_trips']} round trips, {backendStats['reads']} reads, "
+          f"{backendStats['writes']} writes")
+    for error in report["errors"]:
+        print(f"error: {error}", file=sys.stderr)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent clinicians against the in-memory backend")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 8], help="Concurrent sessions per run")
+    parser.add_argument("--participants", type=int, default=2, help="Participants each session onboards and modifies")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per backend round-trip")
+    parser.add_argument("--json", help="Also write the reports to this file")
+    args = parser.parse_args(argv)
+
+    reports = []
+    for sessions in args.sessions:
+        report = runLoadTest(sessions, args.participants, args.latency)
+        printReport(report)
+        print()
+        reports.append(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, indent=2)
+    return 1 if any(report["errors"] for report in reports) else 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
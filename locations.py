@@ -0,0 +1,233 @@
+import argparse
+import sys
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from schedule import NZ_TIMEZONE
+
+# GPS fixes live under {uid}/Location/Buckets/{bucket}:
+#   YYYY-MM-DDTHH  raw hour (UTC), {"Fixes": {epoch ms: [lat, lng, accuracy]}}
+#   YYYY-MM-DD     compacted day (UTC), a downsampled, delta-encoded and zlib-compressed track
+# The Location document indexes them as {"Buckets": {bucket: "raw" | "compact"}} so a range
+# query reads the index plus only the buckets it overlaps.
+BUCKETS_COLLECTION = "Buckets"
+RAW = "raw"
+COMPACT = "compact"
+# Compacted tracks keep at most one fix per minute, coordinates to ~1 m
+DOWNSAMPLE_MS = 60 * 1000
+COORD_SCALE = 100000
+COMPACT_AFTER_DAYS = 7
+MAX_WRITES_PER_BATCH = 500
+READ_BATCH = 100
+
+def locationRef(db, uid: str):
+    return db.collection(uid).document("Location")
+
+def bucketRef(db, uid: str, bucket: str):
+    return locationRef(db, uid).collection(BUCKETS_COLLECTION).document(bucket)
+
+def epochMillis(value) -> int:
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+def hourBucket(millis: int) -> str:
+    return datetime.fromtimestamp(millis / 1000, timezone.utc).strftime("%Y-%m-%dT%H")
+
+def dayOf(bucket: str) -> str:
+    return bucket[:10]
+
+def appendFixes(db, uid: str, fixes: list) -> int:
+    """Append (timestamp, lat, lng[, accuracy]) fixes into their hour buckets, returns the number of commits
+
+    Each bucket receives one merge write holding only the new fixes, so appends never
+    rewrite what is already stored.
+    """
+    buckets = {}
+    for fix in fixes:
+        millis = epochMillis(fix[0])
+        accuracy = fix[3] if len(fix) > 3 else None
+        buckets.setdefault(hourBucket(millis), {})[str(millis)] = [float(fix[1]), float(fix[2]), accuracy]
+
+    writes = [(bucketRef(db, uid, bucket), {"Fixes": entries}) for bucket, entries in sorted(buckets.items())]
+    commits = 0
+    for i in range(0, len(writes), MAX_WRITES_PER_BATCH - 1):
+        chunk = writes[i:i + MAX_WRITES_PER_BATCH - 1]
+        batch = db.batch()
+        for ref, data in chunk:
+            batch.set(ref, data, merge=True)
+        index = {ref.id: RAW for ref, _ in chunk}
+        batch.set(locationRef(db, uid), {"Buckets": index}, merge=True)
+        batch.commit()
+        commits += 1
+    return commits
+
+def _zigzag(values):
+    for value in values:
+        yield (value << 1) ^ (value >> 63)
+
+def _varints(values) -> bytes:
+    out = bytearray()
+    for value in _zigzag(values):
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+def _unvarints(data: bytes) -> list:
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            values.append((value >> 1) ^ -(value & 1))
+            value, shift = 0, 0
+    return values
+
+def _deltas(values: list) -> list:
+    return [b - a for a, b in zip([0] + values, values)]
+
+def _undeltas(deltas: list) -> list:
+    values, total = [], 0
+    for delta in deltas:
+        total += delta
+        values.append(total)
+    return values
+
+def downsample(fixes: list, interval: int = DOWNSAMPLE_MS) -> list:
+    """Keep the first fix of every `interval` milliseconds, and always the last fix"""
+    kept = []
+    for fix in fixes:
+        if not kept or fix[0] - kept[-1][0] >= interval:
+            kept.append(fix)
+    if fixes and kept[-1] is not fixes[-1]:
+        kept.append(fixes[-1])
+    return kept
+
+def encodeTrack(fixes: list) -> dict:
+    """Compacted bucket for time-sorted (ms, lat, lng) fixes"""
+    kept = downsample(fixes)
+    columns = ([f[0] for f in kept],
+               [round(f[1] * COORD_SCALE) for f in kept],
+               [round(f[2] * COORD_SCALE) for f in kept])
+    packed = b"".join(_varints(_deltas(column)) for column in columns)
+    lats, lngs = [f[1] for f in fixes], [f[2] for f in fixes]
+    return {"Count": len(fixes), "Kept": len(kept), "Start": fixes[0][0], "End": fixes[-1][0],
+            "Bounds": [min(lats), min(lngs), max(lats), max(lngs)], "Track": zlib.compress(packed)}
+
+def decodeTrack(bucket: dict) -> list:
+    """(ms, lat, lng) fixes of a compacted bucket"""
+    values = _unvarints(zlib.decompress(bucket["Track"]))
+    kept = bucket["Kept"]
+    times, lats, lngs = (_undeltas(values[i * kept:(i + 1) * kept]) for i in range(3))
+    return [(t, lat / COORD_SCALE, lng / COORD_SCALE) for t, lat, lng in zip(times, lats, lngs)]
+
+def bucketFixes(bucket: dict) -> list:
+    """Time-sorted (ms, lat, lng) fixes of a raw or compacted bucket"""
+    if "Track" in bucket:
+        return decodeTrack(bucket)
+    return sorted((int(ms), fix[0], fix[1]) for ms, fix in bucket.get("Fixes", {}).items())
+
+def _utcRange(startDate: date, endDate: date, tz=NZ_TIMEZONE) -> tuple:
+    """Epoch ms bounds of whole study days in the study timezone, end exclusive"""
+    start = tz.localize(datetime.combine(startDate, time()))
+    end = tz.localize(datetime.combine(endDate + timedelta(days=1), time()))
+    return epochMillis(start), epochMillis(end)
+
+def bucketsBetween(index: dict, startMs: int, endMs: int) -> list:
+    """Indexed buckets overlapping an epoch ms range"""
+    first, last = hourBucket(startMs), hourBucket(endMs - 1)
+    selected = []
+    for bucket, kind in index.items():
+        if kind == COMPACT and dayOf(first) <= bucket <= dayOf(last):
+            selected.append(bucket)
+        elif kind == RAW and first <= bucket <= last:
+            selected.append(bucket)
+    return sorted(selected)
+
+def readFixes(db, uid: str, startDate: date, endDate: date, tz=NZ_TIMEZONE) -> list:
+    """(ms, lat, lng) fixes of a participant between two study days inclusive
+
+    Reads the bucket index, then only the buckets overlapping the range in one get_all.
+    """
+    startMs, endMs = _utcRange(startDate, endDate, tz)
+    index = (locationRef(db, uid).get(field_paths=["Buckets"]).to_dict() or {}).get("Buckets", {})
+    fixes = []
+    buckets = bucketsBetween(index, startMs, endMs)
+    for i in range(0, len(buckets), READ_BATCH):
+        for snapshot in db.get_all([bucketRef(db, uid, b) for b in buckets[i:i + READ_BATCH]]):
+            fixes += [f for f in bucketFixes(snapshot.to_dict() or {}) if startMs <= f[0] < endMs]
+    return sorted(fixes)
+
+def readAllFixes(db, uid: str, index: dict) -> list:
+    """Every fix of a participant given their bucket index"""
+    fixes = []
+    buckets = sorted(index)
+    for i in range(0, len(buckets), READ_BATCH):
+        for snapshot in db.get_all([bucketRef(db, uid, b) for b in buckets[i:i + READ_BATCH]]):
+            fixes += bucketFixes(snapshot.to_dict() or {})
+    return sorted(fixes)
+
+def compactParticipant(db, uid: str, olderThan: int = COMPACT_AFTER_DAYS, dry_run: bool = False) -> str:
+    """Fold raw hour buckets of days older than `olderThan` into one compacted bucket per day
+
+    Each day is rewritten in its own batch: the compacted bucket (merged with an earlier
+    compaction of the same day), the deleted hours and the index update commit together.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=olderThan)).strftime("%Y-%m-%d")
+    index = (locationRef(db, uid).get(field_paths=["Buckets"]).to_dict() or {}).get("Buckets", {})
+    days = {}
+    for bucket, kind in index.items():
+        if kind == RAW and dayOf(bucket) < cutoff:
+            days.setdefault(dayOf(bucket), []).append(bucket)
+    if not days:
+        return "nothing to compact"
+    if dry_run:
+        return f"would compact {sum(map(len, days.values()))} hour buckets into {len(days)} days"
+
+    for day, hours in sorted(days.items()):
+        refs = [bucketRef(db, uid, b) for b in hours]
+        if index.get(day) == COMPACT:
+            refs.append(bucketRef(db, uid, day))
+        fixes = {}
+        for snapshot in db.get_all(refs):
+            fixes |= {f[0]: f for f in bucketFixes(snapshot.to_dict() or {})}
+
+        batch = db.batch()
+        batch.set(bucketRef(db, uid, day), encodeTrack([fixes[ms] for ms in sorted(fixes)]))
+        for hour in hours:
+            batch.delete(bucketRef(db, uid, hour))
+        batch.update(locationRef(db, uid), {f"Buckets.{hour}": firestore.DELETE_FIELD for hour in hours}
+                     | {f"Buckets.{day}": COMPACT})
+        batch.commit()
+    return f"compacted {sum(map(len, days.values()))} hour buckets into {len(days)} days"
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Compact old location buckets")
+    parser.add_argument("uids", nargs="*", help="Participants to compact (default: every account)")
+    parser.add_argument("--older-than", type=int, default=COMPACT_AFTER_DAYS, help="Days of raw fixes to keep")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    db = firestore.client()
+    uids = args.uids or [user.uid for user in auth.list_users().iterate_all()]
+    failed = 0
+    for uid in uids:
+        try:
+            print(f"{uid}: {compactParticipant(db, uid, args.older_than, args.dry_run)}")
+        except Exception as e:
+            failed += 1
+            print(f"{uid}: failed ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
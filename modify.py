@@ -1,8 +1,18 @@
-import json
 import streamlit as st
 from datetime import time, datetime, timedelta
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from audit import APPLIED, DEFERRED, FAILED, recordCalendarChange
+from backend import firestore, auth
+from identity import getUserByEmail
+from jobs import idempotencyKey, showJobs, submitJob
+from layout import SCHEMA_V3, applyPackedChanges, calendarWrites, changesByDay, readCalendarWithSchema, taskPath
+from registry import refreshEntries
+from studycalendar import generateCalendarRange, weekdayCadence
+from writequeue import DONE, PENDING, RUNNING, Deferred, decode, decodeWrites, encode, encodeWrites, register, writeQueue
+
+# Firestore accepts at most 500 writes per commit; field maps are chunked to
+# the same size so no single update carries an oversized request.
+MAX_WRITES_PER_BATCH = 500
+MAX_FIELDS_PER_WRITE = 500
 
 def check_auth_and_redirect():
     """Verify authentication before showing page"""
@@ -14,49 +24,155 @@ def check_auth_and_redirect():
 def checkClientEnrolled(email:str) -> bool:
     """Check if client exists"""
     try:
-        auth.get_user_by_email(email)
+        getUserByEmail(email)
     except auth.UserNotFoundError:
         return False
     return True
 
-def removeStudyDates(email:str, startDate: datetime.date, endDate: datetime.date) -> bool:
-    """Remove study dates for a participant"""
-    user = auth.get_user_by_email(email)
-    dates = [startDate + timedelta(days=i) for i in range((endDate - startDate).days + 1)]
+def studyDates(startDate: datetime.date, endDate: datetime.date) -> list:
+    """List every date from startDate to endDate inclusive"""
+    return [startDate + timedelta(days=i) for i in range((endDate - startDate).days + 1)]
+
+def chunkFields(fields: dict, size: int = MAX_FIELDS_PER_WRITE) -> list:
+    """Split a field map into update-sized chunks"""
+    items = list(fields.items())
+    return [dict(items[i:i + size]) for i in range(0, len(items), size)]
+
+def commitFieldUpdates(db, writes: list) -> int:
+    """Apply (doc_ref, field map, merge) writes using batched writes, returns the number of commits"""
+    commits = 0
+    ops = [(doc_ref, chunk, merge) for doc_ref, fields, merge in writes for chunk in chunkFields(fields)]
+    for i in range(0, len(ops), MAX_WRITES_PER_BATCH):
+        batch = db.batch()
+        for doc_ref, chunk, merge in ops[i:i + MAX_WRITES_PER_BATCH]:
+            if merge:
+                batch.set(doc_ref, chunk, merge=True)
+            else:
+                batch.update(doc_ref, chunk)
+        batch.commit()
+        commits += 1
+    return commits
+
+def describeDiff(fields: dict) -> dict:
+    """Readable version of a calendar diff for previews"""
+    return {key: ("<removed>" if value is firestore.DELETE_FIELD else value)
+            for key, value in fields.items()}
+
+def mergeDay(existing: dict, planned: dict) -> dict:
+    """Planned tasks of a day that are missing or not yet completed, merged with what is recorded
+
+    Completed tasks are left out so applying the result never touches a recorded completion.
+    """
+    existing = existing or {}
+    changes = {}
+    for task, status in planned.items():
+        current = existing.get(task)
+        if not isinstance(current, dict):
+            changes[task] = status
+        elif not current.get("Completed") and current | status != current:
+            changes[task] = current | status
+    return changes
+
+def removalDiff(current: dict, startDate: datetime.date, endDate: datetime.date) -> dict:
+    """Deletes for the days in a range that exist in the calendar"""
+    keys = (date.strftime("%Y-%m-%d") for date in studyDates(startDate, endDate))
+    return {key: firestore.DELETE_FIELD for key in keys if key in current}
+
+def extensionDiff(current: dict, startDate: datetime.date, endDate: datetime.date,
+                  questionniare_day: int, questionnaire_link: str) -> dict:
+    """Per-task field paths (YYYY-MM-DD.Task) for planned tasks of a range that are missing or not completed"""
+    fields = {}
+    for key, planned in generateCalendarRange(startDate, endDate, questionnaireLink=questionnaire_link,
+                                              cadence=weekdayCadence(questionniare_day)):
+        for task, status in mergeDay(current.get(key), planned).items():
+            fields[taskPath(key, task)] = status
+    return fields
+
+def planStudyChanges(email: str, pause: tuple = None, extend: tuple = None) -> dict:
+    """Read the participant's Calendar once and work out the minimal change set
+
+    pause is (startDate, endDate) and extend is (startDate, endDate,
+    questionnaire_day, questionnaire_link); removals are applied before extensions.
+    """
+    return dict(planCalendarChanges(firestore.client(), getUserByEmail(email).uid, pause, extend), email=email)
+
+def planCalendarChanges(db, uid: str, pause: tuple = None, extend: tuple = None) -> dict:
+    """planStudyChanges for an already resolved uid"""
+    ranges = [change[:2] for change in (pause, extend) if change]
+    current, schema = readCalendarWithSchema(
+        db, uid, min(r[0] for r in ranges), max(r[1] for r in ranges))
+
+    fields = removalDiff(current, *pause) if pause else {}
+    if extend:
+        remaining = {key: value for key, value in current.items() if key not in fields}
+        fields |= extensionDiff(remaining, *extend)
+    return {"uid": uid, "schema": schema, "current": current, "fields": fields}
+
+def summarizePlan(plan: dict) -> dict:
+    """Count removed, added and updated days in a plan"""
+    days = changesByDay(plan["fields"])
+    removed = sum(value is firestore.DELETE_FIELD for value in days.values())
+    added = sum(key not in plan["current"] for key in days)
+    return {"removed": removed, "added": added,
+            "updated": len(days) - removed - added}
+
+def applyQueuedWrites(payload: dict, state: dict):
+    """Write queue handler for (path, field map, merge) writes, re-applying them is harmless
+
+    Changes to a packed Calendar are queued as day-level fields and re-applied to the
+    document as it is when the op executes.
+    """
     db = firestore.client()
-    calendar_ref = db.collection(user.uid).document("Calendar")
-    for date in dates:
-        calendar_ref.update({date.strftime("%Y-%m-%d") : firestore.DELETE_FIELD})
+    if "commits" not in state:
+        if "fields" in payload:
+            state["commits"] = applyPackedChanges(db, payload["uid"], decode(payload["fields"]))
+        else:
+            state["commits"] = commitFieldUpdates(db, decodeWrites(db, payload["writes"]))
+    refreshEntries(db, [payload["uid"]])
+
+register("calendar", applyQueuedWrites)
+
+def applyStudyChanges(plan: dict) -> int:
+    """Write only the changed Calendar fields of a plan through the write queue, returns the number of commits
+
+    Raises Deferred when a transient failure left the writes to be retried in the background.
+    Every outcome is recorded in the audit log.
+    """
+    if not plan["fields"]:
+        return 0
+    if plan["schema"] == SCHEMA_V3:
+        payload = {"uid": plan["uid"], "fields": encode(plan["fields"])}
+    else:
+        writes = calendarWrites(firestore.client(), plan["uid"], plan["fields"], plan["schema"])
+        payload = {"uid": plan["uid"], "writes": encodeWrites(writes)}
+    op = writeQueue().submit("calendar", payload)
+    if op.status in (PENDING, RUNNING):
+        recordCalendarChange(plan, DEFERRED, op=op.id)
+        raise Deferred(op)
+    if op.status != DONE:
+        recordCalendarChange(plan, FAILED, op=op.id, error=op.last_error)
+        raise RuntimeError(op.last_error)
+    recordCalendarChange(plan, APPLIED, op=op.id)
+    return op.state["commits"]
+
+def removeStudyDates(email:str, startDate: datetime.date, endDate: datetime.date,
+                     dry_run: bool = False):
+    """Remove study dates for a participant, returns the diff instead of writing when dry_run is set"""
+    plan = planStudyChanges(email, pause=(startDate, endDate))
+    if dry_run:
+        return plan["fields"]
+
+    applyStudyChanges(plan)
     return True
 
 def extendStudyDates(email:str, startDate: datetime.date, endDate: datetime.date, 
-                     questionniare_day:int, questionnaire_link:str) -> bool:
-    """Extend study dates for a participant"""
-    user = auth.get_user_by_email(email)
-    dates = [startDate + timedelta(days=i) for i in range((endDate - startDate).days + 1)]
-    db = firestore.client()
-    calendar_ref = db.collection(user.uid).document("Calendar")
-    qdate = 0
-    
-    for date in dates:
-        tasks = {
-            "Hailie": {"Completed": False},
-            "Cough Monitor": {"Completed": False},
-            "CheckIn": {"Completed": False}
-        }
-
-        if date.weekday() == questionniare_day:
-            if not qdate < 1:
-                tasks |= {"Questionnaire": {
-                    "Completed": False,
-                    "Link": questionnaire_link
-                }}
-                qdate = 0
-            else:
-                qdate += 1
-
-        calendar_ref.update({date.strftime("%Y-%m-%d"): tasks})
+                     questionniare_day:int, questionnaire_link:str, dry_run: bool = False):
+    """Extend study dates for a participant, returns the diff instead of writing when dry_run is set"""
+    plan = planStudyChanges(email, extend=(startDate, endDate, questionniare_day, questionnaire_link))
+    if dry_run:
+        return plan["fields"]
 
+    applyStudyChanges(plan)
     return True
 
 def main():
@@ -97,7 +213,13 @@ def main():
             }
             questionnaireDay = datemap[questionnaireDay]
 
-    if st.button(label="Submit"):
+    col1, col2 = st.columns(2)
+    with col1:
+        preview = st.button("Preview Changes")
+    with col2:
+        submit = st.button(label="Submit")
+
+    if preview or submit:
         if not email:
             st.error("Please enter email")
             return
@@ -106,20 +228,38 @@ def main():
             st.error("User doesn't exist")
             return
 
-        if pauseStudy:
-            res = removeStudyDates(email, startPauseDate, endPauseDate)
-            if res:
-                st.success(f"Participant Dates Removed between {startPauseDate} to {endPauseDate}")
-            else:
-                st.error("Error occurred while removing dates")
+        pause = (startPauseDate, endPauseDate) if pauseStudy else None
+        extend = (startExtendDate, endExtendDate, questionnaireDay, questionnaireLink) if extendStudy else None
+        if not pause and not extend:
+            st.warning("Select dates to remove or extend")
+            return
 
-        if extendStudy:
-            res = extendStudyDates(email, startExtendDate, endExtendDate, 
-                                 questionnaireDay, questionnaireLink)
-            if res:
-                st.success("Successfully Extended Study Dates")
-            else:
-                st.error("Error occurred while extending dates")
+        if preview:
+            plan = planStudyChanges(email, pause, extend)
+            summary = summarizePlan(plan)
+            st.markdown(f"**{summary['added']} days added, {summary['updated']} updated, "
+                        f"{summary['removed']} removed** (completed tasks are kept)")
+            if plan["fields"]:
+                st.json(describeDiff(plan["fields"]), expanded=False)
+            return
+
+        def apply():
+            # The diff is recomputed here so tasks completed since the preview are kept
+            plan = planStudyChanges(email, pause, extend)
+            summary = summarizePlan(plan)
+            applyStudyChanges(plan)
+            messages = []
+            if pause:
+                messages.append(f"Participant Dates Removed between {pause[0]} to {pause[1]}")
+            if extend:
+                messages.append("Successfully Extended Study Dates")
+            return (" | ".join(messages) + f" ({summary['added']} added, "
+                    f"{summary['updated']} updated, {summary['removed']} removed)")
+
+        submitJob(f"Modifying {email}", [("Applying changes", apply)],
+                  key=idempotencyKey("modify", email, pause, extend))
+
+    showJobs()
 
 if __name__ == "__main__":
     st.error("Please access this application through the main portal")
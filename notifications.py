@@ -0,0 +1,147 @@
+import argparse
+import heapq
+import itertools
+import sys
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import NamedTuple
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from layout import READ_BATCH, readCalendars
+from schedule import NZ_TIMEZONE, WEEKDAYS, fireTime, wallTime
+
+class Notification(NamedTuple):
+    """One notification to send, `at` is in UTC"""
+    at: datetime
+    uid: str
+    task: str
+    day: str
+
+def weeklyTimes(notifications: dict, tz=NZ_TIMEZONE) -> dict:
+    """weekday -> [(time of day, task)] from a Notifications document"""
+    weekly = {}
+    for weekday, tasks in notifications.items():
+        times = []
+        for task, value in tasks.items():
+            taskTime = wallTime(value, tz)
+            if taskTime is not None:
+                times.append((taskTime, task))
+        weekly[weekday] = times
+    return weekly
+
+def participantNotifications(uid: str, notifications: dict, calendar: dict, after: datetime,
+                             tz=NZ_TIMEZONE):
+    """Yield a participant's notifications firing after `after`, in time order
+
+    A task is notified on a study day when the Calendar schedules it for that day and it
+    has not been completed yet.
+    """
+    weekly = weeklyTimes(notifications, tz)
+    first = (after.astimezone(tz).date() - timedelta(days=1)).strftime("%Y-%m-%d")
+    for key in sorted(k for k in calendar if k >= first):
+        try:
+            day = date.fromisoformat(key)
+        except ValueError:
+            continue
+        tasks = calendar[key]
+        due = []
+        for taskTime, task in weekly.get(WEEKDAYS[day.weekday()], ()):
+            status = tasks.get(task)
+            if not isinstance(status, dict) or status.get("Completed"):
+                continue
+            at = fireTime(day, taskTime, tz).astimezone(timezone.utc)
+            if at > after:
+                due.append(Notification(at, uid, task, key))
+        # Sorted by instant rather than wall time, a time pushed past the DST gap can move
+        yield from sorted(due)
+
+class NotificationQueue:
+    """Min-heap holding the next notification of every participant
+
+    Each participant contributes one entry at a time, so popping what is due costs
+    O(log n) per notification regardless of how long the studies are. Re-adding a
+    participant (after their study is modified) replaces their queued notifications.
+    """
+    def __init__(self, tz=NZ_TIMEZONE):
+        self.tz = tz
+        self._heap = []
+        self._counter = itertools.count()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def add(self, uid: str, notifications: dict, calendar: dict, after: datetime = None):
+        after = after or datetime.now(timezone.utc)
+        with self._lock:
+            generation = self._generations.get(uid, 0) + 1
+            self._generations[uid] = generation
+            self._push(generation, participantNotifications(uid, notifications, calendar, after, self.tz))
+
+    def remove(self, uid: str):
+        """Stop notifying a participant, their queued entry is dropped when it surfaces"""
+        with self._lock:
+            self._generations.pop(uid, None)
+
+    def _push(self, generation: int, notifications):
+        upcoming = next(notifications, None)
+        if upcoming is not None:
+            heapq.heappush(self._heap, (upcoming.at, next(self._counter), generation, upcoming, notifications))
+
+    def _dropStale(self):
+        while self._heap and self._heap[0][2] != self._generations.get(self._heap[0][3].uid):
+            heapq.heappop(self._heap)
+
+    def peek(self) -> Notification:
+        """The next notification to fire, None when nothing is queued"""
+        with self._lock:
+            self._dropStale()
+            return self._heap[0][3] if self._heap else None
+
+    def popDue(self, until: datetime = None) -> list:
+        """Remove and return every notification firing at or before `until` (default now)"""
+        until = until or datetime.now(timezone.utc)
+        due = []
+        with self._lock:
+            while True:
+                self._dropStale()
+                if not self._heap or self._heap[0][0] > until:
+                    return due
+                _, _, generation, notification, notifications = heapq.heappop(self._heap)
+                due.append(notification)
+                self._push(generation, notifications)
+
+def loadQueue(db, uids: list, after: datetime = None, tz=NZ_TIMEZONE) -> NotificationQueue:
+    """Queue for many participants from batched Notifications and Calendar reads"""
+    schedules = {}
+    for i in range(0, len(uids), READ_BATCH):
+        refs = [db.collection(uid).document("Notifications") for uid in uids[i:i + READ_BATCH]]
+        for snapshot in db.get_all(refs):
+            schedules[snapshot.reference.parent.id] = snapshot.to_dict() or {}
+    calendars = readCalendars(db, uids)
+
+    queue = NotificationQueue(tz)
+    for uid in uids:
+        queue.add(uid, schedules.get(uid, {}), calendars.get(uid, {}), after)
+    return queue
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="List the notifications due in the coming minutes")
+    parser.add_argument("uids", nargs="*", help="Participants to include (default: every account)")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--minutes", type=int, default=60, help="How far ahead to look")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    uids = args.uids or [user.uid for user in auth.list_users().iterate_all()]
+    queue = loadQueue(firestore.client(), uids)
+    for notification in queue.popDue(datetime.now(timezone.utc) + timedelta(minutes=args.minutes)):
+        local = notification.at.astimezone(NZ_TIMEZONE).strftime("%Y-%m-%d %H:%M %Z")
+        print(f"{local}  {notification.uid}  {notification.task}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,105 @@
+import json
+import os
+from collections import deque
+import pandas as pd
+import streamlit as st
+from server import check_auth_and_redirect
+from tracing import DEFAULT_TRACE_FILE, TRACE_FILE_ENV, clearRecent, enabled, flush, recentSpans
+from writequeue import COMPENSATED, FAILED, writeQueue
+
+def readTraceFile(path: str, limit: int = 50000) -> list:
+    """The last spans written to the trace file, without holding the rest of it in memory"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        lines = deque(f, maxlen=limit)
+    return [json.loads(line) for line in lines if line.strip()]
+
+def spanFrame(spans: list) -> pd.DataFrame:
+    """One row per span with its rolled-up counters as columns"""
+    if not spans:
+        return pd.DataFrame(columns=["name", "parent_id", "duration_ms", "status", "reads", "writes", "bytes"])
+    frame = pd.DataFrame(spans)
+    attributes = pd.DataFrame(list(frame.pop("attributes")), index=frame.index)
+    return frame.join(attributes.drop(columns=[c for c in attributes if c in frame]))
+
+def operationTable(frame: pd.DataFrame) -> pd.DataFrame:
+    """Latency percentiles and payload totals per Firebase operation"""
+    calls = frame[frame["name"].str.startswith(("auth.", "firestore."))]
+    if calls.empty:
+        return pd.DataFrame()
+    grouped = calls.groupby("name")
+    table = pd.DataFrame({
+        "calls": grouped.size(),
+        "p50 ms": grouped["duration_ms"].quantile(0.5),
+        "p95 ms": grouped["duration_ms"].quantile(0.95),
+        "max ms": grouped["duration_ms"].max(),
+        "reads": grouped["reads"].sum(),
+        "writes": grouped["writes"].sum(),
+        "KB": grouped["bytes"].sum() / 1024,
+        "errors": grouped["status"].apply(lambda s: (s != "ok").sum()),
+    })
+    return table.sort_values("p95 ms", ascending=False).round(2)
+
+def showWriteQueue():
+    """Writes still pending in the local queue, with a retry for those that gave up"""
+    st.subheader("Write Queue")
+    queue = writeQueue()
+    ops = queue.list()
+    if not ops:
+        st.caption("No pending or failed writes")
+        return
+    st.dataframe(pd.DataFrame([{
+        "id": op.id, "kind": op.kind, "status": op.status, "attempts": op.attempts,
+        "next attempt": pd.Timestamp(op.next_attempt, unit="s", tz="UTC"), "error": op.last_error,
+    } for op in ops]), use_container_width=True, hide_index=True)
+
+    stuck = {op.id: op for op in ops if op.status in (FAILED, COMPENSATED)}
+    if stuck:
+        selected = st.selectbox("Failed write", list(stuck))
+        col1, col2 = st.columns(2)
+        with col1:
+            # A compensated write has been undone, it is resubmitted from its page instead
+            if st.button("🔁 Retry", disabled=stuck[selected].status == COMPENSATED,
+                         help="Give the write a fresh set of attempts"):
+                queue.retry(selected)
+                st.rerun()
+        with col2:
+            if st.button("Dismiss"):
+                queue.discard(selected)
+                st.rerun()
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Performance")
+    showWriteQueue()
+    if not enabled():
+        st.info("Tracing is disabled (DIGIPREDICT_TRACE=0)")
+        return
+
+    path = os.environ.get(TRACE_FILE_ENV, DEFAULT_TRACE_FILE)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        source = st.radio("Spans", ["This process", "Trace file"], horizontal=True,
+                          disabled=not path, help=f"Trace file: {path or 'disabled'}")
+    with col2:
+        if st.button("🗑️ Clear", help="Forget the spans held in memory"):
+            clearRecent()
+            st.rerun()
+
+    if source == "Trace file":
+        # Include the spans still waiting for the background writer
+        flush()
+    frame = spanFrame(recentSpans() if source == "This process" else readTraceFile(path))
+    st.caption(f"{len(frame)} spans")
+
+    st.subheader("Firebase Operations")
+    st.dataframe(operationTable(frame), use_container_width=True)
+
+    st.subheader("Recent Requests")
+    requests = frame[frame["parent_id"].isna() & ~frame["name"].str.startswith(("auth.", "firestore."))]
+    if not requests.empty:
+        columns = ["name", "duration_ms", "status", "calls", "reads", "writes", "bytes", "firebase_ms"]
+        st.dataframe(requests[columns].iloc[::-1].head(100), use_container_width=True, hide_index=True)
@@ -0,0 +1,221 @@
+import argparse
+import re
+import sys
+from datetime import date, datetime, timezone
+import pandas as pd
+import streamlit as st
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from identity import getUserByEmail
+from schedule import NZ_TIMEZONE
+from server import check_auth_and_redirect
+
+# Every questionnaire response is its own document in a top-level collection so the portal can
+# query across participants; the participant's Questionnaires document keeps a running
+# {type: {"Summary": {...}}} updated in the same batch as each response. The composite
+# indexes the queries below need are in firestore.indexes.json.
+RESPONSES_COLLECTION = "QuestionnaireResponses"
+PAGE_SIZE = 500
+MAX_WRITES_PER_BATCH = 500
+
+def responseId(uid: str, questionnaire: str, submitted: datetime) -> str:
+    """Deterministic id, so resubmitting the same response cannot count it twice"""
+    slug = re.sub(r"[^a-z0-9]+", "-", questionnaire.lower()).strip("-")
+    return f"{uid}_{slug}_{int(submitted.timestamp() * 1000)}"
+
+def severityOf(answers: dict):
+    value = answers.get("severity", answers.get("Severity"))
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def responseDocument(uid: str, questionnaire: str, answers: dict, submitted: datetime) -> dict:
+    submitted = submitted.astimezone(timezone.utc)
+    return {"uid": uid, "questionnaire": questionnaire, "submitted": submitted,
+            "day": submitted.astimezone(NZ_TIMEZONE).strftime("%Y-%m-%d"),
+            "severity": severityOf(answers), "answers": answers}
+
+def summaryDelta(response: dict) -> dict:
+    """Increments a response adds to its questionnaire's Summary"""
+    summary = {"Count": firestore.Increment(1), "Last": response["submitted"],
+               "Months": {response["day"][:7]: firestore.Increment(1)}}
+    if response["severity"] is not None:
+        summary["Severity"] = {str(response["severity"]): firestore.Increment(1)}
+        summary["SeveritySum"] = firestore.Increment(response["severity"])
+        summary["LastSeverity"] = response["severity"]
+    return summary
+
+def queueResponse(db, batch, uid: str, questionnaire: str, answers: dict, submitted: datetime) -> str:
+    """Queue a response and its summary increments on a batch, returns the response id"""
+    response = responseDocument(uid, questionnaire, answers, submitted)
+    ref = db.collection(RESPONSES_COLLECTION).document(responseId(uid, questionnaire, response["submitted"]))
+    batch.create(ref, response)
+    batch.set(db.collection(uid).document("Questionnaires"),
+              {questionnaire: {"Summary": summaryDelta(response)}}, merge=True)
+    return ref.id
+
+def recordResponse(db, uid: str, questionnaire: str, answers: dict, submitted: datetime = None) -> str:
+    """Store one response and update the participant's summary atomically
+
+    The response is created rather than set, so a duplicate submission fails the whole
+    batch and the summary is never incremented twice.
+    """
+    batch = db.batch()
+    docId = queueResponse(db, batch, uid, questionnaire, answers, submitted or datetime.now(timezone.utc))
+    batch.commit()
+    return docId
+
+def queryResponses(db, startDate: date = None, endDate: date = None, uid: str = None,
+                   questionnaire: str = None, minSeverity: int = None, fields: list = None):
+    """Stream matching responses ordered by study day and submission time, a page at a time"""
+    query = db.collection(RESPONSES_COLLECTION)
+    filters = [("uid", "==", uid), ("questionnaire", "==", questionnaire),
+               ("day", ">=", startDate and startDate.strftime("%Y-%m-%d")),
+               ("day", "<=", endDate and endDate.strftime("%Y-%m-%d")), ("severity", ">=", minSeverity)]
+    for field, op, value in filters:
+        if value is not None:
+            query = query.where(filter=firestore.FieldFilter(field, op, value))
+    query = query.order_by("day").order_by("submitted")
+    if fields is not None:
+        query = query.select(sorted(set(fields) | {"day", "submitted"}))
+
+    last = None
+    while True:
+        page = (query.start_after(last) if last else query).limit(PAGE_SIZE).get()
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        last = page[-1]
+
+def responseFrame(db, startDate: date, endDate: date, **filters) -> pd.DataFrame:
+    """Responses in a range as a table, without their answers"""
+    fields = ["uid", "questionnaire", "day", "submitted", "severity"]
+    rows = [snapshot.to_dict() for snapshot in queryResponses(db, startDate, endDate, fields=fields, **filters)]
+    return pd.DataFrame(rows, columns=fields)
+
+def aggregateResponses(frame: pd.DataFrame, by: str = "day") -> pd.DataFrame:
+    """Response count and severity statistics per day, participant or questionnaire"""
+    if frame.empty:
+        return pd.DataFrame(columns=["responses", "mean severity", "max severity"])
+    grouped = frame.groupby(by)
+    return pd.DataFrame({
+        "responses": grouped.size(),
+        "mean severity": grouped["severity"].mean().round(2),
+        "max severity": grouped["severity"].max(),
+    })
+
+def participantSummary(db, uid: str) -> dict:
+    """questionnaire -> Summary from the participant's Questionnaires document, no history reads"""
+    document = db.collection(uid).document("Questionnaires").get().to_dict() or {}
+    return {name: section.get("Summary", {}) for name, section in document.items()
+            if isinstance(section, dict) and section.get("Summary")}
+
+def _recordTime(key: str) -> datetime:
+    try:
+        return datetime.fromtimestamp(int(key) / 1000, timezone.utc)
+    except ValueError:
+        parsed = datetime.fromisoformat(key)
+        return parsed if parsed.tzinfo else NZ_TIMEZONE.localize(parsed)
+
+def migrateRecords(db, uid: str, dry_run: bool = False) -> str:
+    """Move responses out of the legacy Questionnaires.<type>.Record maps
+
+    Each batch creates responses, increments the summary and removes the migrated Record
+    entries together, so a rerun picks up exactly where an interrupted one stopped.
+    """
+    document = db.collection(uid).document("Questionnaires").get().to_dict() or {}
+    records = [(name, key, answers) for name, section in document.items() if isinstance(section, dict)
+               for key, answers in (section.get("Record") or {}).items()]
+    if not records:
+        return "no records"
+    if dry_run:
+        return f"would migrate {len(records)} records"
+
+    questionnairesRef = db.collection(uid).document("Questionnaires")
+    perBatch = MAX_WRITES_PER_BATCH // 2 - 1
+    for i in range(0, len(records), perBatch):
+        batch = db.batch()
+        removed = {}
+        for name, key, answers in records[i:i + perBatch]:
+            answers = answers if isinstance(answers, dict) else {"value": answers}
+            queueResponse(db, batch, uid, name, answers, _recordTime(key))
+            removed.setdefault(name, {})[key] = firestore.DELETE_FIELD
+        batch.set(questionnairesRef, {name: {"Record": keys} for name, keys in removed.items()}, merge=True)
+        batch.commit()
+    return f"migrated {len(records)} records"
+
+def main():
+    if not check_auth_and_redirect():
+        return
+
+    st.header("Questionnaire Responses")
+    db = firestore.client()
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        startDate = st.date_input("From", key="qfrom")
+    with col2:
+        endDate = st.date_input("To", key="qto")
+    with col3:
+        questionnaire = st.text_input("Questionnaire", value="Asthma Attack")
+    with col4:
+        minSeverity = st.number_input("Minimum severity", min_value=0, value=0, step=1)
+    email = st.text_input("Participant Email (optional)")
+
+    if st.button("Search"):
+        if endDate < startDate:
+            st.error("End date should be after start date")
+            return
+        uid = None
+        if email:
+            try:
+                uid = getUserByEmail(email).uid
+            except auth.UserNotFoundError:
+                st.error("User doesn't exist")
+                return
+            st.subheader("Summary")
+            st.json(participantSummary(db, uid), expanded=False)
+
+        with st.spinner("Querying responses..."):
+            frame = responseFrame(db, startDate, endDate, uid=uid, questionnaire=questionnaire or None,
+                                  minSeverity=minSeverity or None)
+        st.caption(f"{len(frame)} responses")
+        if frame.empty:
+            return
+        st.subheader("Per Day")
+        daily = aggregateResponses(frame, "day")
+        st.bar_chart(daily["responses"])
+        st.dataframe(daily, use_container_width=True)
+        if uid is None:
+            st.subheader("Per Participant")
+            st.dataframe(aggregateResponses(frame, "uid"), use_container_width=True)
+        st.subheader("Responses")
+        st.dataframe(frame, use_container_width=True, hide_index=True)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Move legacy Questionnaires Record maps into the response store")
+    parser.add_argument("uids", nargs="*", help="Participants to migrate (default: every account)")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    db = firestore.client()
+    uids = args.uids or [user.uid for user in auth.list_users().iterate_all()]
+    failed = 0
+    for uid in uids:
+        try:
+            print(f"{uid}: {migrateRecords(db, uid, args.dry_run)}")
+        except Exception as e:
+            failed += 1
+            print(f"{uid}: failed ({e})", file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,169 @@
+import argparse
+import sys
+from datetime import date, datetime
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, auth, usingFake
+from layout import READ_BATCH, readCalendars
+from schedule import NZ_TIMEZONE, WEEKDAYS
+
+# One document per participant in a top-level collection, denormalised from their Auth
+# account, Basic Info and Calendar, so cohort filters are a single indexed query instead
+# of listing every account and reading its collection. Onboarding writes the entry in the
+# same batch as the participant's documents, modification refreshes it after the Calendar
+# changes, and `python registry.py` backfills or re-syncs existing participants. Study
+# status is not stored, since it changes with the date rather than the documents: a status
+# filter becomes a range query on `start` and `end` against today. The composite indexes
+# are in firestore.indexes.json.
+REGISTRY_COLLECTION = "participants"
+UPCOMING = "upcoming"
+ACTIVE = "active"
+COMPLETED = "completed"
+PAGE_SIZE = 500
+MAX_WRITES_PER_BATCH = 500
+
+def registryRef(db, uid: str):
+    return db.collection(REGISTRY_COLLECTION).document(uid)
+
+def studyDays(calendar: dict) -> list:
+    """Sorted YYYY-MM-DD keys of a day-keyed calendar"""
+    days = []
+    for key in calendar:
+        try:
+            date.fromisoformat(key)
+        except ValueError:
+            continue
+        days.append(key)
+    return sorted(days)
+
+def studyStatus(start: str, end: str, today: date = None) -> str:
+    if not start:
+        return UPCOMING
+    today = (today or datetime.now(NZ_TIMEZONE).date()).strftime("%Y-%m-%d")
+    if today < start:
+        return UPCOMING
+    return ACTIVE if today <= end else COMPLETED
+
+def questionnaireDay(calendar: dict, days: list) -> str:
+    """Weekday of the most recent day scheduling a questionnaire"""
+    for day in reversed(days):
+        if "Questionnaire" in (calendar[day] or {}):
+            return WEEKDAYS[date.fromisoformat(day).weekday()]
+    return None
+
+def registryEntry(uid: str, email: str, basicInfo: dict, calendar: dict) -> dict:
+    days = studyDays(calendar)
+    start, end = (days[0], days[-1]) if days else (None, None)
+    return {"uid": uid, "email": (email or "").lower(), "gender": (basicInfo or {}).get("Gender"),
+            "start": start, "end": end, "days": len(days), "questionnaireDay": questionnaireDay(calendar, days),
+            "updated": firestore.SERVER_TIMESTAMP}
+
+def queueRegistryEntry(db, batch, uid: str, email: str, documents: dict):
+    """Queue the entry of a participant being onboarded on the batch writing their documents"""
+    batch.set(registryRef(db, uid), registryEntry(uid, email, documents.get("Basic Info"), documents.get("Calendar", {})))
+
+def refreshEntries(db, uids: list, emails: dict = None, dry_run: bool = False) -> list:
+    """Rebuild the entries of participants from their current documents, returns the entries
+
+    Emails come from `emails` (uid -> email), the existing entry or the Auth account, in
+    that order. Accounts without a Basic Info or Calendar document are not participants
+    and get no entry.
+    """
+    emails = dict(emails or {})
+    basicInfo, existing = {}, {}
+    for i in range(0, len(uids), READ_BATCH):
+        chunk = uids[i:i + READ_BATCH]
+        for snapshot in db.get_all([db.collection(uid).document("Basic Info") for uid in chunk]):
+            if snapshot.exists:
+                basicInfo[snapshot.reference.parent.id] = snapshot.to_dict() or {}
+        for snapshot in db.get_all([registryRef(db, uid) for uid in chunk], field_paths=["email"]):
+            if snapshot.exists:
+                existing[snapshot.id] = snapshot.to_dict() or {}
+    calendars = readCalendars(db, uids)
+
+    missing = [uid for uid in uids if not emails.get(uid) and not existing.get(uid, {}).get("email")]
+    for i in range(0, len(missing), READ_BATCH):
+        result = auth.get_users([auth.UidIdentifier(uid) for uid in missing[i:i + READ_BATCH]])
+        emails |= {user.uid: user.email for user in result.users}
+
+    entries = [registryEntry(uid, emails.get(uid) or existing.get(uid, {}).get("email"),
+                             basicInfo.get(uid), calendars.get(uid, {}))
+               for uid in uids if uid in basicInfo or calendars.get(uid)]
+    if dry_run:
+        return entries
+    for i in range(0, len(entries), MAX_WRITES_PER_BATCH):
+        batch = db.batch()
+        for entry in entries[i:i + MAX_WRITES_PER_BATCH]:
+            batch.set(registryRef(db, entry["uid"]), entry)
+        batch.commit()
+    return entries
+
+def statusFilters(status: str, today: date = None) -> list:
+    """Range filters on the study dates selecting participants with a status today"""
+    if status is None:
+        return []
+    today = (today or datetime.now(NZ_TIMEZONE).date()).strftime("%Y-%m-%d")
+    if status == UPCOMING:
+        return [("start", ">", today)]
+    if status == ACTIVE:
+        return [("start", "<=", today), ("end", ">=", today)]
+    if status == COMPLETED:
+        return [("end", "<", today)]
+    raise ValueError(f"Unknown study status {status!r}")
+
+def queryParticipants(db, gender: str = None, status: str = None, questionnaireDay: str = None,
+                      startFrom: date = None, startTo: date = None, fields: list = None, today: date = None):
+    """Stream registry entries matching the filters, ordered by study start, a page at a time"""
+    query = db.collection(REGISTRY_COLLECTION)
+    filters = [("gender", "==", gender), ("questionnaireDay", "==", questionnaireDay),
+               ("start", ">=", startFrom and startFrom.strftime("%Y-%m-%d")),
+               ("start", "<=", startTo and startTo.strftime("%Y-%m-%d"))] + statusFilters(status, today)
+    for field, op, value in filters:
+        if value is not None:
+            query = query.where(filter=firestore.FieldFilter(field, op, value))
+    query = query.order_by("start").order_by("uid")
+    if fields is not None:
+        query = query.select(sorted(set(fields) | {"start", "uid"}))
+
+    last = None
+    while True:
+        page = (query.start_after(last) if last else query).limit(PAGE_SIZE).get()
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        last = page[-1]
+
+def registryEmails(db, **filters) -> list:
+    """Emails of the participants matching registry filters"""
+    return sorted(snapshot.get("email") for snapshot in queryParticipants(db, fields=["email"], **filters))
+
+def backfill(db, dry_run: bool = False) -> int:
+    """Write an entry for every account that has participant documents, returns the number written"""
+    written = 0
+    page = auth.list_users(max_results=READ_BATCH)
+    while page:
+        emails = {user.uid: user.email for user in page.users}
+        entries = refreshEntries(db, list(emails), emails, dry_run)
+        for entry in entries:
+            print(f"{entry['uid']}: {entry['email']} {entry['start']} to {entry['end']} ({studyStatus(entry['start'], entry['end'])})")
+        written += len(entries)
+        page = page.get_next_page()
+    return written
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill or re-sync the participants registry")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    written = backfill(firestore.client(), args.dry_run)
+    print(f"{'would write' if args.dry_run else 'wrote'} {written} entries", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,59 @@
+import pytz
+from datetime import date, datetime, time
+
+NZ_TIMEZONE = pytz.timezone('Pacific/Auckland')
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+# Notification times only carry a time of day; the date part is a fixed placeholder
+REFERENCE_DATE = date(2000, 1, 1)
+
+def taskTimes(template: dict, userInfo: dict, questionnaireInfo: dict) -> dict:
+    """Collect the time of day for every task named in the Notifications template"""
+    tasks = {task for day in template.values() for task in day}
+    return {task: questionnaireInfo["time"] if task == "Questionnaire" else userInfo[task+"TaskTime"]
+            for task in tasks}
+
+def localizeTime(taskTime: time, tz=NZ_TIMEZONE) -> datetime:
+    """Attach a time of day to the reference date in the study timezone"""
+    naive_dt = datetime.combine(REFERENCE_DATE, taskTime.replace(microsecond=0, tzinfo=None))
+    return tz.localize(naive_dt)
+
+def buildNotificationSchedule(template: dict, times: dict, overrides: dict = None, tz=NZ_TIMEZONE) -> dict:
+    """Lay out notification times per weekday, localizing each distinct time only once
+
+    template is the Notifications section of structure.json (weekday -> tasks),
+    times maps task -> time and overrides maps weekday -> {task: time}.
+    """
+    overrides = overrides or {}
+    localized = {}
+
+    def lookup(taskTime):
+        if taskTime not in localized:
+            localized[taskTime] = localizeTime(taskTime, tz)
+        return localized[taskTime]
+
+    return {
+        day: {task: lookup(overrides.get(day, {}).get(task, times[task])) for task in tasks}
+        for day, tasks in template.items()
+    }
+
+def wallTime(value, tz=NZ_TIMEZONE):
+    """Time of day of a stored notification timestamp in the study timezone, None if unset"""
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(tz)
+    return value.time().replace(tzinfo=None)
+
+def fireTime(day: date, taskTime: time, tz=NZ_TIMEZONE) -> datetime:
+    """Localize a time of day on a given date, DST-correct
+
+    A time inside the spring-forward gap fires once the clocks have moved on (02:30 -> 03:30),
+    an ambiguous time at fall-back fires on its first occurrence.
+    """
+    naive_dt = datetime.combine(day, taskTime)
+    try:
+        return tz.localize(naive_dt, is_dst=None)
+    except pytz.NonExistentTimeError:
+        return tz.normalize(tz.localize(naive_dt, is_dst=False))
+    except pytz.AmbiguousTimeError:
+        return tz.localize(naive_dt, is_dst=True)
@@ -1,10 +1,16 @@
-import pytz
-from copy import deepcopy
-import json
+import secrets
 import streamlit as st
 from datetime import time, datetime, timedelta
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from audit import APPLIED, DEFERRED, FAILED, recordOnboarding
+from backend import firestore, auth
+from identity import createUser, deleteUsers, getUserByEmail
+from jobs import idempotencyKey, showJobs, submitJob
+from layout import queueParticipantWrites, schemaVersion
+from registry import queueRegistryEntry
+from schedule import WEEKDAYS, buildNotificationSchedule, taskTimes
+from studycalendar import generateCalendarDays, intervalCadence
+from templates import DEFAULT_TEMPLATE, loadTemplate, templateNames, thaw
+from writequeue import DONE, PENDING, Deferred, isPermanent, register, writeQueue
 
 def check_auth_and_redirect():
     """Verify authentication before showing page"""
@@ -16,72 +22,91 @@ def check_auth_and_redirect():
 def onBoardParticipant(email: str, password: str, userInfo: dict, questionnaireInfo: dict, structure: dict) -> str:
     """Your existing onBoardParticipant function"""
     try:
-        auth.get_user_by_email(email)
+        getUserByEmail(email)
         return "User already exists"
     except auth.UserNotFoundError:
         pass
     except ValueError:
         return "Invalid email or password"
 
+    structure = buildParticipantDocuments(userInfo, questionnaireInfo, structure)
+
+    # The op is recorded before the account exists, so documents are still written (or the
+    # account removed) if this process stops in between; the password itself is never stored.
+    # The uid is chosen here so recovery can tell this onboarding's account from another's.
+    queue = writeQueue()
+    uid = secrets.token_urlsafe(21)[:28]
+    opId = queue.enqueue("onboard", {"email": email, "uid": uid, "documents": structure, "schema": schemaVersion()},
+                         claimed=True)
     try:
-        user = auth.create_user(email=email, password=password)
+        user = createUser(uid=uid, email=email, password=password)
     except ValueError as e:
+        queue.discard(opId)
         return e
+    except Exception as e:
+        if isPermanent(e):
+            # e.g. the same email onboarded concurrently, nothing was created here
+            queue.discard(opId)
+            return "User already exists" if isinstance(e, auth.EmailAlreadyExistsError) else f"Account creation failed: {e}"
+        # A transport error leaves it unknown whether the account exists, the op finds out
+        op = queue.execute(opId, claimed=True)
+        outcome = {DONE: APPLIED, PENDING: DEFERRED}.get(op.status, FAILED)
+        recordOnboarding(op.state.get("uid"), email, structure, outcome, op=opId, error=str(e))
+        return "" if op.status == DONE else f"Account creation failed: {e}"
+    queue.setState(opId, uid=user.uid, created=True)
+
+    op = queue.execute(opId, claimed=True)
+    if op.status == DONE:
+        recordOnboarding(user.uid, email, structure, APPLIED, op=opId)
+        return ""
+    if op.status == PENDING:
+        recordOnboarding(user.uid, email, structure, DEFERRED, op=opId)
+        return f"Account created, writing the participant's documents failed. {Deferred(op)}"
+    recordOnboarding(user.uid, email, structure, FAILED, op=opId, error=op.last_error)
+    return f"Onboarding failed, the account was removed: {op.last_error}"
+
+def writeParticipant(payload: dict, state: dict):
+    """Write a new participant's documents, finding the account by email if its creation was interrupted"""
+    if "uid" not in state:
+        try:
+            user = getUserByEmail(payload["email"])
+        except auth.UserNotFoundError:
+            raise ValueError("The account was never created")
+        if payload.get("uid") and user.uid != payload["uid"]:
+            raise ValueError("The account belongs to another onboarding of this email")
+        state["uid"] = user.uid
+        state["created"] = bool(payload.get("uid"))
+    db = firestore.client()
+    batch = db.batch()
+    queueParticipantWrites(db, batch, state["uid"], payload["documents"], payload["schema"])
+    queueRegistryEntry(db, batch, state["uid"], payload["email"], payload["documents"])
+    batch.commit()
 
-    structure["Basic Info"]["Gender"] = userInfo["Gender"]
-    calendar = deepcopy(structure["Calendar"].pop("date"))
-    questionnaireCount = 14
-    
-    for date, x in [[(userInfo["start_date"] + timedelta(days=x)), x] for x in range(int(userInfo["time_frame"]))]:
-        data = deepcopy(calendar)
-
-        if questionnaireCount >= questionnaireInfo["frequency"]:
-            questionnaireCount = 1
-            data |= {"Questionnaire": {
-                "Completed": False,
-                "Link": questionnaireInfo["link"]
-            }}
-        else:
-            questionnaireCount += 1
+def removeParticipantAccount(payload: dict, state: dict):
+    """Compensation for writeParticipant: delete the account so onboarding can simply be retried
 
-        structure["Calendar"] |= {date.strftime("%Y-%m-%d"): deepcopy(data)}
+    Only an account this onboarding created is ever deleted.
+    """
+    if state.get("created"):
+        deleteUsers([state["uid"]])
 
-        NZ_TIMEZONE = pytz.timezone('Pacific/Auckland')
+register("onboard", writeParticipant, removeParticipantAccount)
 
-        for Day in structure["Notifications"]:
-            for task in structure["Notifications"][Day]:
-                if task == "Questionnaire":
-                    # First create the naive datetime
-                    naive_dt = datetime.strptime(
-                        "2000-01-01 " + questionnaireInfo["time"].strftime("%H:%M:%S"), 
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    # Then localize it to NZ timezone
-                    structure["Notifications"][Day][task] = NZ_TIMEZONE.localize(naive_dt)
-                    '''
-                    structure["Notifications"][Day][task] = datetime.strptime(
-                        "2000-01-01 " + questionnaireInfo["time"].strftime("%H:%M:%S"), 
-                        "%Y-%m-%d %H:%M:%S"
-                    ).astimezone(NZ_TIMEZONE)'''
-                else:
-                    # First create the naive datetime
-                    naive_dt = datetime.strptime(
-                        "2000-01-01 " + userInfo[task+"TaskTime"].strftime("%H:%M:%S"), 
-                        "%Y-%m-%d %H:%M:%S"
-                    )
-                    # Then localize it to NZ timezone
-                    structure["Notifications"][Day][task] = NZ_TIMEZONE.localize(naive_dt)
-                    '''
-                    structure["Notifications"][Day][task] = datetime.strptime(
-                        "2000-01-01 " + userInfo[task+"TaskTime"].strftime("%H:%M:%S"), 
-                        "%Y-%m-%d %H:%M:%S"
-                    ).astimezone(NZ_TIMEZONE)'''
+def buildParticipantDocuments(userInfo: dict, questionnaireInfo: dict, structure: dict) -> dict:
+    """Fill a copy of the structure template with a participant's calendar and notification times"""
+    structure = thaw(structure)
+    structure["Basic Info"]["Gender"] = userInfo["Gender"]
+    tasks = tuple(structure["Calendar"].pop("date"))
+    structure["Calendar"].update(generateCalendarDays(
+        userInfo["start_date"], int(userInfo["time_frame"]), tasks,
+        questionnaireInfo["link"], intervalCadence(questionnaireInfo["frequency"])))
 
-    db = firestore.client()
-    for key in structure.keys():
-        db.collection(user.uid).document(key).set(structure[key])
+    structure["Notifications"] = buildNotificationSchedule(
+        structure["Notifications"],
+        taskTimes(structure["Notifications"], userInfo, questionnaireInfo),
+        userInfo.get("NotificationOverrides"))
 
-    return ""
+    return structure
 
 def main():
     if not check_auth_and_redirect():
@@ -113,7 +138,23 @@ def main():
             questionnaireTime = st.time_input(
                 "Questionnaire Time", value=time(20, 00, 0), step=60*5)
 
+        with st.expander("Per-day Timing Overrides"):
+            overrideDays = st.multiselect("Days", WEEKDAYS)
+            col1, col2 = st.columns(2)
+            with col1:
+                checkinOverride = st.time_input(
+                    "Checkin Override Time", value=time(8, 0, 0), step=60*5)
+                hailieOverride = st.time_input(
+                    "Hailie Override Time", value=time(8, 0, 0), step=60*5)
+            with col2:
+                coughMonitorOverride = st.time_input(
+                    "Cough Monitor Override Time", value=time(22, 00, 0), step=60*5)
+                questionnaireOverride = st.time_input(
+                    "Questionnaire Override Time", value=time(20, 00, 0), step=60*5)
+
         st.subheader("Study Configuration")
+        names = templateNames()
+        templateName = st.selectbox("Study Template", names) if len(names) > 1 else DEFAULT_TEMPLATE
         questionnaireLink = st.text_input("Questionnaire Link")
         timeFrame = st.slider("Time Frame (months)",
                           min_value=1, max_value=12, value=7, step=1)
@@ -130,6 +171,12 @@ def main():
                     "HailieTaskTime": hailieTaskTime,
                     "Cough MonitorTaskTime": coughMonitorTaskTime,
                     "time_frame": (timeFrame * 31) - 3,
+                    "NotificationOverrides": {day: {
+                        "CheckIn": checkinOverride,
+                        "Hailie": hailieOverride,
+                        "Cough Monitor": coughMonitorOverride,
+                        "Questionnaire": questionnaireOverride,
+                    } for day in overrideDays},
                 }
 
                 questionnaireInfo = {
@@ -138,15 +185,19 @@ def main():
                     "link": questionnaireLink
                 }
 
-                with open("structure.json", "r") as f:
-                    structure = json.load(f)
+                structure = loadTemplate(templateName)
 
-                err = onBoardParticipant(
-                    email, password, usrInfo, questionnaireInfo, structure)
-                if err:
-                    st.error(err)
-                else:
-                    st.success("Participant successfully onboarded!")
+                def onboard():
+                    err = onBoardParticipant(
+                        email, password, usrInfo, questionnaireInfo, structure)
+                    if err:
+                        raise RuntimeError(str(err))
+                    return "Participant successfully onboarded!"
+
+                submitJob(f"Onboarding {email}", [("Creating participant", onboard)],
+                          key=idempotencyKey("onboard", email, usrInfo, questionnaireInfo, templateName))
+
+    showJobs()
 
 if __name__ == "__main__":
     st.error("Please access this application through the main portal")
@@ -0,0 +1,74 @@
+import logging
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+import streamlit as st
+import backend
+
+# Set DIGIPREDICT_PREWARM=0 to skip opening the Firestore channel in the background after login
+PREWARM_ENV = "DIGIPREDICT_PREWARM"
+PROCESS_START = time.perf_counter()
+
+_timings = {}
+_runs = []
+_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+@contextmanager
+def timed(name: str):
+    """Record how long a startup step took, in milliseconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _timings[name] = (time.perf_counter() - start) * 1000
+
+@contextmanager
+def scriptRun():
+    """Time one script run; the first run of the process is the cold start"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            if not _runs:
+                _timings["cold start (first run)"] = (end - PROCESS_START) * 1000
+            _runs.append((end - start) * 1000)
+            del _runs[:-100]
+
+def _prewarm():
+    try:
+        with timed("firestore client"):
+            db = backend.firestore.client()
+        with timed("firestore first round-trip"):
+            db.collection("_warmup").document("ping").get()
+    except Exception as e:
+        logger.warning("Firestore warm-up failed: %s", e)
+
+@st.cache_resource(show_spinner=False)
+def warmUp():
+    """Create the shared Firestore client once per process, opening its channel in the background"""
+    if os.environ.get(PREWARM_ENV, "1") == "0":
+        return None
+    thread = threading.Thread(target=_prewarm, name="firestore-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def showDebugPanel():
+    """Startup and rerun timings in the sidebar, shown with ?debug=1"""
+    if st.query_params.get("debug") != "1":
+        return
+    with _lock:
+        timings = dict(_timings)
+        runs = list(_runs)
+    with st.sidebar.expander("⏱️ Startup Timings", expanded=True):
+        st.markdown(f"**Backend:** {backend.current().name}")
+        for name, ms in timings.items():
+            st.markdown(f"{name}: `{ms:.0f} ms`")
+        if len(runs) > 1:
+            st.markdown(f"warm reruns: `{statistics.median(runs[1:]):.0f} ms` median over {len(runs) - 1}")
@@ -0,0 +1,37 @@
+from datetime import date, timedelta
+
+DEFAULT_TASKS = ("Hailie", "Cough Monitor", "CheckIn")
+
+def intervalCadence(frequency: int):
+    """Questionnaire on the first study day and every `frequency` days after it (onboarding)"""
+    def cadence(startDate: date, index: int, day: date) -> bool:
+        return index % frequency == 0
+    return cadence
+
+def weekdayCadence(weekday: int, every: int = 2):
+    """Questionnaire on every `every`-th occurrence of a weekday, the first falling on occurrence `every` (extensions)"""
+    def cadence(startDate: date, index: int, day: date) -> bool:
+        if day.weekday() != weekday:
+            return False
+        first = startDate + timedelta(days=(weekday - startDate.weekday()) % 7)
+        return ((day - first).days // 7 + 1) % every == 0
+    return cadence
+
+def generateCalendarDays(startDate: date, days: int, tasks=DEFAULT_TASKS,
+                         questionnaireLink: str = "", cadence=None):
+    """Yield (YYYY-MM-DD, task map) pairs for each study day, building fresh dicts per day"""
+    for index in range(days):
+        day = startDate + timedelta(days=index)
+        data = {task: {"Completed": False} for task in tasks}
+        if cadence is not None and cadence(startDate, index, day):
+            data["Questionnaire"] = {
+                "Completed": False,
+                "Link": questionnaireLink
+            }
+        yield day.strftime("%Y-%m-%d"), data
+
+def generateCalendarRange(startDate: date, endDate: date, tasks=DEFAULT_TASKS,
+                          questionnaireLink: str = "", cadence=None):
+    """Same as generateCalendarDays for an inclusive start/end date range"""
+    return generateCalendarDays(startDate, (endDate - startDate).days + 1, tasks,
+                                questionnaireLink, cadence)
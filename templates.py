@@ -0,0 +1,76 @@
+import glob
+import json
+import os
+import threading
+from types import MappingProxyType
+from schedule import WEEKDAYS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# structure.json is the default protocol; further protocols live in templates/<name>.json
+DEFAULT_TEMPLATE = "default"
+DEFAULT_TEMPLATE_PATH = os.path.join(BASE_DIR, "structure.json")
+TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
+REQUIRED_SECTIONS = ("Basic Info", "Calendar", "Notifications", "Questionnaires", "Location")
+
+_cache = {}
+_lock = threading.Lock()
+
+def templatePaths() -> dict:
+    """Map every available template name to its file"""
+    paths = {DEFAULT_TEMPLATE: DEFAULT_TEMPLATE_PATH}
+    for path in sorted(glob.glob(os.path.join(TEMPLATE_DIR, "*.json"))):
+        paths[os.path.splitext(os.path.basename(path))[0]] = path
+    return paths
+
+def templateNames() -> list:
+    """Names of the available study templates, default first"""
+    return list(templatePaths())
+
+def validateTemplate(name: str, structure: dict):
+    """Raise ValueError if a template is missing anything onboarding relies on"""
+    missing = [section for section in REQUIRED_SECTIONS if section not in structure]
+    if missing:
+        raise ValueError(f"Template {name!r} is missing sections: {', '.join(missing)}")
+    if not isinstance(structure["Calendar"].get("date"), dict) or not structure["Calendar"]["date"]:
+        raise ValueError(f"Template {name!r} needs a non-empty Calendar.date task map")
+    unknown = [day for day in structure["Notifications"] if day not in WEEKDAYS]
+    if unknown:
+        raise ValueError(f"Template {name!r} has unknown Notifications days: {', '.join(unknown)}")
+
+def freeze(value):
+    """Recursively wrap a parsed template in read-only views"""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def thaw(value):
+    """Mutable copy of a frozen (or plain) template section"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(v) for v in value]
+    return value
+
+def loadTemplate(name: str = DEFAULT_TEMPLATE):
+    """Read-only view of a template, parsed and validated once per file modification"""
+    paths = templatePaths()
+    if name not in paths:
+        raise ValueError(f"Unknown study template {name!r}")
+    path = paths[name]
+    mtime = os.stat(path).st_mtime_ns
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    with open(path, "r") as f:
+        structure = json.load(f)
+    validateTemplate(name, structure)
+    frozen = freeze(structure)
+
+    with _lock:
+        _cache[path] = (mtime, frozen)
+    return frozen
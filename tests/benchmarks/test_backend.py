@@ -0,0 +1,66 @@
+from datetime import timedelta
+import pytest
+import backend
+import identity
+from cohort import onBoardCohort
+from fakefirebase import FakeFirebase
+from modify import extendStudyDates, removeStudyDates
+from server import onBoardParticipant
+from templates import loadTemplate
+from tests.samples import sampleParticipant, sampleRoster
+
+# Onboarding and study modification against the in-memory backend, each round on an empty
+# one. The backend traffic of a round (round trips, reads, writes, payload bytes) is kept
+# in the benchmark's extra_info; audit entries go to local files and are not counted.
+pytest.importorskip("pytest_benchmark")
+
+ROUNDS = 3
+EMAIL = "participant@example.com"
+
+def measure(benchmark, target, prepare=None):
+    """Benchmark target on a fresh backend per round, after prepare() has run on it"""
+    backends = []
+    def setup():
+        fb = FakeFirebase()
+        backend.use(fb)
+        identity.invalidate()
+        if prepare:
+            prepare()
+        fb.stats.reset()
+        backends.append(fb)
+    benchmark.pedantic(target, setup=setup, rounds=ROUNDS, iterations=1)
+    stats = backends[-1].stats.snapshot()
+    benchmark.extra_info.update({key: value for key, value in stats.items() if key != "calls"})
+    return stats
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_onboard_single(benchmark, queue, count):
+    usrInfo, questionnaireInfo = sampleParticipant(7)
+    benchmark.group = f"onboard x{count}"
+    stats = measure(benchmark, lambda: [
+        onBoardParticipant(f"participant{i}@example.com", "benchmark", usrInfo, questionnaireInfo, loadTemplate())
+        for i in range(count)])
+    assert stats["round_trips"] == 3 * count
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_onboard_cohort(benchmark, queue, count):
+    benchmark.group = f"onboard x{count}"
+    stats = measure(benchmark, lambda: onBoardCohort(sampleRoster(count), loadTemplate()))
+    assert stats["round_trips"] == 3
+
+@pytest.mark.parametrize("days", [7, 90, 365])
+def test_remove(benchmark, queue, days):
+    usrInfo, questionnaireInfo = sampleParticipant(12)
+    start = usrInfo["start_date"]
+    benchmark.group = f"modify {days} days"
+    measure(benchmark, lambda: removeStudyDates(EMAIL, start, start + timedelta(days=days - 1)),
+            lambda: onBoardParticipant(EMAIL, "benchmark", usrInfo, questionnaireInfo, loadTemplate()))
+
+@pytest.mark.parametrize("days", [7, 90, 365])
+def test_extend(benchmark, queue, days):
+    usrInfo, questionnaireInfo = sampleParticipant(12)
+    end = usrInfo["start_date"] + timedelta(days=usrInfo["time_frame"] - 1)
+    benchmark.group = f"modify {days} days"
+    measure(benchmark, lambda: extendStudyDates(EMAIL, end + timedelta(days=1), end + timedelta(days=days), 2,
+                                                questionnaireInfo["link"]),
+            lambda: onBoardParticipant(EMAIL, "benchmark", usrInfo, questionnaireInfo, loadTemplate()))
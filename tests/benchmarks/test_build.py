@@ -0,0 +1,73 @@
+import json
+import os
+from copy import deepcopy
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from server import buildParticipantDocuments
+from tests.samples import sampleParticipant
+
+# Document building before and after the notification schedule and calendar generators.
+# Run with python -m pytest tests/benchmarks (needs pytest-benchmark).
+pytest.importorskip("pytest_benchmark")
+
+STRUCTURE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                              "structure.json")
+
+def legacyBuildParticipantDocuments(userInfo: dict, questionnaireInfo: dict, structure: dict) -> dict:
+    """Document building as it was before the notification schedule and calendar generators"""
+    structure["Basic Info"]["Gender"] = userInfo["Gender"]
+    calendar = deepcopy(structure["Calendar"].pop("date"))
+    questionnaireCount = 14
+
+    for date, x in [[(userInfo["start_date"] + timedelta(days=x)), x] for x in range(int(userInfo["time_frame"]))]:
+        data = deepcopy(calendar)
+
+        if questionnaireCount >= questionnaireInfo["frequency"]:
+            questionnaireCount = 1
+            data |= {"Questionnaire": {
+                "Completed": False,
+                "Link": questionnaireInfo["link"]
+            }}
+        else:
+            questionnaireCount += 1
+
+        structure["Calendar"] |= {date.strftime("%Y-%m-%d"): deepcopy(data)}
+
+        NZ_TIMEZONE = pytz.timezone('Pacific/Auckland')
+
+        for Day in structure["Notifications"]:
+            for task in structure["Notifications"][Day]:
+                if task == "Questionnaire":
+                    naive_dt = datetime.strptime(
+                        "2000-01-01 " + questionnaireInfo["time"].strftime("%H:%M:%S"),
+                        "%Y-%m-%d %H:%M:%S"
+                    )
+                    structure["Notifications"][Day][task] = NZ_TIMEZONE.localize(naive_dt)
+                else:
+                    naive_dt = datetime.strptime(
+                        "2000-01-01 " + userInfo[task+"TaskTime"].strftime("%H:%M:%S"),
+                        "%Y-%m-%d %H:%M:%S"
+                    )
+                    structure["Notifications"][Day][task] = NZ_TIMEZONE.localize(naive_dt)
+
+    return structure
+
+@pytest.fixture(scope="module")
+def structure() -> dict:
+    with open(STRUCTURE_PATH, "r") as f:
+        return json.load(f)
+
+@pytest.mark.parametrize("months", range(1, 13))
+def test_matches_legacy(structure, months):
+    usrInfo, questionnaireInfo = sampleParticipant(months)
+    assert legacyBuildParticipantDocuments(usrInfo, questionnaireInfo, deepcopy(structure)) \
+        == buildParticipantDocuments(usrInfo, questionnaireInfo, deepcopy(structure))
+
+@pytest.mark.parametrize("build", [legacyBuildParticipantDocuments, buildParticipantDocuments],
+                         ids=["legacy", "current"])
+@pytest.mark.parametrize("months", [1, 7, 12])
+def test_build(benchmark, structure, months, build):
+    usrInfo, questionnaireInfo = sampleParticipant(months)
+    benchmark.group = f"build {months} months"
+    benchmark(lambda: build(usrInfo, questionnaireInfo, deepcopy(structure)))
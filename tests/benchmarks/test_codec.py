@@ -0,0 +1,47 @@
+import pytest
+from calendarcodec import decodeCalendar, encodeCalendar
+from tests.samples import sampleCalendar
+
+# Nested-map vs packed Calendar documents: stored size, wire size and time to parse a read.
+pytest.importorskip("pytest_benchmark")
+
+MONTHS = [1, 3, 7, 12]
+
+def firestoreSize(value) -> int:
+    """Stored size of a value by Firestore's storage size rules"""
+    if isinstance(value, dict):
+        return sum(len(key.encode()) + 1 + firestoreSize(v) for key, v in value.items())
+    if isinstance(value, list):
+        return sum(map(firestoreSize, value))
+    if isinstance(value, str):
+        return len(value.encode()) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    return 8
+
+@pytest.mark.parametrize("months", MONTHS)
+def test_packed_is_smaller(months):
+    calendar = sampleCalendar(months)
+    packed = encodeCalendar(calendar)
+    assert decodeCalendar(packed) == calendar
+    assert firestoreSize(packed) < firestoreSize(calendar) / 4
+
+@pytest.mark.parametrize("layout", ["nested", "packed"])
+@pytest.mark.parametrize("months", MONTHS)
+def test_parse(benchmark, months, layout):
+    """Deserialising a read of the Calendar document into a day-keyed calendar"""
+    helpers = pytest.importorskip("google.cloud.firestore_v1._helpers")
+    documentTypes = pytest.importorskip("google.cloud.firestore_v1.types.document")
+    calendar = sampleCalendar(months)
+    data = calendar if layout == "nested" else encodeCalendar(calendar)
+    wire = documentTypes.Document.serialize(documentTypes.Document(fields=helpers.encode_dict(data)))
+
+    def parse():
+        fields = helpers.decode_dict(documentTypes.Document.deserialize(wire).fields, None)
+        return fields if layout == "nested" else decodeCalendar(fields)
+
+    benchmark.group = f"parse {months} months"
+    benchmark.extra_info.update(stored_bytes=firestoreSize(data), wire_bytes=len(wire))
+    assert benchmark(parse) == calendar
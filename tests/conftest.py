@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+# The app modules live at the repository root and pick their backend on first use,
+# so both are settled before any test imports them.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DIGIPREDICT_BACKEND"] = "fake"
+os.environ["DIGIPREDICT_TRACE_FILE"] = ""
+os.environ["DIGIPREDICT_AUDIT_SINK"] = "jsonl"
+os.environ["DIGIPREDICT_AUDIT_DIR"] = tempfile.mkdtemp(prefix="digipredict-tests-audit-")
+
+import pytest
+import backend
+import identity
+import writequeue
+from fakefirebase import FakeFirebase
+
+@pytest.fixture
+def fb():
+    """An empty in-memory backend every module talks to for the length of a test"""
+    fb = FakeFirebase()
+    backend.use(fb)
+    identity.invalidate()
+    return fb
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """A fresh process-wide write queue in a temporary database, without the background loop"""
+    queue = writequeue.WriteQueue(str(tmp_path / "writequeue.sqlite3"))
+    monkeypatch.setattr(writequeue, "_queue", queue)
+    return queue
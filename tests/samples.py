@@ -0,0 +1,37 @@
+import random
+from datetime import date, time
+from server import buildParticipantDocuments
+from templates import loadTemplate
+
+def sampleParticipant(months: int):
+    """userInfo and questionnaireInfo as the onboarding form builds them"""
+    usrInfo = {
+        "Gender": "Female",
+        "start_date": date(2025, 1, 6),
+        "CheckInTaskTime": time(8, 0, 0),
+        "HailieTaskTime": time(8, 0, 0),
+        "Cough MonitorTaskTime": time(22, 0, 0),
+        "time_frame": (months * 31) - 3,
+    }
+    questionnaireInfo = {
+        "time": time(20, 0, 0),
+        "frequency": 14,
+        "link": "https://example.com/questionnaire"
+    }
+    return usrInfo, questionnaireInfo
+
+def sampleRoster(count: int) -> list:
+    """Roster rows as cohort onboarding reads them from a CSV upload"""
+    return [{"email": f"participant{i}@example.com", "password": "benchmark",
+             "gender": "Female" if i % 2 else "Male", "start_date": "2025-01-06",
+             "questionnaire_link": "https://example.com/questionnaire"} for i in range(count)]
+
+def sampleCalendar(months: int, completion: float = 0.7) -> dict:
+    """A generated study calendar with a share of its tasks completed"""
+    usrInfo, questionnaireInfo = sampleParticipant(months)
+    calendar = buildParticipantDocuments(usrInfo, questionnaireInfo, loadTemplate())["Calendar"]
+    rng = random.Random(months)
+    for tasks in calendar.values():
+        for status in tasks.values():
+            status["Completed"] = rng.random() < completion
+    return calendar
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+import audit
+from audit import AuditLog, FirestoreSink, JsonlSink, auditEntry, calendarDiff
+from backend import firestore
+
+class ListSink:
+    """Sink keeping the batches it was given, failing those holding a `fail` entry"""
+    name = "list"
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def write(self, entries: list):
+        if self.error and any(entry["details"].get("fail") for entry in entries):
+            raise self.error
+        self.batches.append([entry["uid"] for entry in entries])
+
+    def query(self, uid=None, since=None, until=None, limit=audit.QUERY_LIMIT):
+        return []
+
+@pytest.fixture(autouse=True)
+def noBackgroundFlush(monkeypatch):
+    # Only explicit flushes write in these tests
+    monkeypatch.setattr(AuditLog, "_loop", lambda log: None)
+
+def entry(uid: str, **details) -> dict:
+    return auditEntry(audit.MODIFY, uid, actor="tester", **details)
+
+def test_flush_writes_batches_in_order(monkeypatch):
+    monkeypatch.setattr(audit, "FLUSH_BATCH", 2)
+    sink = ListSink()
+    log = AuditLog(sink)
+    for i in range(5):
+        log.record(entry(f"participant{i}"))
+    assert log.flush() == 5
+    assert sink.batches == [["participant0", "participant1"], ["participant2", "participant3"], ["participant4"]]
+    assert log.stats()["pending"] == 0
+
+def test_transient_failure_keeps_entries_buffered():
+    sink = ListSink(ConnectionError("unavailable"))
+    log = AuditLog(sink)
+    log.record(entry("participant0", fail=True))
+    log.record(entry("participant1"))
+    with pytest.raises(ConnectionError):
+        log.flush()
+    assert [e["uid"] for e in log.pending()] == ["participant0", "participant1"]
+    assert log.stats()["last_error"] == "ConnectionError: unavailable"
+
+    sink.error = None
+    assert log.flush() == 2
+    assert log.stats() == {"sink": "list", "pending": 0, "written": 2, "rejected": 0, "last_error": None}
+
+def test_rejected_entries_are_isolated_and_set_aside():
+    sink, rejected = ListSink(ValueError("invalid nested entity")), ListSink()
+    log = AuditLog(sink, rejected)
+    for i in range(8):
+        log.record(entry(f"participant{i}", fail=i == 5))
+    assert log.flush() == 7
+    assert sorted(uid for batch in sink.batches for uid in batch) == [f"participant{i}" for i in range(8) if i != 5]
+    assert rejected.batches == [["participant5"]]
+    assert log.rejected == 1 and log.pending() == []
+
+def test_entry_nobody_can_store_stays_visible():
+    log = AuditLog(ListSink(ValueError("invalid")), None)
+    log.record(entry("participant0", fail=True))
+    log.flush()
+    assert [e["uid"] for e in log.query(uid="participant0")] == ["participant0"]
+
+def test_transient_failure_during_bisection_keeps_only_unwritten_entries():
+    class Flaky(ListSink):
+        def write(self, entries):
+            if len(entries) == 4:
+                raise ValueError("too large")
+            if entries[0]["uid"] == "participant2":
+                raise ConnectionError("unavailable")
+            super().write(entries)
+    sink = Flaky()
+    log = AuditLog(sink)
+    for i in range(4):
+        log.record(entry(f"participant{i}"))
+    with pytest.raises(ConnectionError):
+        log.flush()
+    assert sink.batches == [["participant0", "participant1"]]
+    assert [e["uid"] for e in log.pending()] == ["participant2", "participant3"]
+
+def test_firestore_sink_tolerates_a_repeated_batch(fb):
+    sink = FirestoreSink()
+    entries = [entry("participant0"), entry("participant1")]
+    sink.write(entries[:1])
+    # The first write committed but its response was lost, so it comes again with a newer entry
+    sink.write(entries)
+    assert len(list(firestore.client().collection(audit.AUDIT_COLLECTION).stream())) == 2
+    assert [e["uid"] for e in sink.query(uid="participant1")] == ["participant1"]
+
+def test_jsonl_sink_round_trip(tmp_path):
+    sink = JsonlSink(str(tmp_path))
+    old, new = entry("participant0"), entry("participant0")
+    old["at"] -= timedelta(days=1)
+    sink.write([old])
+    sink.write([new])
+    stored = sink.query(uid="participant0")
+    assert [e["id"] for e in stored] == [new["id"], old["id"]]
+    assert stored[0]["at"] == new["at"]
+    assert sink.query(since=datetime.now(timezone.utc) - timedelta(hours=1)) == [stored[0]]
+
+def test_calendar_diff():
+    current = {"2025-01-06": {"Hailie": {"Completed": True}}, "2025-01-07": {"Hailie": {"Completed": False}}}
+    diff = calendarDiff(current, {"2025-01-06.CheckIn": {"Completed": False},
+                                  "2025-01-07": firestore.DELETE_FIELD, "2025-01-08": {"Hailie": {"Completed": False}}})
+    assert diff == {"removed": {"2025-01-07": {"Hailie": {"Completed": False}}},
+                    "added": {"2025-01-08": {"Hailie": {"Completed": False}}},
+                    "updated": {"2025-01-06": {"before": {"Hailie": {"Completed": True}},
+                                               "after": {"Hailie": {"Completed": True}, "CheckIn": {"Completed": False}}}}}
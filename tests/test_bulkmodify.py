@@ -0,0 +1,90 @@
+from datetime import date
+import pytest
+import bulkmodify
+from backend import auth, firestore
+from bulkmodify import Throttle, bulkModify, normalizeEmails, readCheckpoint
+from layout import calendarRef, readCalendar
+from modify import commitFieldUpdates
+from studycalendar import generateCalendarRange
+
+PAUSE = (date(2025, 1, 11), date(2025, 1, 12))
+
+@pytest.fixture
+def db(fb):
+    db = firestore.client()
+    for i in range(4):
+        user = auth.create_user(uid=f"participant{i}", email=f"participant{i}@example.com", password="password1")
+        # The last participant's study ends before the removed days
+        end = date(2025, 1, 10) if i == 3 else date(2025, 1, 12)
+        calendarRef(db, user.uid).set(dict(generateCalendarRange(date(2025, 1, 6), end)))
+    return db
+
+def statuses(report: list) -> dict:
+    return {row["email"]: row["status"] for row in report}
+
+def test_normalize_emails():
+    assert normalizeEmails([" A@Example.com", "a@example.com", "", "b@example.com "]) == \
+        ["a@example.com", "b@example.com"]
+
+def test_checkpoint_records_finished_participants(db, tmp_path):
+    checkpoint = str(tmp_path / "bulk.jsonl")
+    emails = [f"participant{i}@example.com" for i in range(4)] + ["missing@example.com"]
+    report = bulkModify(emails, pause=PAUSE, checkpoint=checkpoint)
+    assert statuses(report) == {"participant0@example.com": "done", "participant1@example.com": "done",
+                                "participant2@example.com": "done", "participant3@example.com": "unchanged",
+                                "missing@example.com": "failed"}
+    assert "2025-01-11" not in readCalendar(db, "participant0")
+    assert statuses(readCheckpoint(checkpoint).values()) == {f"participant{i}@example.com": status for i, status
+                                                            in enumerate(["done", "done", "done", "unchanged"])}
+
+def test_rerun_skips_finished_participants(db, fb, tmp_path):
+    checkpoint = str(tmp_path / "bulk.jsonl")
+    emails = [f"participant{i}@example.com" for i in range(4)]
+    bulkModify(emails, pause=PAUSE, checkpoint=checkpoint)
+    fb.stats.reset()
+
+    report = bulkModify(emails, pause=PAUSE, checkpoint=checkpoint)
+    assert all(row["message"] == "Finished in an earlier run" for row in report)
+    assert fb.stats.snapshot()["writes"] == 0
+
+def test_interrupted_run_resumes_failed_participants(db, tmp_path, monkeypatch):
+    checkpoint = str(tmp_path / "bulk.jsonl")
+    emails = [f"participant{i}@example.com" for i in range(3)]
+    # One participant per commit, so only the failing participant's commit is lost
+    monkeypatch.setattr(bulkmodify, "MAX_WRITES_PER_BATCH", 1)
+
+    def failFor(db, writes):
+        if any(ref.id == "Calendar" and ref.parent.id == "participant1" for ref, _, _ in writes):
+            raise ConnectionError("deadline exceeded")
+        return commitFieldUpdates(db, writes)
+    monkeypatch.setattr(bulkmodify, "commitFieldUpdates", failFor)
+    report = bulkModify(emails, pause=PAUSE, checkpoint=checkpoint)
+    assert statuses(report)["participant1@example.com"] == "failed"
+    assert "2025-01-11" in readCalendar(db, "participant1")
+    assert set(readCheckpoint(checkpoint)) == {"participant0@example.com", "participant2@example.com"}
+
+    monkeypatch.setattr(bulkmodify, "commitFieldUpdates", commitFieldUpdates)
+    report = bulkModify(emails, pause=PAUSE, checkpoint=checkpoint)
+    assert statuses(report) == {email: "done" for email in emails}
+    assert {row["email"] for row in report if row["message"] == "Finished in an earlier run"} == \
+        {"participant0@example.com", "participant2@example.com"}
+    assert "2025-01-11" not in readCalendar(db, "participant1")
+
+def test_dry_run_changes_nothing(db, fb, tmp_path):
+    checkpoint = str(tmp_path / "bulk.jsonl")
+    fb.stats.reset()
+    report = bulkModify(["participant0@example.com", "participant3@example.com"], pause=PAUSE,
+                        checkpoint=checkpoint, dry_run=True)
+    assert statuses(report) == {"participant0@example.com": "planned", "participant3@example.com": "unchanged"}
+    assert report[0]["removed"] == 2
+    assert fb.stats.snapshot()["writes"] == 0
+    assert readCheckpoint(checkpoint) == {}
+
+def test_throttle_waits_for_tokens(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(bulkmodify.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(bulkmodify.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    throttle = Throttle(rate=100)
+    throttle.acquire(100)
+    throttle.acquire(50)
+    assert clock[0] == pytest.approx(0.5)
@@ -0,0 +1,40 @@
+from datetime import date
+from backend import firestore
+from calendarcodec import applyChanges, decodeCalendar, encodeCalendar, isPacked
+from studycalendar import generateCalendarDays, intervalCadence
+
+def sampleCalendar(days: int = 60) -> dict:
+    return dict(generateCalendarDays(date(2025, 1, 6), days, questionnaireLink="https://example.com/q",
+                                     cadence=intervalCadence(14)))
+
+def test_round_trip():
+    calendar = sampleCalendar()
+    calendar["2025-01-07"]["Hailie"]["Completed"] = True
+    packed = encodeCalendar(calendar)
+    assert isPacked(packed)
+    assert decodeCalendar(packed) == calendar
+
+def test_round_trip_keeps_irregular_statuses():
+    calendar = sampleCalendar(20)
+    calendar["2025-01-08"]["CheckIn"] = {"Completed": "yes", "Note": "late"}
+    calendar["2025-01-20"]["Questionnaire"]["Link"] = "https://example.com/other"
+    del calendar["2025-01-10"]
+    assert decodeCalendar(encodeCalendar(calendar)) == calendar
+
+def test_empty_calendar():
+    assert decodeCalendar(encodeCalendar({})) == {}
+
+def test_decode_range():
+    calendar = sampleCalendar(30)
+    decoded = decodeCalendar(encodeCalendar(calendar), "2025-01-10", "2025-01-12")
+    assert sorted(decoded) == ["2025-01-10", "2025-01-11", "2025-01-12"]
+
+def test_apply_changes_by_day_and_task_path():
+    calendar = sampleCalendar(10)
+    changes = {"2025-01-06": firestore.DELETE_FIELD,
+               "2025-01-07.Hailie": {"Completed": True},
+               "2025-01-20": {"Hailie": {"Completed": False}}}
+    result = decodeCalendar(applyChanges(encodeCalendar(calendar), changes))
+    assert "2025-01-06" not in result
+    assert result["2025-01-07"] == calendar["2025-01-07"] | {"Hailie": {"Completed": True}}
+    assert result["2025-01-20"] == {"Hailie": {"Completed": False}}
@@ -0,0 +1,68 @@
+import pytest
+import cohort
+import fakefirebase
+from backend import auth, firestore
+from cohort import onBoardCohort, parseRow, writeGroups
+from layout import SCHEMA_ENV, calendarRef
+from modify import MAX_WRITES_PER_BATCH
+from templates import loadTemplate
+from tests.samples import sampleRoster
+
+def entry(documents: int) -> dict:
+    return {"documents": {f"Document {i}": {} for i in range(documents)}}
+
+def test_groups_fit_one_batch(monkeypatch):
+    monkeypatch.delenv(SCHEMA_ENV, raising=False)
+    # Every participant takes its documents plus one registry entry
+    entries = [entry(9) for _ in range(120)]
+    groups = writeGroups(entries)
+    assert [len(group) for group in groups] == [50, 50, 20]
+    assert all(sum(len(e["documents"]) + 1 for e in group) <= MAX_WRITES_PER_BATCH for group in groups)
+    assert [e for group in groups for e in group] == entries
+
+def test_oversized_participant_gets_its_own_group(monkeypatch):
+    monkeypatch.delenv(SCHEMA_ENV, raising=False)
+    entries = [entry(3), entry(MAX_WRITES_PER_BATCH), entry(3)]
+    assert [len(group) for group in writeGroups(entries)] == [1, 1, 1]
+
+def test_no_entries():
+    assert writeGroups([]) == []
+
+def test_parse_row_rejects_non_objects():
+    for row in (["participant@example.com"], "participant@example.com", None):
+        with pytest.raises(ValueError):
+            parseRow(row)
+
+def test_roster_rows_are_reported_individually(fb):
+    auth.create_user(email="existing@example.com", password="password1")
+    duplicate, existing = sampleRoster(2)
+    duplicate["email"] = "PARTICIPANT0@example.com"
+    existing["email"] = "existing@example.com"
+    rows = [["not", "an", "object"], None, *sampleRoster(2), duplicate, existing, {"email": "no-password@example.com"}]
+    report = onBoardCohort(rows, loadTemplate())
+    assert [(row["row"], row["status"]) for row in report] == [
+        (1, "failed"), (2, "failed"), (3, "onboarded"), (4, "onboarded"), (5, "failed"), (6, "skipped"), (7, "failed")]
+    assert report[4]["message"] == "Duplicate email in roster"
+    uid = auth.get_user_by_email("participant1@example.com").uid
+    assert report[3]["uid"] == uid
+    assert calendarRef(firestore.client(), uid).get().exists
+
+def test_failed_commit_removes_the_accounts(fb, monkeypatch):
+    def commit(self, *args, **kwargs):
+        raise ConnectionError("unavailable")
+    monkeypatch.setattr(fakefirebase.WriteBatch, "commit", commit)
+    report = onBoardCohort(sampleRoster(2), loadTemplate())
+    assert {(row["status"], row["uid"]) for row in report} == {("failed", "")}
+    with pytest.raises(auth.UserNotFoundError):
+        auth.get_user_by_email("participant0@example.com")
+
+def test_failed_cleanup_keeps_the_uids(fb, monkeypatch):
+    def commit(self, *args, **kwargs):
+        raise ConnectionError("unavailable")
+    def deleteUsers(uids):
+        raise ConnectionError("auth unavailable")
+    monkeypatch.setattr(fakefirebase.WriteBatch, "commit", commit)
+    monkeypatch.setattr(cohort, "deleteUsers", deleteUsers)
+    report = onBoardCohort(sampleRoster(1), loadTemplate())
+    assert report[0]["message"].startswith("Account created, documents not written, cleanup failed")
+    assert report[0]["uid"] == auth.get_user_by_email("participant0@example.com").uid
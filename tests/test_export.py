@@ -0,0 +1,82 @@
+import csv
+import os
+import zipfile
+import pytest
+from backend import auth, firestore
+from export import COLUMNS, exportParticipants, prepareArchive, readParticipants
+from tests.samples import sampleCalendar
+
+@pytest.fixture
+def db(fb):
+    db = firestore.client()
+    for i in range(3):
+        user = auth.create_user(uid=f"participant{i}", email=f"participant{i}@example.com", password="password1")
+        db.collection(user.uid).document("Calendar").set(sampleCalendar(1))
+        db.collection(user.uid).document("Questionnaires").set(
+            {"Weekly": {"Record": {"2025-01-06T20:00:00": {"severity": i}}}})
+        db.collection(user.uid).document("Location").set({"2025-01-06T08:00:00": {"lat": i, "lng": -i}})
+    return db
+
+def readRows(result: dict, name: str) -> list:
+    with open(os.path.join(result["run"], f"{name}.csv"), newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+def test_export_writes_every_dataset(db, tmp_path):
+    result = exportParticipants(str(tmp_path))
+    assert result["participants"] == 3
+    assert sorted(os.listdir(result["run"])) == sorted(f"{name}.csv" for name in COLUMNS)
+    assert readRows(result, "questionnaires")[0] == {"uid": "participant0", "questionnaire": "Weekly",
+                                                     "record": "2025-01-06T20:00:00", "field": "severity", "value": "0"}
+    assert [row["value"] for row in readRows(result, "location") if row["field"] == "lat"] == ["0", "1", "2"]
+    assert result["rows"]["calendar"] == 3 * sum(len(tasks) for tasks in sampleCalendar(1).values())
+
+def test_only_selected_documents_are_read(db, fb):
+    fb.stats.reset()
+    documents = readParticipants(db, ["participant0", "participant1"], ("Location",))
+    assert documents == {f"participant{i}": {"Location": {"2025-01-06T08:00:00": {"lat": i, "lng": -i}}}
+                         for i in range(2)}
+    stats = fb.stats.snapshot()
+    # No responses query without the questionnaires dataset
+    assert stats["reads"] == 2 and "firestore.run_query" not in stats["calls"]
+
+def test_dataset_selection(db, fb, tmp_path):
+    fb.stats.reset()
+    result = exportParticipants(str(tmp_path), datasets=["location"])
+    assert os.listdir(result["run"]) == ["location.csv"]
+    assert result["rows"] == {"location": 6}
+    assert "firestore.run_query" not in fb.stats.snapshot()["calls"]
+
+def test_incremental_exports_changed_participants(db, tmp_path):
+    first = exportParticipants(str(tmp_path), incremental=True)
+    assert (first["participants"], first["unchanged"]) == (3, 0)
+    second = exportParticipants(str(tmp_path), incremental=True)
+    assert (second["participants"], second["unchanged"]) == (0, 3)
+
+    db.collection("participant1").document("Location").update({"2025-01-07T08:00:00": {"lat": 5, "lng": 5}})
+    third = exportParticipants(str(tmp_path), incremental=True)
+    assert (third["participants"], third["unchanged"]) == (1, 2)
+    assert {row["uid"] for row in readRows(third, "location")} == {"participant1"}
+
+def test_incremental_ignores_unselected_documents(db, tmp_path):
+    exportParticipants(str(tmp_path), datasets=["calendar"], incremental=True)
+    db.collection("participant1").document("Location").update({"2025-01-07T08:00:00": {"lat": 5, "lng": 5}})
+    result = exportParticipants(str(tmp_path), datasets=["calendar"], incremental=True)
+    assert (result["participants"], result["unchanged"]) == (0, 3)
+
+def test_incremental_starts_over_with_other_datasets(db, tmp_path):
+    exportParticipants(str(tmp_path), datasets=["calendar"], incremental=True)
+    result = exportParticipants(str(tmp_path), datasets=["calendar", "location"], incremental=True)
+    assert (result["participants"], result["unchanged"]) == (3, 0)
+    assert result["rows"]["location"] == 6
+
+def test_archive_is_prepared_for_the_session(db):
+    prepared = {}
+    message = prepareArchive(prepared, "csv", ["calendar", "location"])
+    assert message.startswith("3 participants")
+    with zipfile.ZipFile(prepared["archive"]) as archive:
+        assert sorted(archive.namelist()) == ["calendar.csv", "location.csv"]
+    os.remove(prepared["archive"])
+
+    replaced = {"discarded": True}
+    prepareArchive(replaced, "csv", ["location"])
+    assert not os.path.exists(replaced["archive"])
@@ -0,0 +1,97 @@
+import pytest
+import livestate
+from backend import firestore
+from layout import SCHEMA_V1, SCHEMA_V2, calendarRef, queueParticipantWrites
+from livestate import LiveState, WATCHED_DOCUMENTS
+from tests.samples import sampleCalendar
+
+def onboard(db, uid: str, schema: int = SCHEMA_V1) -> dict:
+    documents = {"Basic Info": {"Gender": "Female"}, "Calendar": sampleCalendar(1),
+                 "Questionnaires": {"Weekly": {"link": "https://example.com/questionnaire"}},
+                 "Location": {"lat": 0, "lng": 0}}
+    batch = db.batch()
+    queueParticipantWrites(db, batch, uid, documents, schema)
+    batch.commit()
+    return documents
+
+@pytest.fixture
+def db(fb):
+    return firestore.client()
+
+def test_documents_are_read_from_listeners(db):
+    documents = onboard(db, "participant")
+    live = LiveState()
+    state = live.watch(["participant"], timeout=0)["participant"]
+    assert state.ready.is_set()
+    assert set(state.documents) == set(WATCHED_DOCUMENTS)
+    assert live.documents("participant")["Calendar"] == documents["Calendar"]
+    assert live.stats() == {"participants": 1, "listeners": len(WATCHED_DOCUMENTS)}
+
+    db.collection("participant").document("Basic Info").update({"Gender": "Male"})
+    assert live.documents("participant")["Basic Info"] == {"Gender": "Male"}
+
+def test_unwatched_documents_are_not_delivered(db):
+    onboard(db, "participant")
+    live = LiveState()
+    live.watch(["participant"], timeout=0)
+    before = live.version(["participant"])
+    for i in range(5):
+        db.collection("participant").document("Location").set({"lat": i, "lng": i})
+    db.collection("participant").document("Notifications").set({"unread": 1})
+    assert live.version(["participant"]) == before
+    assert "Location" not in live.documents("participant")
+
+def test_missing_documents_still_become_ready(db):
+    db.collection("participant").document("Basic Info").set({"Gender": "Female"})
+    state = LiveState().watch(["participant"], timeout=0)["participant"]
+    assert state.ready.is_set()
+    assert state.documents == {"Basic Info": {"Gender": "Female"}}
+
+    db.collection("participant").document("Basic Info").delete()
+    assert state.documents == {}
+
+def test_sharded_calendar_is_merged(db):
+    documents = onboard(db, "participant", SCHEMA_V2)
+    live = LiveState()
+    state = live.watch(["participant"], timeout=0)["participant"]
+    assert state.ready.is_set() and state.monthsWatched
+    assert live.calendars(["participant"])["participant"] == documents["Calendar"]
+    assert live.stats()["listeners"] == len(WATCHED_DOCUMENTS) + 1
+
+def test_closed_stream_is_replaced(db):
+    onboard(db, "participant")
+    live = LiveState()
+    state = live.watch(["participant"], timeout=0)["participant"]
+    state.watches[1].close()
+    assert live.staleness(["participant"]).keys() == {"participant"}
+
+    replaced = live.watch(["participant"], timeout=0)["participant"]
+    assert replaced is not state and replaced.version > state.version
+    assert not any(watch.is_active for watch in state.watches)
+    assert live.staleness(["participant"]) == {}
+    db.collection("participant").document("Basic Info").update({"Gender": "Male"})
+    assert live.documents("participant")["Basic Info"] == {"Gender": "Male"}
+
+def test_failed_callback_marks_the_state_closed(db, monkeypatch):
+    onboard(db, "participant")
+    live = LiveState()
+    state = live.watch(["participant"], timeout=0)["participant"]
+
+    def fail(*args):
+        raise RuntimeError("decode failed")
+    monkeypatch.setattr(live, "_onDocument", fail)
+    db.collection("participant").document("Calendar").update({"Schema": SCHEMA_V1})
+    assert state.error == "RuntimeError: decode failed"
+    assert state.closed()
+    assert "participant" in live.staleness(["participant"])
+
+def test_idle_participants_are_released(db):
+    onboard(db, "idle")
+    onboard(db, "active")
+    live = LiveState()
+    idle = live.watch(["idle"], timeout=0)["idle"]
+    idle.lastRead -= livestate.IDLE_TIMEOUT + 1
+    live.watch(["active"], timeout=0)
+    assert live.stats() == {"participants": 1, "listeners": len(WATCHED_DOCUMENTS)}
+    assert not any(watch.is_active for watch in idle.watches)
+    assert calendarRef(db, "idle").get().exists
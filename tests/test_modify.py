@@ -0,0 +1,51 @@
+from datetime import date
+from backend import firestore
+from layout import calendarRef, readCalendar
+from modify import extensionDiff, mergeDay, planCalendarChanges, removalDiff, summarizePlan
+from studycalendar import generateCalendarRange
+
+def sampleCalendar() -> dict:
+    return dict(generateCalendarRange(date(2025, 1, 6), date(2025, 1, 12)))
+
+def test_merge_day_adds_missing_tasks():
+    assert mergeDay(None, {"Hailie": {"Completed": False}}) == {"Hailie": {"Completed": False}}
+    assert mergeDay({"Hailie": {"Completed": False}},
+                    {"Hailie": {"Completed": False}, "Questionnaire": {"Completed": False, "Link": "q"}}) \
+        == {"Questionnaire": {"Completed": False, "Link": "q"}}
+
+def test_merge_day_leaves_completed_tasks():
+    existing = {"Questionnaire": {"Completed": True, "Link": "old"}}
+    assert mergeDay(existing, {"Questionnaire": {"Completed": False, "Link": "new"}}) == {}
+
+def test_merge_day_updates_uncompleted_tasks():
+    existing = {"Questionnaire": {"Completed": False, "Link": "old", "Note": "kept"}}
+    assert mergeDay(existing, {"Questionnaire": {"Completed": False, "Link": "new"}}) \
+        == {"Questionnaire": {"Completed": False, "Link": "new", "Note": "kept"}}
+
+def test_removal_diff_only_deletes_existing_days():
+    fields = removalDiff(sampleCalendar(), date(2025, 1, 11), date(2025, 1, 14))
+    assert fields == {"2025-01-11": firestore.DELETE_FIELD, "2025-01-12": firestore.DELETE_FIELD}
+
+def test_extension_diff_emits_task_paths():
+    current = sampleCalendar()
+    current["2025-01-12"]["Hailie"]["Completed"] = True
+    del current["2025-01-12"]["CheckIn"]
+    fields = extensionDiff(current, date(2025, 1, 12), date(2025, 1, 13), 6, "https://example.com/q")
+    assert fields == {"2025-01-12.CheckIn": {"Completed": False},
+                      "2025-01-13.Hailie": {"Completed": False},
+                      "2025-01-13.Cough Monitor": {"Completed": False},
+                      "2025-01-13.CheckIn": {"Completed": False}}
+
+def test_extension_keeps_completions_made_after_planning(fb):
+    db = firestore.client()
+    calendarRef(db, "uid").set(sampleCalendar())
+    # Mondays from 2024-12-30, the second of them (2025-01-06) already has a day
+    plan = planCalendarChanges(db, "uid", extend=(date(2024, 12, 30), date(2025, 1, 14), 0, "q"))
+    assert summarizePlan(plan) == {"removed": 0, "added": 9, "updated": 1}
+
+    calendarRef(db, "uid").update({"2025-01-06.Hailie": {"Completed": True}})
+    calendarRef(db, "uid").update(plan["fields"])
+    calendar = readCalendar(db, "uid")
+    assert calendar["2025-01-06"]["Hailie"] == {"Completed": True}
+    assert calendar["2025-01-06"]["Questionnaire"] == {"Completed": False, "Link": "q"}
+    assert len(calendar) == 16
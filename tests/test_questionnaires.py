@@ -0,0 +1,87 @@
+from datetime import date, datetime, timezone
+import pytest
+import fakefirebase
+import questionnaires
+from backend import firestore
+from questionnaires import (RESPONSES_COLLECTION, migrateRecords, participantSummary, queryResponses,
+                            recordResponse, responseId)
+
+LEGACY = {
+    "Asthma Attack": {"Record": {"1736150400000": {"severity": "3"},
+                                 "2025-01-07T20:00:00": {"severity": 5, "note": "night"}}},
+    "Weekly": {"Record": {"1736236800000": "fine"}, "Link": "https://example.com/questionnaire"},
+}
+
+@pytest.fixture
+def db(fb):
+    db = firestore.client()
+    db.collection("participant").document("Questionnaires").set(LEGACY)
+    return db
+
+def responses(db) -> dict:
+    return {snapshot.id: snapshot.to_dict() for snapshot in db.collection(RESPONSES_COLLECTION).stream()}
+
+def test_migration_moves_records_into_responses(db):
+    assert migrateRecords(db, "participant") == "migrated 3 records"
+    stored = responses(db)
+    first = stored[responseId("participant", "Asthma Attack", datetime(2025, 1, 6, 8, tzinfo=timezone.utc))]
+    assert (first["day"], first["severity"], first["answers"]) == ("2025-01-06", 3, {"severity": "3"})
+    # Local record keys are New Zealand times
+    second = stored[responseId("participant", "Asthma Attack", datetime(2025, 1, 7, 7, tzinfo=timezone.utc))]
+    assert (second["day"], second["severity"]) == ("2025-01-07", 5)
+    assert [r["answers"] for r in stored.values() if r["questionnaire"] == "Weekly"] == [{"value": "fine"}]
+
+    document = db.collection("participant").document("Questionnaires").get().to_dict()
+    assert document["Asthma Attack"]["Record"] == {} and document["Weekly"]["Record"] == {}
+    assert document["Weekly"]["Link"] == "https://example.com/questionnaire"
+    summary = participantSummary(db, "participant")
+    assert summary["Asthma Attack"]["Count"] == 2 and summary["Asthma Attack"]["SeveritySum"] == 8
+    assert summary["Weekly"]["Count"] == 1 and "Severity" not in summary["Weekly"]
+
+def test_migration_is_rerunnable(db):
+    migrateRecords(db, "participant")
+    assert migrateRecords(db, "participant") == "no records"
+    assert participantSummary(db, "participant")["Asthma Attack"]["Count"] == 2
+
+def test_interrupted_migration_resumes_without_double_counting(db, monkeypatch):
+    # One record per batch, and the second batch fails
+    monkeypatch.setattr(questionnaires, "MAX_WRITES_PER_BATCH", 4)
+    commit = fakefirebase.WriteBatch.commit
+    commits = []
+
+    def failSecond(batch, *args, **kwargs):
+        commits.append(batch)
+        if len(commits) == 2:
+            raise ConnectionError("deadline exceeded")
+        return commit(batch, *args, **kwargs)
+    monkeypatch.setattr(fakefirebase.WriteBatch, "commit", failSecond)
+    with pytest.raises(ConnectionError):
+        migrateRecords(db, "participant")
+    assert len(responses(db)) == 1
+
+    monkeypatch.setattr(fakefirebase.WriteBatch, "commit", commit)
+    assert migrateRecords(db, "participant") == "migrated 2 records"
+    assert len(responses(db)) == 3
+    summary = participantSummary(db, "participant")
+    assert summary["Asthma Attack"]["Count"] + summary["Weekly"]["Count"] == 3
+
+def test_dry_run_migrates_nothing(db):
+    assert migrateRecords(db, "participant", dry_run=True) == "would migrate 3 records"
+    assert responses(db) == {}
+    assert db.collection("participant").document("Questionnaires").get().to_dict() == LEGACY
+
+def test_duplicate_response_is_not_counted_twice(db):
+    submitted = datetime(2025, 2, 1, 7, tzinfo=timezone.utc)
+    recordResponse(db, "participant", "Asthma Attack", {"severity": 2}, submitted)
+    with pytest.raises(fakefirebase.AlreadyExists):
+        recordResponse(db, "participant", "Asthma Attack", {"severity": 2}, submitted)
+    summary = participantSummary(db, "participant")["Asthma Attack"]
+    assert summary["Count"] == 1 and summary["Months"] == {"2025-02": 1}
+
+def test_query_filters_responses(db):
+    migrateRecords(db, "participant")
+    recordResponse(db, "other", "Asthma Attack", {"severity": 9}, datetime(2025, 1, 7, 1, tzinfo=timezone.utc))
+    days = lambda **filters: [(s.get("uid"), s.get("day")) for s in queryResponses(db, **filters)]
+    assert days(questionnaire="Asthma Attack", minSeverity=4) == [("other", "2025-01-07"), ("participant", "2025-01-07")]
+    assert days(uid="participant", startDate=date(2025, 1, 7), endDate=date(2025, 1, 7)) == \
+        [("participant", "2025-01-07"), ("participant", "2025-01-07")]
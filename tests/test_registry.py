@@ -0,0 +1,74 @@
+from datetime import date
+import pytest
+import registry
+from backend import auth, firestore
+from registry import (ACTIVE, COMPLETED, UPCOMING, queryParticipants, refreshEntries, registryEmails,
+                      registryEntry, registryRef, studyStatus)
+
+TODAY = date(2025, 3, 1)
+
+def calendar(start: str, end: str) -> dict:
+    return {start: {"Questionnaire": {"Completed": False}}, end: {"CheckIn": {"Completed": False}}}
+
+@pytest.fixture
+def db(fb):
+    db = firestore.client()
+    studies = {"upcoming": ("2025-03-02", "2025-05-30"), "starting": ("2025-03-01", "2025-05-29"),
+               "active": ("2025-01-06", "2025-04-06"), "ending": ("2025-01-01", "2025-03-01"),
+               "completed": ("2024-10-01", "2025-02-28")}
+    for i, (name, (start, end)) in enumerate(studies.items()):
+        entry = registryEntry(name, f"{name}@example.com", {"Gender": "Female" if i % 2 else "Male"},
+                              calendar(start, end))
+        registryRef(db, name).set(entry)
+    return db
+
+def test_status_is_not_stored():
+    entry = registryEntry("uid", "Participant@Example.com", {"Gender": "Male"}, calendar("2025-01-06", "2025-04-06"))
+    assert "status" not in entry
+    assert entry["email"] == "participant@example.com"
+    assert (entry["start"], entry["end"], entry["days"], entry["questionnaireDay"]) == \
+        ("2025-01-06", "2025-04-06", 2, "Monday")
+
+def test_status_filters_follow_the_date(db):
+    emails = lambda status, today: registryEmails(db, status=status, today=today)
+    assert emails(UPCOMING, TODAY) == ["upcoming@example.com"]
+    assert emails(ACTIVE, TODAY) == ["active@example.com", "ending@example.com", "starting@example.com"]
+    assert emails(COMPLETED, TODAY) == ["completed@example.com"]
+    # Nothing is rewritten, the same entries move between statuses as the days pass
+    assert emails(ACTIVE, date(2025, 3, 2)) == ["active@example.com", "starting@example.com", "upcoming@example.com"]
+    assert emails(COMPLETED, date(2025, 3, 2)) == ["completed@example.com", "ending@example.com"]
+
+def test_status_filters_agree_with_study_status(db):
+    for today in (date(2024, 9, 1), TODAY, date(2025, 4, 7), date(2025, 6, 1)):
+        for status in (UPCOMING, ACTIVE, COMPLETED):
+            selected = list(queryParticipants(db, status=status, today=today))
+            assert all(studyStatus(s.get("start"), s.get("end"), today) == status for s in selected)
+        total = sum(len(list(queryParticipants(db, status=s, today=today))) for s in (UPCOMING, ACTIVE, COMPLETED))
+        assert total == 5
+
+def test_filters_combine(db):
+    assert registryEmails(db, gender="Male", status=ACTIVE, today=TODAY) == ["active@example.com"]
+    assert registryEmails(db, status=ACTIVE, startFrom=date(2025, 1, 6), today=TODAY) == \
+        ["active@example.com", "starting@example.com"]
+    assert registryEmails(db, questionnaireDay="Monday") == ["active@example.com"]
+
+def test_unknown_status(db):
+    with pytest.raises(ValueError):
+        registryEmails(db, status="paused")
+
+def test_query_pages_in_start_order(db, monkeypatch):
+    monkeypatch.setattr(registry, "PAGE_SIZE", 2)
+    assert [s.id for s in queryParticipants(db)] == ["completed", "ending", "active", "starting", "upcoming"]
+
+def test_refresh_skips_accounts_without_documents(fb):
+    db = firestore.client()
+    participant = auth.create_user(email="participant@example.com", password="password1")
+    staff = auth.create_user(email="staff@example.com", password="password1")
+    db.collection(participant.uid).document("Basic Info").set({"Gender": "Female"})
+    db.collection(participant.uid).document("Calendar").set(calendar("2025-01-06", "2025-04-06"))
+
+    entries = refreshEntries(db, [participant.uid, staff.uid])
+    assert [entry["uid"] for entry in entries] == [participant.uid]
+    assert entries[0]["email"] == "participant@example.com"
+    assert registryRef(db, participant.uid).get().exists
+    assert not registryRef(db, staff.uid).get().exists
@@ -0,0 +1,24 @@
+from datetime import date, time, timedelta, timezone
+from schedule import fireTime, localizeTime, wallTime
+
+def test_spring_forward_gap_fires_after_the_clocks_move():
+    # New Zealand daylight saving started at 02:00 on 2025-09-28
+    fired = fireTime(date(2025, 9, 28), time(2, 30))
+    assert fired.time() == time(3, 30)
+    assert fired.utcoffset() == timedelta(hours=13)
+
+def test_fall_back_fires_on_first_occurrence():
+    # and ended at 03:00 on 2025-04-06, repeating 02:00-03:00
+    fired = fireTime(date(2025, 4, 6), time(2, 30))
+    assert fired.time() == time(2, 30)
+    assert fired.utcoffset() == timedelta(hours=13)
+
+def test_offset_follows_the_date():
+    assert fireTime(date(2025, 1, 15), time(8)).utcoffset() == timedelta(hours=13)
+    assert fireTime(date(2025, 7, 15), time(8)).utcoffset() == timedelta(hours=12)
+
+def test_wall_time_of_stored_timestamp():
+    # Firestore hands timestamps back in UTC
+    stored = localizeTime(time(20, 0)).astimezone(timezone.utc)
+    assert wallTime(stored) == time(20, 0)
+    assert wallTime(None) is None
@@ -0,0 +1,73 @@
+from datetime import date, time
+import pytest
+import fakefirebase
+import server
+from backend import auth, firestore
+from layout import calendarRef
+from templates import loadTemplate
+from writequeue import COMPENSATED, DONE, FAILED, PENDING, RUNNING
+
+EMAIL = "participant@example.com"
+
+def onboard(email: str = EMAIL) -> str:
+    userInfo = {"Gender": "Female", "start_date": date(2025, 1, 6), "time_frame": 14,
+                "CheckInTaskTime": time(8), "HailieTaskTime": time(8), "Cough MonitorTaskTime": time(22)}
+    questionnaireInfo = {"time": time(20), "frequency": 7, "link": "https://example.com/q"}
+    return server.onBoardParticipant(email, "password1", userInfo, questionnaireInfo, loadTemplate())
+
+def otherParticipant() -> str:
+    """An account and Calendar onboarded by someone else under the same email"""
+    uid = auth.create_user(email=EMAIL, password="password2").uid
+    calendarRef(firestore.client(), uid).set({"2024-01-01": {"Hailie": {"Completed": True}}})
+    return uid
+
+def test_onboarding_writes_documents(fb, queue):
+    assert onboard() == ""
+    uid = auth.get_user_by_email(EMAIL).uid
+    assert len(calendarRef(firestore.client(), uid).get().to_dict()) == 14
+
+def test_concurrent_onboarding_of_the_same_email_is_left_alone(fb, queue, monkeypatch):
+    def createUser(**kwargs):
+        other.append(otherParticipant())
+        raise auth.EmailAlreadyExistsError("The user with the provided email already exists")
+    other = []
+    monkeypatch.setattr(server, "createUser", createUser)
+    assert onboard() == "User already exists"
+    assert auth.get_user(other[0]).email == EMAIL
+    assert calendarRef(firestore.client(), other[0]).get().to_dict() == {"2024-01-01": {"Hailie": {"Completed": True}}}
+    assert queue.list((PENDING, RUNNING, DONE, FAILED, COMPENSATED)) == []
+
+def test_transport_error_after_creation_is_recovered(fb, queue, monkeypatch):
+    created = server.createUser
+    def createUser(**kwargs):
+        created(**kwargs)
+        raise ConnectionError("connection reset")
+    monkeypatch.setattr(server, "createUser", createUser)
+    assert onboard() == ""
+    uid = auth.get_user_by_email(EMAIL).uid
+    assert calendarRef(firestore.client(), uid).get().exists
+    assert [op.state for op in queue.list((DONE,))] == [{"uid": uid, "created": True}]
+
+def test_recovery_never_touches_another_onboardings_account(fb, queue, monkeypatch):
+    def createUser(**kwargs):
+        other.append(otherParticipant())
+        raise ConnectionError("connection reset")
+    other = []
+    monkeypatch.setattr(server, "createUser", createUser)
+    assert onboard().startswith("Account creation failed")
+    assert [op.status for op in queue.list((DONE, COMPENSATED))] == [COMPENSATED]
+    assert auth.get_user(other[0]).email == EMAIL
+    assert calendarRef(firestore.client(), other[0]).get().to_dict() == {"2024-01-01": {"Hailie": {"Completed": True}}}
+
+def test_failed_write_removes_only_the_created_account(fb, queue, monkeypatch):
+    def commit(self, *args, **kwargs):
+        raise ValueError("document too large")
+    monkeypatch.setattr(fakefirebase.WriteBatch, "commit", commit)
+    assert onboard().startswith("Onboarding failed, the account was removed")
+    with pytest.raises(auth.UserNotFoundError):
+        auth.get_user_by_email(EMAIL)
+
+def test_compensation_skips_accounts_it_did_not_create(fb):
+    uid = otherParticipant()
+    server.removeParticipantAccount({"email": EMAIL}, {"uid": uid})
+    assert auth.get_user(uid).email == EMAIL
@@ -0,0 +1,29 @@
+from datetime import date
+from studycalendar import DEFAULT_TASKS, generateCalendarDays, generateCalendarRange, intervalCadence, weekdayCadence
+
+def questionnaireDays(calendar: dict) -> list:
+    return [day for day, tasks in calendar.items() if "Questionnaire" in tasks]
+
+def test_interval_cadence_starts_on_first_day():
+    calendar = dict(generateCalendarDays(date(2025, 1, 6), 30, cadence=intervalCadence(14)))
+    assert questionnaireDays(calendar) == ["2025-01-06", "2025-01-20", "2025-02-03"]
+
+def test_weekday_cadence_skips_first_occurrence():
+    # 2025-01-06 is a Monday, extensions ask every second Monday starting with the second
+    calendar = dict(generateCalendarRange(date(2025, 1, 6), date(2025, 2, 9), cadence=weekdayCadence(0)))
+    assert questionnaireDays(calendar) == ["2025-01-13", "2025-01-27"]
+
+def test_weekday_cadence_from_midweek_start():
+    calendar = dict(generateCalendarRange(date(2025, 1, 8), date(2025, 2, 9), cadence=weekdayCadence(0, every=1)))
+    assert questionnaireDays(calendar) == ["2025-01-13", "2025-01-20", "2025-01-27", "2025-02-03"]
+
+def test_days_are_fresh_maps():
+    calendar = dict(generateCalendarDays(date(2025, 1, 6), 2, questionnaireLink="https://example.com/q",
+                                         cadence=intervalCadence(1)))
+    assert set(calendar["2025-01-06"]) == set(DEFAULT_TASKS) | {"Questionnaire"}
+    assert calendar["2025-01-06"]["Questionnaire"]["Link"] == "https://example.com/q"
+    calendar["2025-01-06"]["Hailie"]["Completed"] = True
+    assert calendar["2025-01-07"]["Hailie"]["Completed"] is False
+
+def test_range_is_inclusive():
+    assert len(list(generateCalendarRange(date(2025, 1, 30), date(2025, 2, 2)))) == 4
@@ -0,0 +1,55 @@
+import json
+import os
+import pytest
+import tracing
+from tracing import TRACE_FILE_ENV, flush, recentSpans, span
+
+@pytest.fixture
+def traceFile(tmp_path, monkeypatch):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setenv(TRACE_FILE_ENV, str(path))
+    # Only explicit flushes write in these tests
+    monkeypatch.setattr(tracing, "FLUSH_INTERVAL", 3600)
+    flush()
+    yield path
+    monkeypatch.setenv(TRACE_FILE_ENV, "")
+    flush()
+
+def readSpans(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_default_trace_file_is_next_to_the_module():
+    assert tracing.DEFAULT_TRACE_FILE == os.path.join(os.path.dirname(os.path.abspath(tracing.__file__)),
+                                                      "traces.jsonl")
+
+def test_spans_are_buffered_until_flushed(traceFile):
+    with span("request", page="dashboard"):
+        with span("job"):
+            pass
+    assert [record["name"] for record in recentSpans()[-2:]] == ["job", "request"]
+    assert not traceFile.exists() or readSpans(traceFile) == []
+
+    flush()
+    job, request = readSpans(traceFile)
+    assert job["parent_id"] == request["span_id"] and job["trace_id"] == request["trace_id"]
+    assert request["attributes"]["page"] == "dashboard"
+
+def test_full_trace_file_is_rotated(traceFile, monkeypatch):
+    monkeypatch.setattr(tracing, "MAX_TRACE_BYTES", 1)
+    with span("first"):
+        pass
+    flush()
+    with span("second"):
+        pass
+    flush()
+    assert [record["name"] for record in readSpans(str(traceFile) + ".1")] == ["second"]
+    assert not traceFile.exists()
+
+def test_spans_stay_in_memory_without_a_trace_file(tmp_path, monkeypatch):
+    monkeypatch.setenv(TRACE_FILE_ENV, "")
+    with span("request"):
+        pass
+    flush()
+    assert recentSpans()[-1]["name"] == "request"
+    assert tracing._pending == []
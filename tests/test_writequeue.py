@@ -0,0 +1,104 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from backend import firestore
+from writequeue import (COMPENSATED, DONE, FAILED, PENDING, RUNNING, WriteQueue, decode, decodeWrites, encode,
+                        encodeWrites, register)
+
+def test_round_trip_through_json(fb):
+    value = {"2025-01-06": firestore.DELETE_FIELD,
+             "at": datetime(2025, 1, 6, 8, tzinfo=timezone.utc),
+             "Days": b"\x01\xff",
+             "nested": {"list": [1, "two", {"Completed": False}]}}
+    assert decode(json.loads(json.dumps(encode(value)))) == value
+
+def test_tuples_become_lists():
+    assert decode(encode((1, 2))) == [1, 2]
+
+def test_writes_keep_their_documents(fb):
+    db = firestore.client()
+    writes = [(db.collection("uid").document("Calendar"), {"2025-01-06.Hailie": {"Completed": False}}, False)]
+    decoded = decodeWrites(db, json.loads(json.dumps(encodeWrites(writes))))
+    assert [(ref.path, fields, merge) for ref, fields, merge in decoded] \
+        == [(ref.path, fields, merge) for ref, fields, merge in writes]
+
+calls = []
+
+def flaky(payload: dict, state: dict):
+    calls.append(payload)
+    state["attempted"] = state.get("attempted", 0) + 1
+    if payload.get("error"):
+        raise {"transient": ConnectionError, "permanent": ValueError}[payload["error"]](payload["error"])
+
+def undo(payload: dict, state: dict):
+    if payload.get("compensation") == "fails":
+        raise ConnectionError("still down")
+    state["compensated"] = True
+
+register("test", flaky, undo)
+
+def test_submit_runs_the_op_once(queue):
+    calls.clear()
+    op = queue.submit("test", {"n": 1})
+    assert (op.status, op.attempts, op.state) == (DONE, 1, {"attempted": 1})
+    assert calls == [{"n": 1}]
+
+def test_submitted_op_is_not_due_while_it_runs(queue):
+    def check(payload, state):
+        assert queue.due(everything=True) == []
+    register("check", check)
+    assert queue.submit("check", {}).status == DONE
+
+def test_keyed_submit_reuses_the_op(queue):
+    calls.clear()
+    first = queue.submit("test", {"n": 1}, key="same")
+    second = queue.submit("test", {"n": 2}, key="same")
+    assert first.id == second.id == "same"
+    assert second.status == DONE
+    assert calls == [{"n": 1}]
+
+def test_transient_failure_is_retried_later(queue):
+    op = queue.submit("test", {"error": "transient"})
+    assert (op.status, op.attempts, op.last_error) == (PENDING, 1, "transient")
+    assert op.next_attempt > time.time()
+    assert queue.due() == []
+    assert queue.due(everything=True) == [op.id]
+
+def test_permanent_failure_is_compensated(queue):
+    op = queue.submit("test", {"error": "permanent"})
+    assert op.status == COMPENSATED
+    assert op.state == {"attempted": 1, "compensated": True}
+
+def test_failed_compensation_leaves_the_op_failed(queue):
+    op = queue.submit("test", {"error": "permanent", "compensation": "fails"})
+    assert op.status == FAILED
+    assert op.last_error == "permanent; compensation failed: still down"
+
+def test_running_op_is_only_reclaimed_once_its_lease_expires(queue):
+    opId = queue.enqueue("test", {}, claimed=True)
+    other = WriteQueue(queue.path)
+    assert other.due(everything=True) == []
+    assert other.execute(opId).status == RUNNING
+
+    with closing(sqlite3.connect(queue.path)) as conn, conn:
+        conn.execute("UPDATE ops SET claimed_until = ? WHERE id = ?", (time.time() - 1, opId))
+    assert other.due(everything=True) == [opId]
+    assert other.execute(opId).status == DONE
+
+def test_renewed_lease_is_kept(queue):
+    opId = queue.enqueue("test", {}, claimed=True)
+    with closing(sqlite3.connect(queue.path)) as conn, conn:
+        conn.execute("UPDATE ops SET claimed_until = ? WHERE id = ?", (time.time() - 1, opId))
+    queue.renewLeases()
+    assert WriteQueue(queue.path).due(everything=True) == []
+
+def test_finished_ops_drop_their_payload_and_are_pruned(queue):
+    done = queue.submit("test", {"email": "participant@example.com"})
+    compensated = queue.submit("test", {"error": "permanent"})
+    failed = queue.submit("test", {"error": "permanent", "compensation": "fails"})
+    assert queue.get(done.id).payload == {}
+    assert queue.prune() == 0
+    assert queue.prune(retention=-1) == 2
+    assert [op.id for op in queue.list((DONE, COMPENSATED, FAILED))] == [failed.id]
@@ -0,0 +1,338 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Every auth and Firestore call made through backend.py becomes a span: a JSON line in
+# DIGIPREDICT_TRACE_FILE (empty to keep spans in memory only) and an entry in the recent
+# buffer the Performance page reads. Set DIGIPREDICT_TRACE=0 to disable the wrapping.
+# Calls only buffer their span; a background thread serializes and appends them to the
+# file every FLUSH_INTERVAL seconds, or sooner once FLUSH_BATCH are waiting. A trace file
+# that grows past MAX_TRACE_BYTES is moved to <file>.1, replacing the previous one, so at
+# most twice that is kept on disk.
+TRACE_ENV = "DIGIPREDICT_TRACE"
+TRACE_FILE_ENV = "DIGIPREDICT_TRACE_FILE"
+DEFAULT_TRACE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces.jsonl")
+MAX_TRACE_BYTES = 64 * 1024 * 1024
+RECENT_SPANS = 5000
+FLUSH_INTERVAL = 1
+FLUSH_BATCH = 1000
+
+# Methods that reach the server, everything else only builds references and queries
+NETWORK_CALLS = {"get", "set", "create", "update", "delete", "commit", "get_all", "stream",
+                 "list_documents", "collections", "add"}
+BATCH_WRITES = {"set", "create", "update", "delete"}
+KINDS = {"Client": "client", "FakeClient": "client", "CollectionReference": "collection",
+         "DocumentReference": "document", "Query": "query", "WriteBatch": "batch"}
+
+_current = contextvars.ContextVar("span", default=None)
+_recent = deque(maxlen=RECENT_SPANS)
+_pending = []
+_lock = threading.Lock()
+_writeLock = threading.Lock()
+_rollUpLock = threading.Lock()
+_wake = threading.Event()
+_writer = None
+_file = None
+
+logger = logging.getLogger(__name__)
+
+def enabled() -> bool:
+    return os.environ.get(TRACE_ENV, "1") != "0"
+
+class Span:
+    """A request, job or single Firebase call, with the calls made beneath it rolled up"""
+    def __init__(self, name: str, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.traceId = parent.traceId if parent else uuid.uuid4().hex
+        self.spanId = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.start = time.time()
+        self.durationMs = 0.0
+        self.status = "ok"
+        self.calls = 0
+        self.reads = 0
+        self.writes = 0
+        self.bytes = 0
+        self.firebaseMs = 0.0
+
+    def rollUp(self, durationMs: float, reads: int, writes: int, size: int):
+        span = self
+        with _rollUpLock:
+            while span is not None:
+                span.calls += 1
+                span.reads += reads
+                span.writes += writes
+                span.bytes += size
+                span.firebaseMs += durationMs
+                span = span.parent
+
+    def summary(self) -> dict:
+        return {"calls": self.calls, "reads": self.reads, "writes": self.writes,
+                "bytes": self.bytes, "firebase_ms": round(self.firebaseMs, 2)}
+
+    def toDict(self) -> dict:
+        return {"trace_id": self.traceId, "span_id": self.spanId,
+                "parent_id": self.parent.spanId if self.parent else None,
+                "name": self.name, "start": self.start, "duration_ms": round(self.durationMs, 3),
+                "status": self.status, "attributes": dict(self.attributes, **self.summary())}
+
+def _emit(record: dict):
+    """Keep a finished span in memory and buffer it for the trace file writer"""
+    global _writer
+    with _lock:
+        _recent.append(record)
+        if not os.environ.get(TRACE_FILE_ENV, DEFAULT_TRACE_FILE):
+            return
+        _pending.append(record)
+        full = len(_pending) >= FLUSH_BATCH
+        if _writer is None:
+            _writer = threading.Thread(target=_writeLoop, name="trace-writer", daemon=True)
+            _writer.start()
+    if full:
+        _wake.set()
+
+def flush():
+    """Append the buffered spans to the trace file"""
+    global _pending, _file
+    with _writeLock:
+        with _lock:
+            records, _pending = _pending, []
+        path = os.environ.get(TRACE_FILE_ENV, DEFAULT_TRACE_FILE)
+        if not records or not path:
+            return
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        if _file is None or _file.name != path:
+            if _file is not None:
+                _file.close()
+            _file = open(path, "a", encoding="utf-8")
+        _file.write(lines)
+        _file.flush()
+        if _file.tell() >= MAX_TRACE_BYTES:
+            _file.close()
+            _file = None
+            _rotate(path)
+
+def _writeLoop():
+    while True:
+        _wake.wait(FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            flush()
+        except OSError as e:
+            # Spans are diagnostics, the ones that could not be written are dropped
+            logger.warning("Could not write spans to the trace file: %s", e)
+
+def _flushAtExit():
+    try:
+        flush()
+    except OSError as e:
+        logger.warning("Could not write spans to the trace file at exit: %s", e)
+
+atexit.register(_flushAtExit)
+
+def _rotate(path: str):
+    """Move a full trace file aside, unless another process sharing it already has"""
+    try:
+        if os.path.getsize(path) >= MAX_TRACE_BYTES:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+
+@contextmanager
+def span(name: str, **attributes):
+    """Group the Firebase calls made inside the block (a submission, a page load) under one span"""
+    current = Span(name, _current.get(), **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.status = f"error: {type(e).__name__}"
+        raise
+    finally:
+        _current.reset(token)
+        current.durationMs = (time.time() - current.start) * 1000
+        _emit(current.toDict())
+
+def currentSpan():
+    return _current.get()
+
+def recentSpans() -> list:
+    with _lock:
+        return list(_recent)
+
+def clearRecent():
+    with _lock:
+        _recent.clear()
+
+def _record(op: str, start: float, reads: int, writes: int, size: int, error=None, **attributes):
+    durationMs = (time.perf_counter() - start) * 1000
+    parent = _current.get()
+    if parent is not None:
+        parent.rollUp(durationMs, reads, writes, size)
+    _emit({"trace_id": parent.traceId if parent else uuid.uuid4().hex, "span_id": uuid.uuid4().hex[:16],
+           "parent_id": parent.spanId if parent else None, "name": op,
+           "start": time.time() - durationMs / 1000, "duration_ms": round(durationMs, 3),
+           "status": f"error: {type(error).__name__}" if error else "ok",
+           "attributes": dict(attributes, reads=reads, writes=writes, bytes=size)})
+
+def _size(data) -> int:
+    return len(json.dumps(data, default=str)) if data is not None else 0
+
+def _snapshotSize(snapshot) -> int:
+    return _size(snapshot.to_dict()) if getattr(snapshot, "exists", False) else 0
+
+def _unwrap(value):
+    if isinstance(value, _Traced):
+        return value._inner
+    if isinstance(value, list):
+        return [_unwrap(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_unwrap(v) for v in value)
+    return value
+
+def _wrappable(value) -> bool:
+    return any(hasattr(value, attr) for attr in ("collection", "commit", "stream"))
+
+class _Traced:
+    """Firestore client, reference, query or batch whose network calls are recorded"""
+    def __init__(self, inner):
+        self._inner = inner
+        self._kind = KINDS.get(type(inner).__name__, type(inner).__name__.lower())
+        self._pending = [0, 0]
+
+    def __getattr__(self, attr):
+        value = getattr(self._inner, attr)
+        if not callable(value):
+            return _Traced(value) if _wrappable(value) else value
+        return lambda *args, **kwargs: self._call(attr, value, args, kwargs)
+
+    def __eq__(self, other):
+        return self._inner == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._inner)
+
+    def __len__(self):
+        return len(self._inner)
+
+    def __repr__(self):
+        return f"<traced {self._inner!r}>"
+
+    def _call(self, attr: str, method, args, kwargs):
+        args, kwargs = _unwrap(args), {k: _unwrap(v) for k, v in kwargs.items()}
+        if self._kind == "batch" and attr in BATCH_WRITES:
+            self._pending[0] += 1
+            self._pending[1] += _size(args[1] if len(args) > 1 else kwargs.get("document_data", kwargs.get("field_updates")))
+            return self._wrap(method(*args, **kwargs))
+        if attr not in NETWORK_CALLS or (self._kind == "batch" and attr != "commit"):
+            return self._wrap(method(*args, **kwargs))
+
+        op = f"firestore.{self._kind}.{attr}"
+        path = getattr(self._inner, "path", None) or getattr(self._inner, "id", None)
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            _record(op, start, 0, 0, 0, e, path=path)
+            raise
+
+        if attr == "stream" or attr == "get_all":
+            return self._traceStream(op, start, result, path)
+        if attr == "commit":
+            writes, size = self._pending
+            self._pending = [0, 0]
+            _record(op, start, 0, writes, size)
+        elif attr in ("set", "create", "update", "add"):
+            _record(op, start, 0, 1, _size(args[0] if args else next(iter(kwargs.values()), None)), path=path)
+        elif attr == "delete":
+            _record(op, start, 0, 1, 0, path=path)
+        elif attr == "get" and self._kind == "document":
+            _record(op, start, 1, 0, _snapshotSize(result), path=path)
+        elif attr == "get":
+            result = list(result)
+            _record(op, start, len(result), 0, sum(map(_snapshotSize, result)), path=path)
+        else:
+            result = list(result)
+            _record(op, start, len(result), 0, 0, path=path)
+        return self._wrap(result)
+
+    def _traceStream(self, op: str, start: float, results, path):
+        reads = size = 0
+        error = None
+        try:
+            for snapshot in results:
+                reads += 1
+                size += _snapshotSize(snapshot)
+                yield snapshot
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _record(op, start, reads, 0, size, error, path=path)
+
+    def _wrap(self, result):
+        if result is self._inner:
+            return self
+        if isinstance(result, list):
+            return [_Traced(r) if _wrappable(r) else r for r in result]
+        if isinstance(result, tuple):
+            return tuple(_Traced(r) if _wrappable(r) else r for r in result)
+        return _Traced(result) if _wrappable(result) else result
+
+class _TracedFirestore:
+    """firestore module whose clients are traced"""
+    def __init__(self, module):
+        self._module = module
+
+    def client(self, *args, **kwargs):
+        return _Traced(self._module.client(*args, **kwargs))
+
+    def __getattr__(self, attr):
+        return getattr(self._module, attr)
+
+class _TracedAuth:
+    """auth module whose functions are traced, classes and exceptions pass through"""
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, attr):
+        value = getattr(self._module, attr)
+        if isinstance(value, type) or not callable(value):
+            return value
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                _record(f"auth.{attr}", start, 0, 0, 0, e)
+                raise
+            count = len(args[0]) if args and isinstance(args[0], (list, tuple)) else 1
+            _record(f"auth.{attr}", start, count if attr.startswith("get") else 0,
+                    count if not attr.startswith(("get", "list")) else 0, 0)
+            return result
+        return call
+
+class TracedBackend:
+    """Wraps a backend so every auth and Firestore call it serves is recorded"""
+    def __init__(self, inner):
+        self._inner = inner
+        self.name = inner.name
+        self.auth = _TracedAuth(inner.auth)
+        self.firestore = _TracedFirestore(inner.firestore)
+
+    def __getattr__(self, attr):
+        return getattr(self._inner, attr)
+
+def traced(backend):
+    """The backend wrapped for tracing, or unchanged when tracing is disabled"""
+    if not enabled() or isinstance(backend, TracedBackend):
+        return backend
+    return TracedBackend(backend)
@@ -0,0 +1,392 @@
+import argparse
+import base64
+import importlib
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime
+from typing import NamedTuple
+import firebase_admin
+from firebase_admin import credentials
+from backend import firestore, usingFake
+from tracing import span
+
+# Portal writes are recorded in a local SQLite write-ahead log before they touch Firebase.
+# An op that fails transiently is retried with exponential backoff by a background loop
+# (and on the next start of the process); one that fails permanently, or runs out of
+# attempts, runs its kind's compensation, e.g. removing an account whose documents could
+# not be written. Handlers must be idempotent since an op may be applied more than once.
+# A running op is leased to the queue running it, which renews the lease while it is alive;
+# other processes sharing the database only take over ops whose lease has run out.
+# A finished op keeps only its state (its payload can hold a whole participant), and
+# done or compensated ops are deleted RETENTION_SECONDS after they finished.
+QUEUE_DB_ENV = "DIGIPREDICT_QUEUE_DB"
+# Next to the code rather than the working directory, so every launch finds the same queue
+DEFAULT_QUEUE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "writequeue.sqlite3")
+LEASE_SECONDS = 120
+RETENTION_SECONDS = 7 * 24 * 3600
+PRUNE_INTERVAL = 3600
+MAX_ATTEMPTS = 8
+BASE_DELAY = 1
+MAX_DELAY = 300
+POLL_INTERVAL = 1
+MAX_WORKERS = 4
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+COMPENSATED = "compensated"
+
+# Errors retrying cannot fix, matched by class name so both backends are covered
+PERMANENT_ERRORS = {"ValueError", "TypeError", "KeyError", "InvalidArgument", "NotFound", "AlreadyExists",
+                    "PermissionDenied", "FailedPrecondition", "UserNotFoundError",
+                    "EmailAlreadyExistsError", "UidAlreadyExistsError", "InvalidArgumentError",
+                    "AlreadyExistsError", "NotFoundError", "PermissionDeniedError", "UnauthenticatedError",
+                    "FailedPreconditionError"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ops (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    module TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    owner TEXT,
+    claimed_until REAL
+);
+CREATE INDEX IF NOT EXISTS ops_due ON ops (status, next_attempt);
+"""
+# Columns added after the first release, for databases created before them
+COLUMNS = {"owner": "TEXT", "claimed_until": "REAL"}
+
+_handlers = {}
+logger = logging.getLogger(__name__)
+
+class QueuedOp(NamedTuple):
+    id: str
+    kind: str
+    status: str
+    attempts: int
+    next_attempt: float
+    last_error: str
+    payload: dict
+    state: dict
+    created: float
+    updated: float
+
+class Deferred(Exception):
+    """Raised to a caller whose write did not finish, the queue keeps retrying it"""
+    def __init__(self, op: QueuedOp):
+        wait = max(0, op.next_attempt - time.time())
+        super().__init__(f"Saved locally and will be retried in {wait:.0f}s "
+                         f"(attempt {op.attempts} of {MAX_ATTEMPTS}): {op.last_error}")
+        self.op = op
+
+def register(kind: str, apply, compensate=None):
+    """Handle ops of a kind with apply(payload, state); compensate(payload, state) undoes a failed one
+
+    Both may record progress in the state dict, which is saved after every attempt.
+    """
+    _handlers[kind] = (apply, compensate, apply.__module__)
+
+def encode(value):
+    """JSON-safe copy of Firestore write values"""
+    if value is firestore.DELETE_FIELD:
+        return {"$delete": True}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, bytes):
+        return {"$bytes": base64.b64encode(value).decode()}
+    if isinstance(value, dict):
+        return {key: encode(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    return value
+
+def decode(value):
+    if isinstance(value, dict):
+        if value.keys() == {"$delete"}:
+            return firestore.DELETE_FIELD
+        if value.keys() == {"$datetime"}:
+            return datetime.fromisoformat(value["$datetime"])
+        if value.keys() == {"$bytes"}:
+            return base64.b64decode(value["$bytes"])
+        return {key: decode(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    return value
+
+def encodeWrites(writes: list) -> list:
+    """(doc_ref, field map, merge) writes as (path, field map, merge)"""
+    return [(ref.path, encode(fields), merge) for ref, fields, merge in writes]
+
+def decodeWrites(db, writes: list) -> list:
+    return [(db.document(path), decode(fields), merge) for path, fields, merge in writes]
+
+def isPermanent(error: Exception) -> bool:
+    return any(cls.__name__ in PERMANENT_ERRORS for cls in type(error).__mro__)
+
+def backoff(attempts: int) -> float:
+    """Seconds before the next attempt, doubling from BASE_DELAY with jitter"""
+    return min(MAX_DELAY, BASE_DELAY * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+def _row(row) -> QueuedOp:
+    return QueuedOp(row["id"], row["kind"], row["status"], row["attempts"], row["next_attempt"],
+                    row["last_error"], json.loads(row["payload"]), json.loads(row["state"]),
+                    row["created"], row["updated"])
+
+class WriteQueue:
+    """SQLite-backed queue of writes, shared by every session of the process"""
+    def __init__(self, path: str, max_workers: int = MAX_WORKERS):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="write-queue")
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._renewed = 0.0
+        self._pruned = 0.0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            existing = {row["name"] for row in conn.execute("PRAGMA table_info(ops)")}
+            for column, kind in COLUMNS.items():
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE ops ADD COLUMN {column} {kind}")
+        self.prune()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, opId: str, **values):
+        values["updated"] = time.time()
+        columns = ", ".join(f"{column} = ?" for column in values)
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE ops SET {columns} WHERE id = ?", (*values.values(), opId))
+
+    def enqueue(self, kind: str, payload: dict, key: str = None, state: dict = None, claimed: bool = False) -> str:
+        """Record an op, returns its id; an op with the same key is reused rather than added twice
+
+        A claimed op is left to the caller to execute, the background loop only takes it over
+        if this process stops before it has run.
+        """
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for {kind!r} writes")
+        opId = key or uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO ops (id, kind, module, payload, state, status, next_attempt, created, updated,"
+                " owner, claimed_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (opId, kind, _handlers[kind][2], json.dumps(encode(payload)), json.dumps(state or {}),
+                 RUNNING if claimed else PENDING, now, now, now,
+                 self.owner if claimed else None, now + LEASE_SECONDS if claimed else None)).rowcount
+        if claimed and not inserted:
+            # An existing op with this key is taken over only if nobody is running it
+            self._claim(opId)
+        return opId
+
+    def get(self, opId: str) -> QueuedOp:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM ops WHERE id = ?", (opId,)).fetchone()
+        return _row(row) if row else None
+
+    def list(self, statuses: tuple = (PENDING, RUNNING, FAILED, COMPENSATED), limit: int = 500) -> list:
+        marks = ", ".join("?" * len(statuses))
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM ops WHERE status IN ({marks}) ORDER BY created DESC LIMIT ?",
+                                (*statuses, limit)).fetchall()
+        return [_row(row) for row in rows]
+
+    def setState(self, opId: str, **state):
+        op = self.get(opId)
+        self._update(opId, state=json.dumps(op.state | state))
+
+    def discard(self, opId: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM ops WHERE id = ?", (opId,))
+
+    def retry(self, opId: str):
+        """Give a failed op a fresh set of attempts"""
+        self._update(opId, status=PENDING, attempts=0, next_attempt=time.time())
+        self._wake.set()
+
+    def _claim(self, opId: str) -> bool:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            claimed = conn.execute(
+                "UPDATE ops SET status = ?, owner = ?, claimed_until = ?, updated = ? WHERE id = ? AND status = ?",
+                (RUNNING, self.owner, now + LEASE_SECONDS, now, opId, PENDING)).rowcount
+        return claimed == 1
+
+    def renewLeases(self):
+        """Extend the leases of the ops this queue is running"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE ops SET claimed_until = ? WHERE owner = ? AND status = ?",
+                         (now + LEASE_SECONDS, self.owner, RUNNING))
+        self._renewed = now
+
+    def prune(self, retention: float = RETENTION_SECONDS) -> int:
+        """Delete done and compensated ops finished more than `retention` seconds ago, returns how many"""
+        self._pruned = time.time()
+        with closing(self._connect()) as conn:
+            return conn.execute("DELETE FROM ops WHERE status IN (?, ?) AND updated < ?",
+                                (DONE, COMPENSATED, self._pruned - retention)).rowcount
+
+    def reclaimExpired(self) -> int:
+        """Return ops whose runner stopped renewing their lease to pending, returns how many"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "UPDATE ops SET status = ?, owner = NULL, claimed_until = NULL, next_attempt = ?, updated = ?"
+                " WHERE status = ? AND COALESCE(claimed_until, 0) < ?", (PENDING, now, now, RUNNING, now)).rowcount
+
+    def execute(self, opId: str, claimed: bool = False) -> QueuedOp:
+        """Run one attempt of a pending op in this thread, returns the op as it was left"""
+        if not claimed and not self._claim(opId):
+            return self.get(opId)
+        op = self.get(opId)
+        if op.kind not in _handlers:
+            self._update(opId, status=PENDING)
+            return self.get(opId)
+        apply, compensate, _ = _handlers[op.kind]
+        payload, state = decode(op.payload), dict(op.state)
+        attempts = op.attempts + 1
+        try:
+            with span(f"write queue: {op.kind}", op=opId, attempt=attempts):
+                apply(payload, state)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            if not isPermanent(e) and attempts < MAX_ATTEMPTS:
+                self._update(opId, status=PENDING, attempts=attempts, last_error=error,
+                             state=json.dumps(state), next_attempt=time.time() + backoff(attempts))
+                return self.get(opId)
+            status = FAILED
+            if compensate is not None:
+                try:
+                    compensate(payload, state)
+                    status = COMPENSATED
+                except Exception as c:
+                    error = f"{error}; compensation failed: {c}"
+            self._update(opId, status=status, attempts=attempts, last_error=error, state=json.dumps(state))
+            return self.get(opId)
+        self._update(opId, status=DONE, attempts=attempts, last_error=None, state=json.dumps(state), payload="{}")
+        return self.get(opId)
+
+    def submit(self, kind: str, payload: dict, key: str = None, state: dict = None) -> QueuedOp:
+        """Enqueue an op and make its first attempt right away
+
+        The op is claimed as it is recorded so the background loop cannot start it first.
+        """
+        opId = self.enqueue(kind, payload, key, state, claimed=True)
+        return self.execute(opId, claimed=self._owns(opId))
+
+    def _owns(self, opId: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT 1 FROM ops WHERE id = ? AND status = ? AND owner = ?",
+                               (opId, RUNNING, self.owner)).fetchone()
+        return row is not None
+
+    def due(self, everything: bool = False) -> list:
+        """Ids of pending ops whose backoff has passed, oldest first"""
+        self.reclaimExpired()
+        query = "SELECT id, module FROM ops WHERE status = ?"
+        args = [PENDING]
+        if not everything:
+            query += " AND next_attempt <= ?"
+            args.append(time.time())
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query + " ORDER BY next_attempt", args).fetchall()
+        for module in {row["module"] for row in rows}:
+            # Handlers live in the page modules, which are only imported when first opened
+            importlib.import_module(module)
+        return [row["id"] for row in rows]
+
+    def _dispatch(self, opId: str):
+        try:
+            self.execute(opId)
+        finally:
+            with self._lock:
+                self._inflight.discard(opId)
+
+    def _loop(self):
+        while True:
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                if time.time() - self._renewed > LEASE_SECONDS / 3:
+                    self.renewLeases()
+                if time.time() - self._pruned > PRUNE_INTERVAL:
+                    self.prune()
+                due = self.due()
+            except Exception:
+                logger.exception("Write queue poll failed")
+                continue
+            with self._lock:
+                due = [opId for opId in due if opId not in self._inflight]
+                self._inflight.update(due)
+            for opId in due:
+                self.executor.submit(self._dispatch, opId)
+
+    def start(self):
+        """Start retrying due ops in the background, once per process"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="write-queue", daemon=True)
+                self._thread.start()
+
+_queue = None
+_queueLock = threading.Lock()
+
+def writeQueue() -> WriteQueue:
+    """The process-wide queue, retrying in the background from its first use"""
+    global _queue
+    with _queueLock:
+        if _queue is None:
+            _queue = WriteQueue(os.environ.get(QUEUE_DB_ENV, DEFAULT_QUEUE_DB))
+            _queue.start()
+        return _queue
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the pending writes of the local write queue")
+    parser.add_argument("--credentials", help="Firebase service account JSON")
+    parser.add_argument("--db", default=os.environ.get(QUEUE_DB_ENV, DEFAULT_QUEUE_DB), help="Queue database")
+    args = parser.parse_args(argv)
+
+    if not usingFake() and not firebase_admin._apps:
+        if not args.credentials:
+            parser.error("--credentials is required unless DIGIPREDICT_BACKEND=fake")
+        firebase_admin.initialize_app(credentials.Certificate(args.credentials))
+
+    queue = WriteQueue(args.db)
+    failed = 0
+    for opId in queue.due(everything=True):
+        op = queue.execute(opId)
+        print(f"{op.id} {op.kind}: {op.status}" + (f" ({op.last_error})" if op.last_error else ""))
+        failed += op.status != DONE
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    # Handlers register with the importable module rather than __main__
+    import writequeue
+    sys.exit(writequeue.cli())